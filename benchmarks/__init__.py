@@ -0,0 +1 @@
+"""Load-test harness for the TaskFlow services (``python -m benchmarks --help``)."""
@@ -0,0 +1,194 @@
+"""
+Load tests for the TaskFlow services.
+
+Run from the repository root with the requirements of the service under
+test installed. Seeding writes a manifest to the state directory, a run
+reads it, prints per-operation throughput and p50/p95/p99, saves the
+report and optionally compares it with a stored baseline (exit status 1 on
+regression).
+
+Tasks service, in process against SQLite (or DATABASE_URL=postgres://...):
+    python -m benchmarks seed tasks --users 4 --tasks 10000:100000 --comments 0.2
+    python -m benchmarks run tasks --concurrency 8 --duration 30 --save-baseline tasks-sqlite
+    python -m benchmarks run tasks --concurrency 8 --duration 30 --baseline tasks-sqlite
+
+Tasks service over HTTP (seed with the same DATABASE_URL as the server). The
+service must be able to identify the caller; pass whatever it needs with
+--header:
+    python -m benchmarks run tasks --transport http --base-url http://localhost:8002 \\
+        --header 'Authorization: Bearer ...' --rate 200 --concurrency 32
+
+Auth service (HTTP only) login and token refresh:
+    python -m benchmarks seed auth --base-url http://localhost:8001 --users 50
+    python -m benchmarks run auth --transport http --base-url http://localhost:8001
+
+Notifications API and worker ingestion, with fakeredis or local Redis:
+    python -m benchmarks run notifications --redis-url memory --seed --users 1000 --backlog 100
+    python -m benchmarks run worker --redis-url memory --seed --users 1000
+    python -m benchmarks run worker --transport amqp --rabbitmq-url amqp://localhost:5672 --messages 50000
+
+Compare two saved reports:
+    python -m benchmarks compare .bench/results/tasks-latest.json benchmarks/baselines/tasks-sqlite.json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from . import runner, scenarios
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def _parse_mix(value, service):
+    mix = dict(scenarios.DEFAULT_MIXES[service])
+    for item in filter(None, (value or '').split(',')):
+        name, weight = item.split('=')
+        if name not in mix:
+            raise SystemExit(f"Unknown operation {name!r} for {service}; choose from {', '.join(mix)}")
+        mix[name] = int(weight)
+    return mix
+
+
+def _parse_headers(values):
+    headers = {}
+    for value in values or []:
+        name, _, header_value = value.partition(':')
+        headers[name.strip()] = header_value.strip()
+    return headers
+
+
+def _manifest_path(args):
+    return os.path.join(args.state_dir, f"{args.service}-seed.json")
+
+
+def seed(args):
+    if args.service == 'tasks':
+        low, _, high = args.tasks.partition(':')
+        manifest = scenarios.seed_tasks(args.users, int(low), int(high or low), args.comments, args.first_user_id)
+    elif args.service == 'auth':
+        manifest = scenarios.seed_auth(args.base_url, args.users)
+    else:
+        store = scenarios.notification_store(args.redis_url)
+        manifest = scenarios.seed_notifications(store, args.users, args.backlog, args.first_user_id)
+    scenarios.save_manifest(manifest, _manifest_path(args))
+    return manifest
+
+
+def run(args):
+    service = args.service
+    headers = _parse_headers(args.header)
+    mix = _parse_mix(args.mix, service)
+
+    if service in ('notifications', 'worker'):
+        store = None if args.transport in ('http', 'amqp') else scenarios.notification_store(args.redis_url)
+        if args.seed:
+            store = store or scenarios.notification_store(args.redis_url)
+            manifest = scenarios.seed_notifications(store, args.users, args.backlog, args.first_user_id)
+        else:
+            manifest = scenarios.load_manifest(os.path.join(args.state_dir, 'notifications-seed.json'))
+    else:
+        manifest = seed(args) if args.seed else scenarios.load_manifest(_manifest_path(args))
+
+    if service == 'worker' and args.transport == 'amqp':
+        result = scenarios.amqp_ingestion(args.rabbitmq_url, manifest, args.messages)
+        print(json.dumps(result, indent=2))
+        return 0
+
+    if service == 'tasks':
+        transport = scenarios.tasks_transport(args.transport, args.base_url)
+        operations = scenarios.tasks_operations(transport, manifest, mix, headers)
+    elif service == 'auth':
+        if args.transport != 'http':
+            raise SystemExit("The auth scenario needs --transport http and a running auth service")
+        operations = scenarios.auth_operations(scenarios.HTTPTransport(args.base_url), manifest, mix, headers)
+    elif service == 'notifications':
+        transport = scenarios.notifications_transport(args.transport, args.base_url, store)
+        operations = scenarios.notifications_operations(transport, manifest, mix, headers)
+    else:
+        operations = scenarios.worker_operations(store, manifest, mix)
+
+    report = runner.run_load(operations, args.duration, args.concurrency, args.rate, args.warmup)
+    report.update({'service': service, 'transport': args.transport, 'mix': mix})
+    runner.print_report(report)
+    runner.save_report(report, os.path.join(args.state_dir, 'results', f"{service}-latest.json"))
+
+    if args.save_baseline:
+        runner.save_report(report, os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"))
+    if args.baseline:
+        with open(os.path.join(BASELINE_DIR, f"{args.baseline}.json")) as f:
+            return _report_regressions(runner.compare(report, json.load(f), args.tolerance))
+    return 0
+
+
+def compare(args):
+    with open(args.report) as f:
+        report = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    return _report_regressions(runner.compare(report, baseline, args.tolerance))
+
+
+def _report_regressions(regressions):
+    if not regressions:
+        print("No regressions against baseline")
+        return 0
+    print("Regressions against baseline:")
+    for line in regressions:
+        print(f"  {line}")
+    return 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--state-dir', default='.bench', help='Seed manifests and latest results')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_seed_options(command):
+        command.add_argument('--users', type=int, default=4)
+        command.add_argument('--first-user-id', type=int, default=900001)
+        command.add_argument('--tasks', default='10000:100000', help='Tasks per user, MIN:MAX')
+        command.add_argument('--comments', type=float, default=0.2, help='Comments per task')
+        command.add_argument('--backlog', type=int, default=100, help='Notifications per user')
+        command.add_argument('--redis-url', default='redis://localhost:6379',
+                             help="Comma-separated shard URLs, or 'memory' for fakeredis")
+        command.add_argument('--base-url')
+
+    seed_command = commands.add_parser('seed', help='Load benchmark data')
+    seed_command.add_argument('service', choices=['tasks', 'auth', 'notifications'])
+    add_seed_options(seed_command)
+    seed_command.set_defaults(func=seed)
+
+    run_command = commands.add_parser('run', help='Run a load test')
+    run_command.add_argument('service', choices=['tasks', 'auth', 'notifications', 'worker'])
+    add_seed_options(run_command)
+    run_command.add_argument('--seed', action='store_true', help='Seed before running (needed for memory)')
+    run_command.add_argument('--transport', default='inprocess', choices=['inprocess', 'http', 'amqp'])
+    run_command.add_argument('--rabbitmq-url', default='amqp://localhost:5672')
+    run_command.add_argument('--messages', type=int, default=10000, help='AMQP ingestion messages')
+    run_command.add_argument('--concurrency', type=int, default=8)
+    run_command.add_argument('--rate', type=float, help='Open-loop arrival rate (req/s); default closed loop')
+    run_command.add_argument('--duration', type=float, default=30.0)
+    run_command.add_argument('--warmup', type=float, default=5.0)
+    run_command.add_argument('--mix', help='Operation weights, e.g. list=50,detail=50')
+    run_command.add_argument('--header', action='append', help="Extra request header 'Name: value'")
+    run_command.add_argument('--baseline', help='Compare with benchmarks/baselines/<name>.json')
+    run_command.add_argument('--save-baseline', help='Store this run as benchmarks/baselines/<name>.json')
+    run_command.add_argument('--tolerance', type=float, default=0.10)
+    run_command.set_defaults(func=run)
+
+    compare_command = commands.add_parser('compare', help='Compare a saved report with a baseline')
+    compare_command.add_argument('report')
+    compare_command.add_argument('baseline')
+    compare_command.add_argument('--tolerance', type=float, default=0.10)
+    compare_command.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    result = args.func(args)
+    return result if isinstance(result, int) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Load generation, latency statistics and baseline comparison.
+
+Two concurrency models are supported:
+
+- closed loop (``rate=None``): ``concurrency`` threads each issue the next
+  request as soon as the previous one returns
+- open loop (``rate`` requests/second): requests are scheduled at a fixed
+  arrival rate and served by ``concurrency`` threads. Latency is measured
+  from the scheduled start, so a stalled server shows up as queueing delay
+  instead of silently lowering the offered load.
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+Operation = Tuple[str, int, Callable[[random.Random], int]]
+
+
+class Recorder:
+    """Thread-safe per-operation latency and error collection."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    index = max(math.ceil(pct / 100 * len(values)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def _pick(operations: Sequence[Operation], rng: random.Random) -> Operation:
+    total = sum(weight for _, weight, _ in operations)
+    point = rng.uniform(0, total)
+    for operation in operations:
+        point -= operation[1]
+        if point <= 0:
+            return operation
+    return operations[-1]
+
+
+def _call(operation: Operation, rng: random.Random, recorder: Recorder, start: float):
+    name, _, func = operation
+    try:
+        status = func(rng)
+        ok = status < 400
+    except Exception:
+        ok = False
+    recorder.record(name, time.perf_counter() - start, ok)
+
+
+def run_load(operations: Sequence[Operation], duration: float, concurrency: int,
+             rate: Optional[float] = None, warmup: float = 0.0, seed: int = 0) -> dict:
+    """Drive the weighted operation mix and return a report dict."""
+    operations = [op for op in operations if op[1] > 0]
+    if warmup:
+        _drive(operations, warmup, concurrency, rate, Recorder(), seed + 1)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    _drive(operations, duration, concurrency, rate, recorder, seed)
+    return summarize(recorder, time.perf_counter() - started, concurrency, rate)
+
+
+def _drive(operations, duration, concurrency, rate, recorder, seed):
+    deadline = time.perf_counter() + duration
+    schedule_lock = threading.Lock()
+    next_slot = [time.perf_counter()]
+
+    def closed_loop(rng):
+        while time.perf_counter() < deadline:
+            _call(_pick(operations, rng), rng, recorder, time.perf_counter())
+
+    def open_loop(rng):
+        interval = 1.0 / rate
+        while True:
+            with schedule_lock:
+                scheduled = next_slot[0]
+                next_slot[0] += interval
+            if scheduled >= deadline:
+                return
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            _call(_pick(operations, rng), rng, recorder, scheduled)
+
+    target = open_loop if rate else closed_loop
+    threads = [
+        threading.Thread(target=target, args=(random.Random(seed * 1000 + i),), daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def summarize(recorder: Recorder, elapsed: float, concurrency: int, rate: Optional[float]) -> dict:
+    operations = {}
+    all_latencies: List[float] = []
+    for name, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        all_latencies.extend(latencies)
+        operations[name] = _stats(latencies, recorder.errors.get(name, 0), elapsed)
+    all_latencies.sort()
+    return {
+        'elapsed': round(elapsed, 3),
+        'concurrency': concurrency,
+        'rate': rate,
+        'total': _stats(all_latencies, sum(recorder.errors.values()), elapsed),
+        'operations': operations,
+    }
+
+
+def _stats(latencies: List[float], errors: int, elapsed: float) -> dict:
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def print_report(report: dict):
+    print(f"{'operation':<18}{'requests':>10}{'errors':>8}{'req/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = list(report['operations'].items()) + [('TOTAL', report['total'])]
+    for name, stats in rows:
+        print(f"{name:<18}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>10.1f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+
+def save_report(report: dict, path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions against a baseline: p95/p99 up or throughput down by more than `tolerance`."""
+    regressions = []
+    for name, stats in list(report['operations'].items()) + [('TOTAL', report['total'])]:
+        base = baseline['total'] if name == 'TOTAL' else baseline['operations'].get(name)
+        if not base:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            if base[metric] and stats[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {base[metric]:.2f} -> {stats[metric]:.2f}")
+        if base['throughput'] and stats['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name} throughput: {base['throughput']:.1f} -> {stats['throughput']:.1f}")
+        if stats['errors'] > base['errors']:
+            regressions.append(f"{name} errors: {base['errors']} -> {stats['errors']}")
+    return regressions
@@ -0,0 +1,286 @@
+"""
+Seeding and request mixes for each service.
+
+Seeding writes a manifest (user ids, task id ranges, credentials) that the
+matching run reads, so an HTTP run against a separately started service
+uses the same data as the seed step that filled its database.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from typing import Dict, List
+
+from .runner import Operation
+from .transports import ASGITransport, DjangoTransport, HTTPTransport, SERVICES_DIR
+
+PRIORITIES = ['low', 'medium', 'high', 'urgent']
+STATUSES = ['todo', 'in_progress', 'review', 'done', 'cancelled']
+
+DEFAULT_MIXES = {
+    'tasks': {'list': 40, 'detail': 40, 'stats': 15, 'bulk_update': 5},
+    'auth': {'login': 20, 'refresh': 80},
+    'notifications': {'get': 50, 'since': 30, 'mark_read': 20},
+    'worker': {'ingest': 100},
+}
+
+
+def tasks_transport(kind: str, base_url: str = None):
+    if kind == 'http':
+        return HTTPTransport(base_url)
+    return DjangoTransport('tasks_service', 'tasks_service.settings', _tasks_overrides)
+
+
+def _tasks_overrides(settings):
+    rest_framework = dict(settings.REST_FRAMEWORK)
+    rest_framework['DEFAULT_AUTHENTICATION_CLASSES'] = ['benchmarks.stand_ins.HeaderUserAuthentication']
+    return {'REST_FRAMEWORK': rest_framework, 'DEBUG': False}
+
+
+# Tasks service
+
+def seed_tasks(users: int, min_tasks: int, max_tasks: int, comments_per_task: float,
+               first_user_id: int, batch_size: int = 5000) -> dict:
+    """Bulk insert tasks and comments through the tasks service ORM."""
+    tasks_transport('inprocess')
+    from django.core.management import call_command
+    from django.db.models import Max, Min
+    from django.utils import timezone
+    from tasks.models import Task, TaskComment
+
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    rng = random.Random(42)
+    now = timezone.now()
+    manifest_users = []
+    for index in range(users):
+        user_id = first_user_id + index
+        # Spread users evenly across the requested size range
+        count = min_tasks + (max_tasks - min_tasks) * index // max(users - 1, 1)
+        started = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            Task.objects.bulk_create([
+                Task(
+                    title=f"Task {offset + i} for user {user_id}",
+                    description='Seeded task ' * rng.randint(1, 20),
+                    user_id=user_id,
+                    priority=rng.choice(PRIORITIES),
+                    status=rng.choice(STATUSES),
+                    due_date=now + timedelta(days=rng.randint(-30, 90)) if rng.random() < 0.6 else None,
+                )
+                for i in range(min(batch_size, count - offset))
+            ])
+        bounds = Task.objects.filter(user_id=user_id).aggregate(first=Min('id'), last=Max('id'))
+
+        task_ids = list(range(bounds['first'], bounds['last'] + 1))
+        comment_tasks = rng.sample(task_ids, int(len(task_ids) * min(comments_per_task, 1.0)))
+        for offset in range(0, len(comment_tasks), batch_size):
+            TaskComment.objects.bulk_create([
+                TaskComment(task_id=task_id, user_id=user_id, content='Seeded comment')
+                for task_id in comment_tasks[offset:offset + batch_size]
+            ])
+        print(f"user {user_id}: {count} tasks, {len(comment_tasks)} comments "
+              f"in {time.perf_counter() - started:.1f}s")
+        manifest_users.append({'id': user_id, 'tasks': count, **bounds})
+    return {'service': 'tasks', 'users': manifest_users}
+
+
+def tasks_operations(transport, manifest: dict, mix: Dict[str, int], headers: Dict[str, str]) -> List[Operation]:
+    users = manifest['users']
+
+    def pick(rng):
+        user = rng.choice(users)
+        return user, dict(headers, **{'X-Bench-User': str(user['id'])})
+
+    def task_list(rng):
+        user, h = pick(rng)
+        return transport.request('GET', f"/api/tasks/?page={rng.randint(1, 5)}", headers=h)[0]
+
+    def detail(rng):
+        user, h = pick(rng)
+        return transport.request('GET', f"/api/tasks/{rng.randint(user['first'], user['last'])}/", headers=h)[0]
+
+    def stats(rng):
+        user, h = pick(rng)
+        return transport.request('GET', '/api/tasks/stats/', headers=h)[0]
+
+    def bulk_update(rng):
+        user, h = pick(rng)
+        task_ids = [rng.randint(user['first'], user['last']) for _ in range(50)]
+        body = {'task_ids': task_ids, 'updates': {'priority': rng.choice(PRIORITIES)}}
+        return transport.request('POST', '/api/tasks/bulk-update/', body, headers=h)[0]
+
+    funcs = {'list': task_list, 'detail': detail, 'stats': stats, 'bulk_update': bulk_update}
+    return [(name, weight, funcs[name]) for name, weight in mix.items()]
+
+
+# Auth service (HTTP only: the service needs its own database and JWT settings)
+
+def seed_auth(base_url: str, users: int, password: str = 'bench-pass-123') -> dict:
+    transport = HTTPTransport(base_url)
+    credentials = []
+    for index in range(users):
+        email = f"bench{index}@example.com"
+        status, _ = transport.request('POST', '/api/auth/register/', {
+            'username': f"bench{index}",
+            'email': email,
+            'first_name': 'Bench',
+            'last_name': str(index),
+            'password': password,
+            'password_confirm': password,
+        })
+        if status not in (201, 400):  # 400: already registered by an earlier seed
+            raise RuntimeError(f"Registering {email} failed with HTTP {status}")
+        credentials.append({'email': email, 'password': password})
+    return {'service': 'auth', 'users': credentials}
+
+
+def auth_operations(transport, manifest: dict, mix: Dict[str, int], headers: Dict[str, str]) -> List[Operation]:
+    users = manifest['users']
+    tokens = threading.local()
+
+    def login(rng):
+        status, body = transport.request('POST', '/api/auth/login/', rng.choice(users), headers=headers)
+        if status == 200:
+            tokens.refresh = body['tokens']['refresh']
+        return status
+
+    def refresh(rng):
+        # Each thread rotates its own refresh token; the first call logs in
+        if not getattr(tokens, 'refresh', None):
+            return login(rng)
+        status, body = transport.request('POST', '/api/auth/token/refresh/',
+                                         {'refresh': tokens.refresh}, headers=headers)
+        tokens.refresh = body.get('refresh', tokens.refresh) if status == 200 else None
+        return status
+
+    funcs = {'login': login, 'refresh': refresh}
+    return [(name, weight, funcs[name]) for name, weight in mix.items()]
+
+
+# Notifications service
+
+def notification_store(redis_url: str):
+    """Store over local Redis, or over fakeredis for ``memory``."""
+    import sys
+    sys.path.insert(0, os.path.join(SERVICES_DIR, 'notifications_service'))
+    from worker import NotificationStore, ShardedNotificationStore
+
+    if redis_url == 'memory':
+        import fakeredis
+        return NotificationStore(fakeredis.FakeRedis())
+    return ShardedNotificationStore(redis_url.split(','))
+
+
+def seed_notifications(store, users: int, backlog: int, first_user_id: int, batch_users: int = 200) -> dict:
+    started = time.perf_counter()
+    for offset in range(0, users, batch_users):
+        store.push_many({
+            user_id: [
+                {'title': 'Seeded', 'message': f"Notification {i}", 'type': 'info',
+                 'event_type': 'task_updated', 'read': False}
+                for i in range(backlog)
+            ]
+            for user_id in range(first_user_id + offset, first_user_id + min(offset + batch_users, users))
+        })
+    print(f"{users} users x {backlog} notifications in {time.perf_counter() - started:.1f}s")
+    return {'service': 'notifications', 'users': list(range(first_user_id, first_user_id + users)),
+            'backlog': backlog}
+
+
+def notifications_transport(kind: str, base_url: str, store):
+    if kind == 'http':
+        return HTTPTransport(base_url)
+    transport = ASGITransport()
+    transport.module.notification_store = store
+    return transport
+
+
+def notifications_operations(transport, manifest: dict, mix: Dict[str, int],
+                             headers: Dict[str, str]) -> List[Operation]:
+    users, backlog = manifest['users'], manifest['backlog']
+
+    def get(rng):
+        return transport.request('GET', f"/notifications/{rng.choice(users)}?limit=20", headers=headers)[0]
+
+    def since(rng):
+        since_id = rng.randint(0, backlog)
+        return transport.request('GET', f"/notifications/{rng.choice(users)}?since={since_id}&limit=50",
+                                 headers=headers)[0]
+
+    def mark_read(rng):
+        ids = [str(rng.randint(1, backlog)) for _ in range(10)]
+        return transport.request('POST', f"/notifications/{rng.choice(users)}/mark-read", ids,
+                                 headers=headers)[0]
+
+    funcs = {'get': get, 'since': since, 'mark_read': mark_read}
+    return [(name, weight, funcs[name]) for name, weight in mix.items()]
+
+
+def worker_operations(store, manifest: dict, mix: Dict[str, int]) -> List[Operation]:
+    """Feed task events straight into NotificationWorker._on_message (RabbitMQ stand-in)."""
+    from worker.events import BINARY_CONTENT_TYPE, encode_task_event
+    from worker.notification_worker import NotificationWorker
+
+    worker = NotificationWorker(None, SimpleNamespace(call_later=lambda *a: None), store=store)
+    lock = threading.Lock()  # The worker runs on one consumer thread in production
+    channel = SimpleNamespace(basic_ack=lambda tag: None, is_open=False)
+    # Coalesced messages are acked through the worker's channel once stored
+    worker.channel = channel
+    method = SimpleNamespace(delivery_tag=1)
+    users = manifest['users']
+
+    def ingest(rng):
+        body = encode_task_event(rng.choice(['task_created', 'task_updated', 'task_completed']), {
+            'id': rng.randint(1, 10 ** 6), 'user_id': rng.choice(users), 'title': 'Bench task',
+        })
+        properties = SimpleNamespace(content_type=BINARY_CONTENT_TYPE, timestamp=None,
+                                     headers={'x-published-at': time.time()})
+        with lock:
+            worker._on_message('task_events', channel, method, properties, body)
+            if len(worker.coalescer) >= 1000:
+                worker._flush_pending()
+        return 200
+
+    return [('ingest', mix.get('ingest', 100), ingest)]
+
+
+def amqp_ingestion(rabbitmq_url: str, manifest: dict, messages: int) -> dict:
+    """Publish task events to a running worker and time until the queue drains."""
+    import pika
+    from worker.events import BINARY_CONTENT_TYPE, encode_task_event
+
+    connection = pika.BlockingConnection(pika.URLParameters(rabbitmq_url))
+    channel = connection.channel()
+    rng = random.Random(0)
+    users = manifest['users']
+
+    started = time.perf_counter()
+    for i in range(messages):
+        channel.basic_publish(
+            exchange='', routing_key='task_events',
+            body=encode_task_event('task_updated', {'id': i, 'user_id': rng.choice(users), 'title': 'Bench'}),
+            properties=pika.BasicProperties(content_type=BINARY_CONTENT_TYPE, delivery_mode=2,
+                                            headers={'x-published-at': time.time()}),
+        )
+    published = time.perf_counter() - started
+    while channel.queue_declare(queue='task_events', passive=True).method.message_count:
+        time.sleep(0.05)
+    drained = time.perf_counter() - started
+    connection.close()
+    return {'messages': messages, 'publish_s': round(published, 3), 'drain_s': round(drained, 3),
+            'throughput': round(messages / drained, 1)}
+
+
+def load_manifest(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f)
@@ -0,0 +1,27 @@
+"""
+In-process stand-ins used when a service runs inside the benchmark process.
+
+The tasks service expects the caller's identity as ``request.user_id``,
+which the gateway is meant to provide. In-process runs use
+``HeaderUserAuthentication`` instead: it trusts an ``X-Bench-User`` header.
+Never enable it in a deployed service.
+"""
+
+from rest_framework.authentication import BaseAuthentication
+
+
+class BenchUser:
+    is_authenticated = True
+    is_active = True
+
+    def __init__(self, user_id: int):
+        self.id = self.pk = user_id
+
+
+class HeaderUserAuthentication(BaseAuthentication):
+    def authenticate(self, request):
+        user_id = request.META.get('HTTP_X_BENCH_USER')
+        if not user_id:
+            return None
+        request._request.user_id = int(user_id)
+        return BenchUser(int(user_id)), None
@@ -0,0 +1,131 @@
+"""
+Ways of sending requests to a service.
+
+Every transport exposes ``request(method, path, body=None, headers=None)``
+returning ``(status, parsed JSON body or None)`` and is safe to call from
+many threads.
+
+- ``HTTPTransport``: real HTTP/1.1 with one keep-alive connection per thread
+- ``DjangoTransport``: the Django test client against the service's own
+  settings, in this process
+- ``ASGITransport``: the FastAPI app through Starlette's test client, in
+  this process, without running its lifespan (the caller wires up stores)
+"""
+
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+SERVICES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'services')
+
+
+def _decode(content_type: str, body: bytes):
+    if body and 'json' in (content_type or ''):
+        return json.loads(body)
+    return None
+
+
+class HTTPTransport:
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.secure = parts.scheme == 'https'
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            cls = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            connection = self._local.connection = cls(self.host, self.port, timeout=self.timeout)
+        return connection
+
+    def request(self, method: str, path: str, body: Any = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, Any]:
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        connection = self._connection()
+        try:
+            connection.request(method, self.prefix + path, body=payload, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # Drop the broken keep-alive connection; the next call reconnects
+            connection.close()
+            self._local.connection = None
+            raise
+        return response.status, _decode(response.getheader('Content-Type'), data)
+
+
+class DjangoTransport:
+    """In-process Django test client for a service under services/<service_dir>."""
+
+    def __init__(self, service_dir: str, settings_module: str, settings_overrides=None):
+        sys.path.insert(0, os.path.join(SERVICES_DIR, service_dir))
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+        import django
+        from django.conf import settings
+        from django.test.utils import override_settings, setup_test_environment
+
+        django.setup()
+        if not hasattr(DjangoTransport, '_environment_ready'):
+            setup_test_environment()
+            DjangoTransport._environment_ready = True
+        if settings_overrides:
+            # A callable, so overrides can be derived from the service's own settings
+            override_settings(**settings_overrides(settings)).enable()
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            from django.test import Client
+            client = self._local.client = Client()
+        return client
+
+    def request(self, method: str, path: str, body: Any = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, Any]:
+        extra = {f"HTTP_{k.upper().replace('-', '_')}": v for k, v in (headers or {}).items()}
+        kwargs = {}
+        if body is not None:
+            kwargs = {'data': json.dumps(body), 'content_type': 'application/json'}
+        response = getattr(self._client(), method.lower())(path, **kwargs, **extra)
+        content = b'' if response.streaming else response.content
+        return response.status_code, _decode(response.get('Content-Type'), content)
+
+
+class ASGITransport:
+    """In-process test client for the notifications FastAPI app."""
+
+    def __init__(self):
+        sys.path.insert(0, os.path.join(SERVICES_DIR, 'notifications_service'))
+        import app as notifications_app
+
+        self.module = notifications_app
+        # The app configures INFO logging; keep httpx from logging every request
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            from fastapi.testclient import TestClient
+            # Not used as a context manager, so the lifespan (RabbitMQ, worker) never starts
+            client = self._local.client = TestClient(self.module.app)
+        return client
+
+    def request(self, method: str, path: str, body: Any = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, Any]:
+        response = self._client().request(method, path, json=body, headers=headers)
+        return response.status_code, _decode(response.headers.get('content-type'), response.content)
@@ -0,0 +1,9 @@
+"""
+Code shared by the TaskFlow services.
+
+Installed into each service image (see the service Dockerfiles); for local
+development run ``pip install -e packages/taskflow_common`` from the
+repository root. ``events`` and ``tracing`` don't import a framework or a
+service's settings: services pass their configuration in. ``profiling`` and
+``warmup`` are for the Django services and read ``django.conf.settings``.
+"""
@@ -0,0 +1,235 @@
+"""
+Versioned schema for messages on the ``task_events`` and ``notification_events`` queues.
+
+Two encodings are accepted, selected by the message ``content_type``:
+
+- ``application/x-taskflow-event``: compact binary. A 4-byte header (magic
+  ``TF``, schema version, message kind) is followed by a fixed struct of
+  numeric fields and length-prefixed UTF-8 strings. Fields without a slot
+  travel in a trailing JSON ``extra`` object, so producers can add fields
+  without a schema bump.
+- ``application/json`` (or no content type): the original JSON documents,
+  with an optional ``version`` key that defaults to 1.
+
+Both decode to the same dicts the handlers always worked with, so the format
+can be switched per producer without a flag day. Readers reject versions
+newer than ``SCHEMA_VERSION``; bump it only for changes old readers cannot
+skip. Both services import this module, so producers and consumers can't
+drift apart.
+
+Task event, version 1 (big-endian, after the header)::
+
+    u8  event type code (0: name follows)    u64 task id
+    u64 user id                              i64 due date, epoch ms (NO_DATE if unset)
+    u8  event name length                    u16 title length
+    u32 extra length                         name, title, extra bytes
+
+Notification event, version 1::
+
+    u64 user id                              u8  level code
+    u16 title length                         u16 message length
+    u32 extra length                         title, message, extra bytes
+
+Encoders raise ``ValueError`` for strings too long for their length field
+(e.g. a notification message over 65535 bytes). Decoders raise
+``InvalidEvent`` for any body that doesn't parse, including one shorter
+than its lengths say, so consumers dead-letter it instead of retrying.
+"""
+
+import json
+import struct
+from datetime import datetime, timezone
+from typing import Dict, Any, Tuple
+
+BINARY_CONTENT_TYPE = 'application/x-taskflow-event'
+JSON_CONTENT_TYPE = 'application/json'
+SCHEMA_VERSION = 1
+
+MAGIC = b'TF'
+KIND_TASK = 1
+KIND_NOTIFICATION = 2
+NO_DATE = -(1 << 63)
+
+HEADER = struct.Struct('>2sBB')
+TASK_V1 = struct.Struct('>BQQqBHI')
+NOTIFICATION_V1 = struct.Struct('>QBHHI')
+# Length field sizes, for checking strings fit before encoding
+U8, U16, U32 = struct.Struct('>B'), struct.Struct('>H'), struct.Struct('>I')
+
+# Append-only: codes are part of the wire format
+EVENT_TYPE_CODES = {
+    'task_created': 1,
+    'task_updated': 2,
+    'task_completed': 3,
+    'task_due_soon': 4,
+    'task_overdue': 5,
+    'comment_added': 6,
+}
+EVENT_TYPE_NAMES = {code: name for name, code in EVENT_TYPE_CODES.items()}
+
+LEVEL_CODES = {'info': 1, 'success': 2, 'warning': 3, 'error': 4}
+LEVEL_NAMES = {code: name for name, code in LEVEL_CODES.items()}
+
+# Task fields with a dedicated slot; everything else goes into `extra`
+TASK_FIELDS = ('id', 'user_id', 'title', 'task_title', 'due_date')
+NOTIFICATION_FIELDS = ('title', 'message', 'type')
+
+
+class InvalidEvent(ValueError):
+    """Raised for payloads that can never be processed; they go straight to the dead-letter queue."""
+
+
+def _to_epoch_ms(value) -> int:
+    if not value:
+        return NO_DATE
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp() * 1000)
+
+
+def _extra(source: Dict[str, Any], known) -> bytes:
+    extra = {k: v for k, v in source.items() if k not in known}
+    return json.dumps(extra, separators=(',', ':'), default=str).encode() if extra else b''
+
+
+def _sized(field: str, value: bytes, size: struct.Struct) -> bytes:
+    limit = (1 << (8 * size.size)) - 1
+    if len(value) > limit:
+        raise ValueError(f"Event {field} is {len(value)} bytes; the binary format allows {limit}")
+    return value
+
+
+def _take(view: memoryview, offset: int, length: int) -> memoryview:
+    if offset + length > len(view):
+        raise InvalidEvent(f"Truncated event: {length} bytes at offset {offset}, body is {len(view)}")
+    return view[offset:offset + length]
+
+
+def _extra_object(raw: memoryview) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    extra = json.loads(raw.tobytes())
+    if not isinstance(extra, dict):
+        raise InvalidEvent("Event extra is not a JSON object")
+    return extra
+
+
+def encode_task_event(event_type: str, data: Dict[str, Any]) -> bytes:
+    """Encode a task event ({'type': event_type, 'data': data}) in the binary format."""
+    code = EVENT_TYPE_CODES.get(event_type, 0)
+    name = _sized('name', b'' if code else event_type.encode(), U8)
+    title = _sized('title', (data.get('task_title') or data.get('title') or '').encode(), U16)
+    extra = _sized('extra', _extra(data, TASK_FIELDS), U32)
+    return b''.join((
+        HEADER.pack(MAGIC, SCHEMA_VERSION, KIND_TASK),
+        TASK_V1.pack(code, data.get('id') or 0, data.get('user_id') or 0,
+                     _to_epoch_ms(data.get('due_date')), len(name), len(title), len(extra)),
+        name, title, extra,
+    ))
+
+
+def encode_notification_event(user_id: int, notification: Dict[str, Any]) -> bytes:
+    """Encode a direct notification event in the binary format."""
+    title = _sized('title', notification.get('title', '').encode(), U16)
+    message = _sized('message', notification.get('message', '').encode(), U16)
+    extra = _sized('extra', _extra(notification, NOTIFICATION_FIELDS), U32)
+    return b''.join((
+        HEADER.pack(MAGIC, SCHEMA_VERSION, KIND_NOTIFICATION),
+        NOTIFICATION_V1.pack(user_id, LEVEL_CODES.get(notification.get('type'), 1),
+                             len(title), len(message), len(extra)),
+        title, message, extra,
+    ))
+
+
+def task_event_message(event_type: str, data: Dict[str, Any],
+                       encoding: str = 'binary') -> Tuple[str, bytes]:
+    """Return (content_type, body) for publishing a task event; ``encoding`` is 'binary' or 'json'."""
+    if encoding == 'json':
+        body = json.dumps({'version': SCHEMA_VERSION, 'type': event_type, 'data': data}, default=str)
+        return JSON_CONTENT_TYPE, body.encode()
+    return BINARY_CONTENT_TYPE, encode_task_event(event_type, data)
+
+
+def _read_header(body: bytes, kind: int) -> int:
+    try:
+        magic, version, body_kind = HEADER.unpack_from(body)
+    except struct.error:
+        raise InvalidEvent("Truncated event header")
+    if magic != MAGIC or body_kind != kind:
+        raise InvalidEvent(f"Not a {'task' if kind == KIND_TASK else 'notification'} event")
+    if version > SCHEMA_VERSION:
+        raise InvalidEvent(f"Unsupported event schema version {version}")
+    return version
+
+
+def _decode_json(body: bytes) -> Dict[str, Any]:
+    try:
+        event = json.loads(body)
+    except ValueError as e:
+        raise InvalidEvent(f"Undecodable JSON event: {e}")
+    if not isinstance(event, dict):
+        raise InvalidEvent("Event is not a JSON object")
+    if event.get('version', 1) > SCHEMA_VERSION:
+        raise InvalidEvent(f"Unsupported event schema version {event['version']}")
+    return event
+
+
+def _json_object(event: Dict[str, Any], key: str) -> Dict[str, Any]:
+    value = event.get(key) or {}
+    if not isinstance(value, dict):
+        raise InvalidEvent(f"Event {key} is not a JSON object")
+    return value
+
+
+def decode_task_event(content_type: str, body: bytes) -> Tuple[str, Dict[str, Any]]:
+    """Return (event_type, task data) for a task_events message."""
+    if content_type != BINARY_CONTENT_TYPE:
+        event = _decode_json(body)
+        return event.get('type'), _json_object(event, 'data')
+
+    _read_header(body, KIND_TASK)
+    offset = HEADER.size
+    try:
+        code, task_id, user_id, due_ms, name_len, title_len, extra_len = TASK_V1.unpack_from(body, offset)
+        offset += TASK_V1.size
+        view = memoryview(body)
+        event_type = EVENT_TYPE_NAMES.get(code) if code else str(_take(view, offset, name_len), 'utf-8')
+        offset += name_len
+        title = str(_take(view, offset, title_len), 'utf-8')
+        offset += title_len
+        data = _extra_object(_take(view, offset, extra_len))
+        if due_ms != NO_DATE:
+            data['due_date'] = datetime.fromtimestamp(due_ms / 1000, tz=timezone.utc).isoformat()
+    except (struct.error, ValueError, OverflowError, OSError) as e:
+        raise InvalidEvent(f"Malformed task event: {e}")
+
+    data['id'] = task_id
+    data['user_id'] = user_id
+    data['title'] = data['task_title'] = title
+    return event_type, data
+
+
+def decode_notification_event(content_type: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+    """Return (user_id, notification) for a notification_events message."""
+    if content_type != BINARY_CONTENT_TYPE:
+        event = _decode_json(body)
+        return event.get('user_id'), _json_object(event, 'notification')
+
+    _read_header(body, KIND_NOTIFICATION)
+    offset = HEADER.size
+    try:
+        user_id, level, title_len, message_len, extra_len = NOTIFICATION_V1.unpack_from(body, offset)
+        offset += NOTIFICATION_V1.size
+        view = memoryview(body)
+        title = str(_take(view, offset, title_len), 'utf-8')
+        offset += title_len
+        message = str(_take(view, offset, message_len), 'utf-8')
+        offset += message_len
+        notification = _extra_object(_take(view, offset, extra_len))
+    except (struct.error, ValueError) as e:
+        raise InvalidEvent(f"Malformed notification event: {e}")
+
+    notification['title'] = title
+    notification['message'] = message
+    notification['type'] = LEVEL_NAMES.get(level, 'info')
+    return user_id, notification
@@ -0,0 +1,45 @@
+"""
+Gunicorn settings shared by the service images.
+
+Each service's ``gunicorn.conf.py`` star-imports these and adds its worker
+class and hooks. Workers default to one per available core
+(``WEB_CONCURRENCY``), and the app is loaded once in the master and shared
+copy-on-write by the forked workers.
+
+Graceful reloads: `kill -HUP <master pid>` re-reads the config and replaces
+workers once their in-flight requests finish. Because the app is preloaded,
+HUP does not pick up new code; for that send USR2 (starts a new master with
+the new code) and then TERM to the old master, or roll the containers.
+"""
+
+import os
+
+# Imported as a module: a top-level name `config` would clash with gunicorn's own setting
+import decouple
+
+__all__ = [
+    'bind', 'workers', 'preload_app', 'timeout', 'graceful_timeout', 'keepalive',
+    'max_requests', 'max_requests_jitter', 'worker_tmp_dir', 'accesslog', 'errorlog',
+]
+
+bind = decouple.config('GUNICORN_BIND', default='0.0.0.0:8000')
+workers = decouple.config('WEB_CONCURRENCY', default=len(os.sched_getaffinity(0)), cast=int)
+preload_app = True
+
+timeout = decouple.config('GUNICORN_TIMEOUT', default=30, cast=int)
+graceful_timeout = decouple.config('GUNICORN_GRACEFUL_TIMEOUT', default=30, cast=int)
+keepalive = 5
+# Recycle workers periodically, staggered so they do not all restart together
+max_requests = decouple.config('GUNICORN_MAX_REQUESTS', default=5000, cast=int)
+max_requests_jitter = max_requests // 10
+
+# Worker heartbeat files on tmpfs; overlay filesystems can stall them
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = '-'
+errorlog = '-'
+
+
+def close_django_connections(server, worker):
+    """``post_fork`` hook: each worker opens its own persistent connections (DB_CONN_MAX_AGE)."""
+    from django.db import connections
+    connections.close_all()
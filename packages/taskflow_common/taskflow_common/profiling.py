@@ -0,0 +1,253 @@
+"""
+Per-request query and timing instrumentation.
+
+``ProfilingMiddleware`` times every request and reports it as ``total`` in
+a ``Server-Timing`` header; that single timer is all most requests pay for.
+Requests picked at PROFILE_CAPTURE_RATE, and requests carrying a valid
+``X-Profile`` header (a token from ``make_profile_token()``, signed with
+SECRET_KEY), are captured in full:
+
+- the number of SQL queries and total database time, via a connection
+  ``execute_wrapper``, plus the slowest few statements
+- serialize time: DRF serializers building ``serializer.data`` in the view
+- render time: the renderer turning the response into JSON/HTML bytes
+- total time
+
+Requests slower than SLOW_REQUEST_THRESHOLD_MS are written to the
+``slow_requests`` logger (a rotating file, see LOGGING in settings), with
+their slowest statements when they were captured.
+
+A request with a valid ``X-Profile`` header is also run under a sampling
+profiler. The collapsed stacks are written to PROFILE_DIR, ready for
+flamegraph tools, and the file name is returned in ``X-Profile-Id``.
+
+Used by the Django services (``MIDDLEWARE`` in their settings); each
+configures the settings above and the ``slow_requests`` logger.
+"""
+
+import functools
+import heapq
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+
+logger = logging.getLogger('slow_requests')
+
+PROFILE_SALT = 'request-profiling'
+SLOWEST_STATEMENTS = 5
+
+
+def make_profile_token():
+    """Token to send in the X-Profile header, e.g. from ``manage.py shell``."""
+    return signing.dumps({'profile': True}, salt=PROFILE_SALT)
+
+
+def _profile_requested(request):
+    token = request.headers.get('X-Profile')
+    if not token:
+        return False
+    try:
+        signing.loads(token, salt=PROFILE_SALT, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class QueryStats:
+    """Connection execute wrapper counting queries and keeping the slowest ones."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            entry = (elapsed, self.count, sql)
+            if len(self.slowest) < SLOWEST_STATEMENTS:
+                heapq.heappush(self.slowest, entry)
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def slowest_statements(self):
+        return [
+            {'ms': round(elapsed * 1000, 2), 'sql': sql[:500]}
+            for elapsed, _, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+class SerializeTimer:
+    """Time spent in ``serializer.data`` during one request; nested serializers count once."""
+
+    def __init__(self):
+        self.duration = 0.0
+        self.depth = 0
+
+
+_serialize_timer = ContextVar('serialize_timer', default=None)
+_serializers_instrumented = False
+
+
+def _timed(data):
+    @functools.wraps(data)
+    def timed(serializer):
+        timer = _serialize_timer.get()
+        if timer is None or timer.depth:
+            return data(serializer)
+        timer.depth += 1
+        start = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            timer.depth -= 1
+            timer.duration += time.perf_counter() - start
+    return timed
+
+
+def _instrument_serializers():
+    """Wrap ``Serializer.data`` and ``ListSerializer.data`` to add to the request's ``SerializeTimer``."""
+    global _serializers_instrumented
+    if _serializers_instrumented:
+        return
+    from rest_framework.serializers import ListSerializer, Serializer
+
+    for cls in (Serializer, ListSerializer):
+        cls.data = property(_timed(cls.data.fget))
+    _serializers_instrumented = True
+
+
+class SamplingProfiler:
+    """Sample one thread's stack from a background thread and count collapsed stacks."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Write samples in collapsed-stack format (one "stack count" per line)."""
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfilingMiddleware:
+    """Time every request; capture queries, serialize and render time for sampled ones."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _instrument_serializers()
+
+    def __call__(self, request):
+        profiling = _profile_requested(request)
+        if not profiling and random.random() >= settings.PROFILE_CAPTURE_RATE:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            total = time.perf_counter() - start
+            response['Server-Timing'] = f'total;dur={total * 1000:.1f}'
+            self._log_if_slow(request, response, total)
+            return response
+
+        stats = QueryStats()
+        serialize = SerializeTimer()
+        request._render_time = 0.0
+        profiler = SamplingProfiler(settings.PROFILE_SAMPLE_INTERVAL) if profiling else None
+
+        token = _serialize_timer.set(serialize)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                if profiler:
+                    stack.enter_context(profiler)
+                response = self.get_response(request)
+        finally:
+            _serialize_timer.reset(token)
+        total = time.perf_counter() - start
+
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"',
+            f'serialize;dur={serialize.duration * 1000:.1f}',
+            f'render;dur={request._render_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+        if profiler:
+            response['X-Profile-Id'] = self._write_profile(request, profiler)
+        self._log_if_slow(request, response, total, {
+            'db_ms': round(stats.duration * 1000, 1),
+            'queries': stats.count,
+            'serialize_ms': round(serialize.duration * 1000, 1),
+            'render_ms': round(request._render_time * 1000, 1),
+            'slowest': stats.slowest_statements(),
+        })
+        return response
+
+    def process_template_response(self, request, response):
+        """Time rendering (the renderer only, not serializers) with a post-render callback."""
+        if not hasattr(request, '_render_time'):
+            return response
+        start = time.perf_counter()
+
+        def rendered(response):
+            request._render_time += time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def _log_if_slow(request, response, total, captured=None):
+        if total * 1000 < settings.SLOW_REQUEST_THRESHOLD_MS:
+            return
+        logger.warning(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            **(captured or {}),
+        }))
+
+    @staticmethod
+    def _write_profile(request, profiler):
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{os.getpid()}-{threading.get_ident()}.collapsed"
+        profiler.write(os.path.join(settings.PROFILE_DIR, name))
+        return name
@@ -0,0 +1,240 @@
+"""
+Minimal W3C trace context tracing.
+
+Spans are propagated in ``traceparent`` headers (HTTP and AMQP message
+headers) and sampled spans are written as JSON lines by ``FileExporter``,
+one file per process. ``python -m worker.trace_report`` in the
+notifications service merges the files of both services into per-stage
+latency breakdowns.
+
+The sampling decision is made once at the root and inherited through the
+``sampled`` flag, so a trace is either complete or absent. Unsampled spans
+only carry ids for propagation and are never timed or exported. Headers
+from inside the system (task events) are trusted as they are. A
+``traceparent`` sent by an outside caller goes through ``Tracer.incoming``
+first: its trace id is kept, but its sampled flag is honoured for at most
+``incoming_limit`` traces per second, so clients can't make every request
+write spans. Past that, the local sample rate decides.
+
+Each service builds its ``Tracer`` and ``FileExporter`` from its own
+settings in its ``tracing`` module.
+"""
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, NamedTuple, Optional
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+class Span:
+    __slots__ = ('name', 'context', 'parent_id', 'start_ns', 'end_ns', 'attributes')
+
+    def __init__(self, name: str, context: SpanContext, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns() if context.sampled else 0
+        self.end_ns = 0
+
+    def set(self, key: str, value):
+        if self.context.sampled:
+            self.attributes[key] = value
+
+    def to_dict(self, service: str) -> Dict[str, Any]:
+        return {
+            'service': service,
+            'name': self.name,
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'attributes': self.attributes,
+        }
+
+
+class FileExporter:
+    """Buffer finished spans and append them to a JSON-lines file per process.
+
+    ``path`` may contain ``{pid}``. It is resolved at each write, and the
+    buffer is dropped in forked children, so workers forked from a
+    preloaded master each write their own file. A file reaching
+    ``max_bytes`` is renamed to ``<path>.1`` (older ones shift up to
+    ``<path>.<backup_count>``) and a new one started; 0 never rotates.
+    """
+
+    def __init__(self, service: str, path: str, batch_size: int = 256,
+                 max_bytes: int = 0, backup_count: int = 3):
+        self.service = service
+        self.path = path
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._after_fork()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.flush)
+
+    def _after_fork(self):
+        # The parent's spans are its own to write, and its locks may have been held
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(self.service), default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) < self.batch_size:
+                return
+            lines, self._buffer = self._buffer, []
+        self._write(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if lines:
+            self._write(lines)
+
+    def _write(self, lines: List[str]):
+        path = self.path.format(pid=os.getpid())
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._write_lock:
+            if self.max_bytes and os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+                self._rotate(path)
+            with open(path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def _rotate(self, path: str):
+        if self.backup_count < 1:
+            os.remove(path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{path}.{index}'):
+                os.replace(f'{path}.{index}', f'{path}.{index + 1}')
+        os.replace(path, f'{path}.1')
+
+
+_current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def parse_traceparent(value) -> Optional[SpanContext]:
+    """Parse a W3C traceparent header; returns None for missing or malformed values."""
+    if isinstance(value, bytes):
+        value = value.decode()
+    if not value or len(value) != 55 or value.count('-') != 3:
+        return None
+    version, trace_id, span_id, flags = value.split('-')
+    if version != '00' or len(trace_id) != 32 or len(span_id) != 16 or trace_id == '0' * 32:
+        return None
+    try:
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    return SpanContext(trace_id, span_id, sampled)
+
+
+def extract(headers) -> Optional[SpanContext]:
+    """Read the parent context from message or request headers."""
+    return parse_traceparent((headers or {}).get('traceparent'))
+
+
+def inject(headers: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the current span's traceparent to outgoing headers."""
+    span = _current.get()
+    if span is not None:
+        headers['traceparent'] = span.context.traceparent
+    return headers
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+class Tracer:
+    """Start spans, sampling new traces at ``sample_rate``, and export them to ``exporter``."""
+
+    def __init__(self, exporter: FileExporter, sample_rate: float = 0.0, incoming_limit: float = 0.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.incoming_limit = incoming_limit
+        # Token bucket for honoured incoming sampled flags, one second deep
+        self._tokens = max(incoming_limit, 1.0)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            capacity = max(self.incoming_limit, 1.0)
+            self._tokens = min(capacity, self._tokens + (now - self._refilled) * self.incoming_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def incoming(self, context: Optional[SpanContext]) -> Optional[SpanContext]:
+        """The parent for work started by an outside caller's ``traceparent``, re-sampled here."""
+        if context is None:
+            return None
+        if context.sampled and self.incoming_limit > 0 and self._take_token():
+            return context
+        return context._replace(sampled=self._sample())
+
+    def _new_context(self, parent: Optional[SpanContext]) -> SpanContext:
+        if parent is None:
+            ids = os.urandom(24).hex()
+            return SpanContext(ids[:32], ids[32:], self._sample())
+        if not parent.sampled:
+            # Nothing is recorded, so children only need to pass the decision on
+            return parent
+        return SpanContext(parent.trace_id, os.urandom(8).hex(), True)
+
+    @contextmanager
+    def start_span(self, name: str, parent: Optional[SpanContext] = None, **attributes):
+        """Run a block inside a span that is a child of `parent` (default: the current span)."""
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current is not None else None
+        span = Span(name, self._new_context(parent), parent.span_id if parent else None, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set('error', repr(e))
+            raise
+        finally:
+            _current.reset(token)
+            if span.context.sampled:
+                span.end_ns = time.time_ns()
+                self.exporter.export(span)
+
+    def record_span(self, name: str, parent: SpanContext, start_ns: int, end_ns: int, **attributes):
+        """Export an already finished span, e.g. for work done later in a batch."""
+        if not parent.sampled:
+            return
+        span = Span(name, self._new_context(parent), parent.span_id, attributes)
+        span.start_ns, span.end_ns = start_ns, end_ns
+        self.exporter.export(span)
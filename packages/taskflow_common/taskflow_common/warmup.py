@@ -0,0 +1,44 @@
+"""
+Warm-up run once when the WSGI application is loaded.
+
+Under gunicorn with ``preload_app`` this happens in the master, so every
+forked worker starts with the URL resolver, view modules and serializer
+field maps already built instead of paying for them on its first requests.
+Called from the Django services' ``wsgi.py``.
+"""
+
+import inspect
+import logging
+from importlib import import_module
+
+from django.apps import apps
+from django.urls import get_resolver
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    # Importing every view module and compiling the reverse lookup tables
+    resolver = get_resolver()
+    resolver.reverse_dict
+    for app_config in apps.get_app_configs():
+        try:
+            module = import_module(f"{app_config.name}.serializers")
+        except ModuleNotFoundError:
+            continue
+        for serializer_class in vars(module).values():
+            if (inspect.isclass(serializer_class)
+                    and issubclass(serializer_class, serializers.Serializer)
+                    and serializer_class.__module__ == module.__name__):
+                try:
+                    # Builds fields from model metadata and caches the model's _meta lookups
+                    serializer_class().fields
+                except Exception as e:
+                    logger.debug("Skipping warm-up of %s: %s", serializer_class.__name__, e)
+    # Resolve the DRF classes named by string in settings
+    api_settings.DEFAULT_RENDERER_CLASSES
+    api_settings.DEFAULT_PARSER_CLASSES
+    api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    api_settings.DEFAULT_PERMISSION_CLASSES
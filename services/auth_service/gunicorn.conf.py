@@ -0,0 +1,19 @@
+"""
+Gunicorn settings for the auth service.
+
+    gunicorn -c gunicorn.conf.py auth_service.wsgi:application
+
+Shared defaults and reload notes are in ``taskflow_common/gunicorn_conf.py``;
+the preloaded app is warmed up in the master by ``taskflow_common/warmup.py``.
+"""
+
+# Imported as a module: a top-level name `config` would clash with gunicorn's own setting
+import decouple
+from taskflow_common.gunicorn_conf import *  # noqa: F401,F403
+from taskflow_common.gunicorn_conf import close_django_connections
+
+# One process per available core; threads cover requests blocked on the database
+worker_class = 'gthread'
+threads = decouple.config('GUNICORN_THREADS', default=4, cast=int)
+
+post_fork = close_django_connections
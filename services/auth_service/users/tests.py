@@ -1,8 +1,12 @@
-from django.test import TestCase
+import os
+import tempfile
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
+from taskflow_common.profiling import ProfilingMiddleware, make_profile_token
 
 User = get_user_model()
 
@@ -79,3 +83,43 @@ class UserAPITest(APITestCase):
         response = self.client.get(self.profile_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['email'], user.email)
+
+
+@override_settings(PROFILE_CAPTURE_RATE=1.0)
+class ProfilingMiddlewareTest(TestCase):
+    """Test cases for per-request profiling."""
+    
+    def setUp(self):
+        self.factory = RequestFactory()
+    
+    def view(self, request):
+        return HttpResponse(str(User.objects.count()))
+    
+    def test_server_timing_counts_queries(self):
+        """Test that Server-Timing reports the queries the request ran."""
+        response = ProfilingMiddleware(self.view)(self.factory.get('/api/auth/profile/'))
+        
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="1 queries"')
+    
+    def test_signed_header_runs_profiler(self):
+        """Test that only signed X-Profile tokens start the profiler."""
+        profile_dir = tempfile.mkdtemp()
+        
+        with self.settings(PROFILE_DIR=profile_dir):
+            profiled = ProfilingMiddleware(self.view)(
+                self.factory.get('/api/auth/profile/', HTTP_X_PROFILE=make_profile_token())
+            )
+            forged = ProfilingMiddleware(self.view)(
+                self.factory.get('/api/auth/profile/', HTTP_X_PROFILE='forged')
+            )
+        
+        self.assertTrue(os.path.exists(os.path.join(profile_dir, profiled['X-Profile-Id'])))
+        self.assertNotIn('X-Profile-Id', forged)
+    
+    def test_slow_requests_are_logged(self):
+        """Test that requests over the threshold go to the slow-request log."""
+        with self.settings(SLOW_REQUEST_THRESHOLD_MS=0):
+            with self.assertLogs('slow_requests', level='WARNING') as logs:
+                ProfilingMiddleware(self.view)(self.factory.get('/api/auth/profile/'))
+        
+        self.assertIn('"queries": 1', logs.output[0])
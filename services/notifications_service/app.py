@@ -2,42 +2,76 @@
 FastAPI application for notifications service.
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from typing import Optional, Literal
+from pydantic import AnyHttpUrl, BaseModel, EmailStr, Field, ValidationError, field_validator
 import redis
 import pika
 import json
+import logging
+import time
 from decouple import config
-from worker import NotificationWorker
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
+from worker import NotificationWorker, ReminderScheduler, ShardedNotificationStore
+from worker.delivery import check_webhook_url
+from worker.metrics import HTTP_LATENCY
 
 # Configuration
 REDIS_URL = config('REDIS_URL', default='redis://localhost:6379')
 RABBITMQ_URL = config('RABBITMQ_URL', default='amqp://localhost:5672')
+# Redis nodes for per-user notification keys, placed by consistent hashing of user_id
+REDIS_SHARD_URLS = config('REDIS_SHARD_URLS', default=REDIS_URL).split(',')
+REMINDER_SCHEDULER_ENABLED = config('REMINDER_SCHEDULER_ENABLED', default=True, cast=bool)
+# Consume events and schedule reminders inside the API process. Production
+# serving turns this off and runs `python -m worker` as its own process.
+RUN_WORKER = config('RUN_WORKER', default=True, cast=bool)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+# Set by gunicorn.conf.py when serving with several worker processes
+PROMETHEUS_MULTIPROC_DIR = config('PROMETHEUS_MULTIPROC_DIR', default='')
+
+logging.basicConfig(level=LOG_LEVEL, format='%(message)s')
 
 # Global variables for connections
 redis_client = None
+notification_store = None
 rabbitmq_connection = None
 notification_worker = None
+reminder_scheduler = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager."""
-    global redis_client, rabbitmq_connection, notification_worker
+    global redis_client, notification_store, rabbitmq_connection, notification_worker, reminder_scheduler
     
     # Startup
     try:
         # Initialize Redis connection
         redis_client = redis.from_url(REDIS_URL)
         redis_client.ping()  # Test connection
+        notification_store = ShardedNotificationStore(REDIS_SHARD_URLS)
+        notification_store.ping()
         
-        # Initialize RabbitMQ connection
-        rabbitmq_connection = pika.BlockingConnection(pika.URLParameters(RABBITMQ_URL))
-        
-        # Start notification worker
-        notification_worker = NotificationWorker(redis_client, rabbitmq_connection)
-        notification_worker.start()
+        if RUN_WORKER:
+            # Initialize RabbitMQ connection
+            rabbitmq_connection = pika.BlockingConnection(pika.URLParameters(RABBITMQ_URL))
+            
+            # Start notification worker
+            notification_worker = NotificationWorker(
+                redis_client,
+                rabbitmq_connection,
+                store=notification_store,
+                connection_params=pika.URLParameters(RABBITMQ_URL)
+            )
+            notification_worker.start()
+            
+            # Start due-date reminder scheduler (pika connections are not thread-safe)
+            if REMINDER_SCHEDULER_ENABLED:
+                reminder_connection = pika.BlockingConnection(pika.URLParameters(RABBITMQ_URL))
+                reminder_scheduler = ReminderScheduler(redis_client, reminder_connection)
+                reminder_scheduler.start()
         
         print("Notifications service started successfully")
         
@@ -49,10 +83,16 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     try:
+        if reminder_scheduler:
+            reminder_scheduler.stop()
+            if not reminder_scheduler.rabbitmq_connection.is_closed:
+                reminder_scheduler.rabbitmq_connection.close()
         if notification_worker:
             notification_worker.stop()
         if rabbitmq_connection and not rabbitmq_connection.is_closed:
             rabbitmq_connection.close()
+        if notification_store:
+            notification_store.close()
         if redis_client:
             redis_client.close()
         print("Notifications service stopped")
@@ -78,6 +118,58 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    """Record request latency by route template, so user ids don't explode label cardinality."""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_LATENCY.labels(
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code
+    ).observe(time.perf_counter() - start)
+    return response
+
+
+class NotificationPreferences(BaseModel):
+    """Per-user delivery preferences."""
+    
+    # Seconds between digest summaries of info notifications (0 delivers them immediately)
+    digest_interval: int = Field(default=0, ge=0)
+    # External channels to deliver to in addition to the in-app list
+    channels: list[Literal['email', 'webhook']] = []
+    email: Optional[EmailStr] = None
+    # https only, and never a private or loopback address (checked again on delivery)
+    webhook_url: Optional[AnyHttpUrl] = None
+    
+    @field_validator('webhook_url')
+    @classmethod
+    def webhook_url_is_public(cls, value):
+        # UnsafeDestination is a ValueError, so it is reported as a 422
+        if value is not None:
+            check_webhook_url(str(value))
+        return value
+    
+    @classmethod
+    def from_storage(cls, stored: dict) -> "NotificationPreferences":
+        """Build preferences from the flat string hash kept in Redis."""
+        stored = dict(stored)
+        stored['channels'] = [c for c in stored.get('channels', '').split(',') if c]
+        try:
+            return cls(**stored)
+        except ValidationError as e:
+            # Addresses stored before they were validated are left out
+            invalid = {error['loc'][0] for error in e.errors() if error['loc']}
+            return cls(**{k: v for k, v in stored.items() if k not in invalid})
+    
+    def to_storage(self) -> dict:
+        """Flatten to string fields for the Redis hash read by the worker."""
+        stored = self.model_dump(mode='json', exclude_none=True)
+        stored['channels'] = ','.join(self.channels)
+        return stored
+
+
 def get_redis():
     """Dependency to get Redis client."""
     if not redis_client:
@@ -85,19 +177,58 @@ def get_redis():
     return redis_client
 
 
+def get_store():
+    """Dependency to get the notification store."""
+    if not notification_store:
+        raise HTTPException(status_code=503, detail="Redis not available")
+    return notification_store
+
+
+def _parse_notifications(raw_notifications):
+    """Decode stored notifications, skipping anything corrupt."""
+    parsed_notifications = []
+    for notification in raw_notifications:
+        try:
+            parsed_notifications.append(json.loads(notification))
+        except json.JSONDecodeError:
+            continue
+    return parsed_notifications
+
+
+def _raw_response(raw_notifications, headers):
+    """Write the stored JSON documents straight through as a JSON array."""
+    body = b"[" + b",".join(raw_notifications) + b"]"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/")
 async def root():
     """Root endpoint."""
     return {"message": "TaskFlow Notifications Service", "status": "running"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Several gunicorn workers: aggregate the per-process metric files
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/health")
-async def health_check(redis: redis.Redis = Depends(get_redis)):
+async def health_check(
+    redis: redis.Redis = Depends(get_redis),
+    store: ShardedNotificationStore = Depends(get_store)
+):
     """Health check endpoint."""
     try:
-        # Check Redis connection
+        # Check Redis connections
         redis.ping()
-        return {"status": "healthy", "redis": "connected"}
+        store.ping()
+        return {"status": "healthy", "redis": "connected", "shards": len(store.clients)}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Service unhealthy: {e}")
 
@@ -107,25 +238,55 @@ async def get_user_notifications(
     user_id: int,
     limit: int = 20,
     offset: int = 0,
-    redis: redis.Redis = Depends(get_redis)
+    since: Optional[int] = None,
+    cursor: Optional[int] = None,
+    raw: bool = False,
+    store: ShardedNotificationStore = Depends(get_store)
 ):
-    """Get notifications for a specific user."""
+    """Get notifications for a specific user.
+    
+    - ``since=<id>`` returns only notifications newer than the last one seen;
+      ``truncated`` is set when some of them were already trimmed from the list.
+    - ``cursor=<id>`` pages backwards from an id (0 for the newest) and is not
+      shifted by notifications pushed in the meantime.
+    - ``raw=true`` returns the stored documents as a bare JSON array, with
+      paging state in ``X-Notifications-*`` headers.
+    """
     try:
-        # Get notifications from Redis
-        notifications_key = f"notifications:user:{user_id}"
-        notifications = redis.lrange(notifications_key, offset, offset + limit - 1)
+        if since is not None:
+            items, newest, has_more, truncated = store.since(user_id, since, limit)
+            newest = newest if newest is not None else since
+            if raw:
+                return _raw_response(items, {
+                    "X-Notifications-Since": str(newest),
+                    "X-Notifications-Has-More": str(has_more).lower(),
+                    "X-Notifications-Truncated": str(truncated).lower(),
+                })
+            return {
+                "notifications": _parse_notifications(items),
+                "since": newest,
+                "has_more": has_more,
+                "truncated": truncated,
+                "limit": limit
+            }
         
-        # Parse notifications
-        parsed_notifications = []
-        for notification in notifications:
-            try:
-                parsed_notifications.append(json.loads(notification))
-            except json.JSONDecodeError:
-                continue
+        if cursor is not None:
+            items, next_cursor = store.before(user_id, cursor, limit)
+            if raw:
+                headers = {"X-Notifications-Next-Cursor": str(next_cursor)} if next_cursor else {}
+                return _raw_response(items, headers)
+            return {
+                "notifications": _parse_notifications(items),
+                "next_cursor": next_cursor,
+                "limit": limit
+            }
         
+        items, total = store.page(user_id, offset, limit)
+        if raw:
+            return _raw_response(items, {"X-Notifications-Total": str(total)})
         return {
-            "notifications": parsed_notifications,
-            "total": redis.llen(notifications_key),
+            "notifications": _parse_notifications(items),
+            "total": total,
             "limit": limit,
             "offset": offset
         }
@@ -137,29 +298,53 @@ async def get_user_notifications(
 async def mark_notifications_read(
     user_id: int,
     notification_ids: list[str],
-    redis: redis.Redis = Depends(get_redis)
+    store: ShardedNotificationStore = Depends(get_store)
 ):
     """Mark notifications as read."""
     try:
-        # Mark notifications as read in Redis
-        for notification_id in notification_ids:
-            read_key = f"notifications:read:{user_id}:{notification_id}"
-            redis.set(read_key, "true", ex=86400 * 30)  # Expire in 30 days
+        # Mark notifications as read in Redis (expire in 30 days)
+        store.mark_read(user_id, notification_ids)
         
         return {"message": "Notifications marked as read"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to mark notifications as read: {e}")
 
 
+@app.get("/notifications/{user_id}/preferences")
+async def get_notification_preferences(
+    user_id: int,
+    store: ShardedNotificationStore = Depends(get_store)
+):
+    """Get a user's delivery preferences."""
+    try:
+        stored = store.get_preferences_many([user_id])[user_id]
+        return NotificationPreferences.from_storage(stored)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get preferences: {e}")
+
+
+@app.put("/notifications/{user_id}/preferences")
+async def update_notification_preferences(
+    user_id: int,
+    preferences: NotificationPreferences,
+    store: ShardedNotificationStore = Depends(get_store)
+):
+    """Update a user's delivery preferences (workers pick them up within PREFERENCES_CACHE_TTL)."""
+    try:
+        store.set_preferences(user_id, preferences.to_storage())
+        return preferences
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update preferences: {e}")
+
+
 @app.delete("/notifications/{user_id}")
 async def clear_user_notifications(
     user_id: int,
-    redis: redis.Redis = Depends(get_redis)
+    store: ShardedNotificationStore = Depends(get_store)
 ):
     """Clear all notifications for a user."""
     try:
-        notifications_key = f"notifications:user:{user_id}"
-        redis.delete(notifications_key)
+        store.clear(user_id)
         return {"message": "Notifications cleared"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to clear notifications: {e}")
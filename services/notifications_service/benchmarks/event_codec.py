@@ -0,0 +1,79 @@
+"""
+Benchmark encode/decode throughput and message size of the task event encodings.
+
+Compares the binary schema against the JSON documents for a typical task
+event and a direct notification, through the same decode functions the
+worker uses.
+
+Usage (from services/notifications_service):
+    python benchmarks/event_codec.py --iterations 200000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.events import (  # noqa: E402
+    BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE, decode_notification_event, decode_task_event,
+    encode_notification_event, task_event_message,
+)
+
+TASK = {
+    'id': 184467,
+    'user_id': 52311,
+    'title': 'Prepare quarterly planning deck',
+    'task_title': 'Prepare quarterly planning deck',
+    'due_date': '2026-03-31T17:00:00+00:00',
+}
+NOTIFICATION = {
+    'title': 'Build finished',
+    'message': 'The nightly build for main finished in 14m 32s.',
+    'type': 'success',
+}
+
+
+def rate(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    cases = {
+        'task/binary': (
+            lambda: task_event_message('task_due_soon', TASK, 'binary')[1],
+            lambda body: decode_task_event(BINARY_CONTENT_TYPE, body),
+        ),
+        'task/json': (
+            lambda: task_event_message('task_due_soon', TASK, 'json')[1],
+            lambda body: decode_task_event(JSON_CONTENT_TYPE, body),
+        ),
+        'notification/binary': (
+            lambda: encode_notification_event(52311, NOTIFICATION),
+            lambda body: decode_notification_event(BINARY_CONTENT_TYPE, body),
+        ),
+        'notification/json': (
+            lambda: json.dumps({'user_id': 52311, 'notification': NOTIFICATION}).encode(),
+            lambda body: decode_notification_event(JSON_CONTENT_TYPE, body),
+        ),
+    }
+
+    print(f"{'case':<22}{'bytes':>8}{'encode/s':>14}{'decode/s':>14}")
+    for name, (encode, decode) in cases.items():
+        body = encode()
+        encode_rate = rate(encode, args.iterations)
+        decode_rate = rate(lambda: decode(body), args.iterations)
+        print(f"{name:<22}{len(body):>8}{encode_rate:>14,.0f}{decode_rate:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
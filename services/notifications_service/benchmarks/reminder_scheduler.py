@@ -0,0 +1,111 @@
+"""
+Benchmark the reminder scheduler tick against a large reminder index.
+
+Loads up to --total future reminders into a scratch sorted set, then at each
+checkpoint adds --due already-due reminders and times a single tick. The
+per-tick cost should track the number of due items and stay flat as the
+index grows.
+
+Usage (from services/notifications_service):
+    python benchmarks/reminder_scheduler.py --redis-url redis://localhost:6379 \
+        --total 10000000 --checkpoints 100000,1000000,10000000 --due 100,1000,10000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.reminder_scheduler import ReminderScheduler  # noqa: E402
+
+KEY_PREFIX = 'bench:reminders'
+
+
+class CountingScheduler(ReminderScheduler):
+    """Scheduler that counts events instead of publishing to RabbitMQ."""
+
+    published = 0
+
+    def _publish_batch(self, events):
+        self.published += len(events)
+
+
+def load_future(client, start, stop, now, chunk=10000):
+    """Add reminders [start, stop) with scores spread over the next year."""
+    schedule_key = f'{KEY_PREFIX}:schedule'
+    for offset in range(start, stop, chunk):
+        pipe = client.pipeline(transaction=False)
+        pipe.zadd(schedule_key, {
+            f'overdue:{i}': now + 3600 + (i % 31536000)
+            for i in range(offset, min(offset + chunk, stop))
+        })
+        pipe.execute()
+
+
+def load_due(client, count, now, id_base):
+    """Add `count` already-due reminders with payloads."""
+    pipe = client.pipeline(transaction=False)
+    pipe.zadd(f'{KEY_PREFIX}:schedule', {f'due_soon:{id_base + i}': now - 1 for i in range(count)})
+    pipe.hset(f'{KEY_PREFIX}:payload', mapping={
+        id_base + i: json.dumps({'id': id_base + i, 'user_id': 1, 'task_title': 'bench'})
+        for i in range(count)
+    })
+    pipe.execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', default='redis://localhost:6379')
+    parser.add_argument('--total', type=int, default=10_000_000)
+    parser.add_argument('--checkpoints', default='100000,1000000,10000000')
+    parser.add_argument('--due', default='100,1000,10000')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    client = redis.from_url(args.redis_url)
+    client.delete(f'{KEY_PREFIX}:schedule', f'{KEY_PREFIX}:payload', f'{KEY_PREFIX}:leader')
+
+    scheduler = CountingScheduler(
+        client, None,
+        schedule_key=f'{KEY_PREFIX}:schedule',
+        payload_key=f'{KEY_PREFIX}:payload',
+        leader_key=f'{KEY_PREFIX}:leader',
+        batch_size=args.batch_size,
+    )
+    checkpoints = sorted(min(int(c), args.total) for c in args.checkpoints.split(','))
+    due_counts = [int(d) for d in args.due.split(',')]
+    now = time.time()
+    loaded = 0
+    id_base = args.total
+
+    print(f"{'index size':>12} {'due':>8} {'tick ms':>10} {'us/item':>10}")
+    for checkpoint in checkpoints:
+        load_future(client, loaded, checkpoint, now)
+        loaded = checkpoint
+
+        # Empty tick: nothing due, must be O(log N)
+        start = time.perf_counter()
+        scheduler.tick(now)
+        elapsed = time.perf_counter() - start
+        print(f"{loaded:>12,} {0:>8} {elapsed * 1000:>10.3f} {'-':>10}")
+
+        for due in due_counts:
+            load_due(client, due, now, id_base)
+            id_base += due
+            scheduler.published = 0
+            start = time.perf_counter()
+            scheduler.tick(now)
+            elapsed = time.perf_counter() - start
+            assert scheduler.published == due, (scheduler.published, due)
+            print(f"{loaded:>12,} {due:>8} {elapsed * 1000:>10.3f} {elapsed / due * 1e6:>10.2f}")
+
+    client.delete(f'{KEY_PREFIX}:schedule', f'{KEY_PREFIX}:payload', f'{KEY_PREFIX}:leader')
+
+
+if __name__ == '__main__':
+    main()
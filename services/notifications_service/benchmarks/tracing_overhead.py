@@ -0,0 +1,88 @@
+"""
+Benchmark the per-message cost of tracing in the notification worker.
+
+Feeds the same task event through ``NotificationWorker._on_message`` with
+tracing off, at a sample rate and fully on, and reports throughput and
+overhead relative to the untraced run. Redis is replaced by a no-op store
+and the coalescer merges every message, so the numbers isolate worker CPU
+time; with real Redis round trips the relative overhead is lower still.
+
+Usage (from services/notifications_service):
+    python benchmarks/tracing_overhead.py --messages 100000 --rates 0,0.01,0.1,1
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker import tracing  # noqa: E402
+from worker.coalescer import NotificationCoalescer  # noqa: E402
+from worker.events import BINARY_CONTENT_TYPE, encode_task_event  # noqa: E402
+from worker.notification_worker import NotificationWorker  # noqa: E402
+
+
+class NullChannel:
+    is_open = False  # No consumer to stop after the final flush
+
+    def basic_ack(self, delivery_tag):
+        pass
+
+
+def run(worker, body, messages, parent):
+    channel, method = NullChannel(), SimpleNamespace(delivery_tag=1)
+    # Coalesced messages are acked through the worker's channel once stored
+    worker.channel = channel
+    properties = SimpleNamespace(
+        content_type=BINARY_CONTENT_TYPE,
+        timestamp=None,
+        headers={'traceparent': parent} if parent else {},
+    )
+    start = time.perf_counter()
+    for _ in range(messages):
+        worker._on_message('task_events', channel, method, properties, body)
+    elapsed = time.perf_counter() - start
+    worker._flush_pending()
+    return messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--rates', default='0,0.01,0.1,1')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    worker = NotificationWorker(None, SimpleNamespace(call_later=lambda *a: None),
+                                store=SimpleNamespace(push_many=lambda batches: {},
+                                                      get_preferences_many=lambda users: {}))
+    # One pending entry that every message merges into: no Redis writes in the timed loop
+    worker.coalescer = NotificationCoalescer(window=3600, max_pending=10 ** 9)
+    body = encode_task_event('task_updated', {'id': 1, 'user_id': 1, 'title': 'Benchmark task'})
+    tracing.exporter.path = os.path.join(tempfile.mkdtemp(), 'spans.jsonl')
+
+    rates = [float(r) for r in args.rates.split(',')]
+    unsampled = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00'
+    cases = [(f'rate {rate}', rate, None) for rate in rates] + [('unsampled parent', 0.0, unsampled)]
+
+    run(worker, body, args.messages // 10, None)  # Warm up
+    # Interleave repeats and keep the best run of each case to damp scheduler noise
+    best = {name: 0.0 for name, _, _ in cases}
+    for _ in range(args.repeat):
+        for name, rate, parent in cases:
+            tracing.tracer.sample_rate = rate
+            best[name] = max(best[name], run(worker, body, args.messages, parent))
+
+    baseline = best[cases[0][0]]
+    print(f"{'case':<18}{'msgs/s':>12}{'us/msg':>9}{'added us':>10}{'overhead':>10}")
+    for name, _, _ in cases:
+        added = (1 / best[name] - 1 / baseline) * 1e6
+        print(f"{name:<18}{best[name]:>12,.0f}{1e6 / best[name]:>9.2f}{added:>10.2f}"
+              f"{(baseline / best[name] - 1) * 100:>9.1f}%")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Gunicorn settings for the notifications API.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Serves the FastAPI app with uvicorn workers, one per available core. The
+RabbitMQ consumer and reminder scheduler do not run here (RUN_WORKER=False);
+they run as a separate `python -m worker` process.
+
+Shared defaults and reload notes are in ``taskflow_common/gunicorn_conf.py``.
+"""
+
+import os
+import shutil
+import tempfile
+
+# Imported as a module: a top-level name `config` would clash with gunicorn's own setting
+import decouple
+from taskflow_common.gunicorn_conf import *  # noqa: F401,F403
+
+worker_class = 'uvicorn.workers.UvicornWorker'
+max_requests = decouple.config('GUNICORN_MAX_REQUESTS', default=10000, cast=int)
+max_requests_jitter = max_requests // 10
+
+os.environ.setdefault('RUN_WORKER', 'False')
+
+# Prometheus metrics from every worker process, aggregated by /metrics. Must be
+# set before the app (and prometheus_client) is imported.
+_metrics_dir = os.path.join(tempfile.gettempdir(), 'notifications-metrics')
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', _metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,9 @@
+"""
+Tests for the notifications service.
+
+Install ``requirements-dev.txt`` and the shared package (``pip install -e
+../../packages/taskflow_common``), then run from the service directory with
+``python -m pytest tests`` (or ``python -m unittest``). Redis is replaced
+by fakeredis servers, SMTP by an aiosmtpd sink and webhook receivers by
+``http.server``, so no external services are needed.
+"""
@@ -0,0 +1,28 @@
+"""Shared helpers for the notifications tests."""
+
+import json
+from unittest import mock
+
+import fakeredis
+
+from worker.events import JSON_CONTENT_TYPE
+from worker.notification_worker import NotificationWorker
+from worker.store import NotificationStore
+
+
+def make_worker(**store_options) -> NotificationWorker:
+    """A worker on a fresh fakeredis server, without a broker connection."""
+    client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    return NotificationWorker(client, None, store=NotificationStore(client, **store_options))
+
+
+def task_message(event_type: str, **data):
+    """(properties, body) of a JSON task_events message."""
+    properties = mock.Mock(content_type=JSON_CONTENT_TYPE, headers={}, timestamp=None)
+    return properties, json.dumps({'type': event_type, 'data': data}).encode()
+
+
+def stored(worker: NotificationWorker, user_id: int) -> list:
+    """A user's stored notifications, newest first."""
+    items, _ = worker.store.page(user_id, 0, 1000)
+    return [json.loads(item) for item in items]
@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+
+from worker.coalescer import NotificationCoalescer
+
+from .support import make_worker, stored, task_message
+
+
+class NotificationCoalescerTest(unittest.TestCase):
+    """Test merging bursts of events per (user, task, event type)."""
+
+    def test_merges_within_the_window(self):
+        coalescer = NotificationCoalescer(window=2.0)
+        for i in range(3):
+            coalescer.add(1, {'task_id': 7, 'event_type': 'task_updated', 'message': f'v{i}'}, now=10.0 + i / 10)
+        coalescer.add(1, {'task_id': 8, 'event_type': 'task_updated', 'message': 'other'}, now=10.5)
+        coalescer.add(2, {'task_id': 7, 'event_type': 'task_updated', 'message': 'user 2'}, now=10.5)
+
+        self.assertEqual(coalescer.drain(now=11.0), {})
+        ready = coalescer.drain(now=12.6)
+
+        self.assertEqual(sorted(ready), [1, 2])
+        merged, other = ready[1]
+        self.assertEqual(merged['count'], 3)
+        self.assertEqual(merged['message'], 'v2 (3 events)')
+        self.assertEqual((other['count'], other['message']), (1, 'other'))
+        self.assertEqual(len(coalescer), 0)
+
+    def test_drains_in_first_seen_order(self):
+        coalescer = NotificationCoalescer(window=1.0)
+        coalescer.add(1, {'task_id': 1, 'event_type': 'task_updated', 'message': 'a'}, now=0.0)
+        coalescer.add(1, {'task_id': 2, 'event_type': 'task_updated', 'message': 'b'}, now=5.0)
+
+        self.assertEqual([n['message'] for n in coalescer.drain(now=2.0)[1]], ['a'])
+        self.assertEqual(len(coalescer), 1)
+        self.assertEqual([n['message'] for n in coalescer.drain(now=2.0, force=True)[1]], ['b'])
+
+    def test_reports_full_buffer(self):
+        coalescer = NotificationCoalescer(window=1.0, max_pending=2)
+        self.assertFalse(coalescer.add(1, {'task_id': 1, 'event_type': 'x', 'message': ''}))
+        self.assertFalse(coalescer.add(1, {'task_id': 1, 'event_type': 'x', 'message': ''}))
+        self.assertTrue(coalescer.add(1, {'task_id': 2, 'event_type': 'x', 'message': ''}))
+
+    def test_zero_window_disables(self):
+        self.assertFalse(NotificationCoalescer(window=0).enabled)
+
+
+class WorkerCoalescingTest(unittest.TestCase):
+    """Test that the worker buffers task events and stores one notification per burst."""
+
+    def setUp(self):
+        self.worker = make_worker()
+        self.worker.coalescer = NotificationCoalescer(window=2.0)
+
+    def test_burst_is_stored_once_flushed(self):
+        for title in ('One', 'Two', 'Three'):
+            self.worker._handle_task_event(*task_message('task_updated', id=5, user_id=1, task_title=title))
+        self.assertEqual(stored(self.worker, 1), [])
+
+        self.worker._flush_batches(self.worker.coalescer.drain(force=True))
+
+        [notification] = stored(self.worker, 1)
+        self.assertEqual(notification['count'], 3)
+        self.assertEqual(notification['message'], 'Task "Three" has been updated. (3 events)')
+
+    def test_full_buffer_is_written_immediately(self):
+        self.worker.coalescer.max_pending = 2
+        self.worker._handle_task_event(*task_message('task_created', id=1, user_id=1, title='A'))
+        self.worker._handle_task_event(*task_message('task_created', id=2, user_id=1, title='B'))
+        self.assertEqual(len(stored(self.worker, 1)), 2)
+
+    def test_disabled_coalescing_stores_each_event(self):
+        self.worker.coalescer = NotificationCoalescer(window=0)
+        with mock.patch.object(self.worker, '_flush_batches') as flush:
+            self.worker._handle_task_event(*task_message('task_created', id=1, user_id=1, title='A'))
+        flush.assert_not_called()
+        self.assertEqual(len(stored(self.worker, 1)), 1)
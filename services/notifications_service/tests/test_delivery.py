@@ -0,0 +1,199 @@
+import json
+import smtplib
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from aiosmtpd.controller import Controller
+from pydantic import ValidationError
+
+from app import NotificationPreferences
+from worker.delivery import DeliveryDispatcher, UnsafeDestination, check_webhook_url, is_public_address
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for delivery")
+        time.sleep(0.01)
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    """Local HTTP server answering POSTs with queued status codes (200 once they run out)."""
+
+    def __init__(self):
+        self.statuses = []
+        self.received = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.received.append((self.headers['Host'], json.loads(body)))
+                self.send_response(receiver.statuses.pop(0) if receiver.statuses else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/hook"
+
+
+class SmtpSink:
+    """aiosmtpd handler keeping every accepted message."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('bounce'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode()))
+        return '250 OK'
+
+
+class DeliveryTest(unittest.TestCase):
+    """Test webhook and email delivery against a local HTTP receiver and SMTP sink."""
+
+    def setUp(self):
+        self.receiver = WebhookReceiver()
+        threading.Thread(target=self.receiver.serve_forever, daemon=True).start()
+        self.addCleanup(self.receiver.server_close)
+        self.addCleanup(self.receiver.shutdown)
+
+        self.sink = SmtpSink()
+        self.smtp = Controller(self.sink, hostname='127.0.0.1', port=free_port())
+        self.smtp.start()
+        self.addCleanup(self.smtp.stop)
+
+        for name, value in (('DELIVERY_BACKOFF_BASE', 0.01), ('SMTP_BATCH_WAIT', 0.05)):
+            patcher = mock.patch(f'worker.delivery.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.dispatcher = DeliveryDispatcher(smtp_host='127.0.0.1', smtp_port=self.smtp.port, allow_local=True)
+        self.dispatcher.start()
+        self.addCleanup(self.dispatcher.stop)
+
+    def submit(self, user_id, channels, **preferences):
+        self.dispatcher.submit(user_id, {'title': 'Hello', 'message': f'for {user_id}'},
+                               {'channels': channels, **preferences})
+
+    def test_webhook_is_posted(self):
+        self.submit(1, 'webhook', webhook_url=self.receiver.url)
+        wait_for(lambda: self.dispatcher.stats['delivered'] == 1)
+        [(host, body)] = self.receiver.received
+        self.assertEqual(host, self.receiver.url.split('/')[2])
+        self.assertEqual(body, {'user_id': 1, 'notification': {'title': 'Hello', 'message': 'for 1'}})
+
+    def test_host_limits_are_dropped_when_idle(self):
+        for user_id in range(3):
+            self.submit(user_id, 'webhook', webhook_url=self.receiver.url)
+        wait_for(lambda: self.dispatcher.stats['delivered'] == 3)
+        self.assertEqual(len(self.dispatcher._host_limits), 0)
+
+    def test_server_errors_are_retried_and_client_errors_are_not(self):
+        self.receiver.statuses = [503, 500]
+        self.submit(1, 'webhook', webhook_url=self.receiver.url)
+        wait_for(lambda: self.dispatcher.stats['delivered'] == 1)
+        self.assertEqual(self.dispatcher.stats['retried'], 2)
+
+        self.receiver.statuses = [404]
+        self.submit(2, 'webhook', webhook_url=self.receiver.url)
+        wait_for(lambda: self.dispatcher.stats['failed'] == 1)
+        self.assertEqual(self.dispatcher.stats['retried'], 2)
+
+    def test_gives_up_after_max_attempts(self):
+        self.receiver.statuses = [500] * 10
+        with mock.patch('worker.delivery.DELIVERY_MAX_ATTEMPTS', 3):
+            self.submit(1, 'webhook', webhook_url=self.receiver.url)
+            wait_for(lambda: self.dispatcher.stats['failed'] == 1)
+        self.assertEqual(len(self.receiver.received), 3)
+
+    def test_emails_are_batched_into_one_session(self):
+        for user_id in range(3):
+            self.submit(user_id, 'email', email=f'user{user_id}@example.com')
+        self.submit(9, 'email', email='bounce@example.com')
+        wait_for(lambda: self.dispatcher.stats['delivered'] + self.dispatcher.stats['failed'] == 4)
+
+        self.assertEqual(self.dispatcher.stats['failed'], 1)
+        self.assertEqual(sorted(rcpt for (rcpt,), _ in self.sink.messages),
+                         ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+        self.assertIn('Subject: Hello', self.sink.messages[0][1])
+
+    def test_stop_waits_for_email_batches_in_flight(self):
+        send_message = smtplib.SMTP.send_message
+
+        def slow_send(smtp, message):
+            time.sleep(0.2)
+            return send_message(smtp, message)
+
+        with mock.patch.object(smtplib.SMTP, 'send_message', autospec=True, side_effect=slow_send):
+            self.submit(1, 'email', email='user1@example.com')
+            wait_for(lambda: self.dispatcher._email_batches)
+            self.dispatcher.stop()
+        self.assertEqual(self.dispatcher.stats['delivered'], 1)
+        self.assertEqual(len(self.sink.messages), 1)
+
+    def test_invalid_email_is_not_sent(self):
+        self.submit(1, 'email', email='not an address\r\nBcc: x@example.com')
+        self.assertEqual(self.dispatcher.stats['failed'], 1)
+        time.sleep(0.2)
+        self.assertEqual(self.sink.messages, [])
+
+
+class WebhookDestinationTest(unittest.TestCase):
+    """Test that webhooks can't be pointed at internal addresses."""
+
+    def test_url_checks(self):
+        self.assertEqual(check_webhook_url('https://hooks.example.com/x'), 'https://hooks.example.com/x')
+        for url in ('http://hooks.example.com/x', 'https://10.0.0.5/x', 'https://127.0.0.1/x',
+                    'https://[::1]/x', 'https://169.254.169.254/latest', 'https://user:pw@example.com/',
+                    'ftp://example.com/'):
+            with self.assertRaises(UnsafeDestination, msg=url):
+                check_webhook_url(url)
+        self.assertEqual(check_webhook_url('http://127.0.0.1:8080/x', allow_local=True), 'http://127.0.0.1:8080/x')
+
+    def test_public_addresses(self):
+        self.assertTrue(is_public_address('93.184.216.34'))
+        for address in ('10.1.2.3', '172.16.0.1', '192.168.1.1', '127.0.0.1', '169.254.0.1', '100.64.0.1',
+                        '0.0.0.0', '::1', 'fe80::1%eth0', 'fc00::1', '::ffff:127.0.0.1', '224.0.0.1'):
+            self.assertFalse(is_public_address(address), address)
+
+    def test_names_resolving_to_private_addresses_are_rejected(self):
+        dispatcher = DeliveryDispatcher(smtp_host='')
+        dispatcher.start()
+        self.addCleanup(dispatcher.stop)
+        with mock.patch('worker.delivery.log_error') as log_error:
+            dispatcher.submit(1, {'title': 'x'}, {'channels': 'webhook', 'webhook_url': 'https://localhost/hook'})
+            wait_for(lambda: dispatcher.stats['failed'] == 1)
+        self.assertIn('resolves to', log_error.call_args.kwargs['error'])
+
+    def test_preferences_validate_addresses(self):
+        preferences = NotificationPreferences(channels=['email', 'webhook'], email='a@example.com',
+                                              webhook_url='https://hooks.example.com/x')
+        self.assertEqual(preferences.to_storage()['webhook_url'], 'https://hooks.example.com/x')
+        for fields in ({'email': 'nope'}, {'webhook_url': 'http://hooks.example.com/'},
+                       {'webhook_url': 'https://192.168.0.10/'}):
+            with self.assertRaises(ValidationError, msg=fields):
+                NotificationPreferences(**fields)
+
+        stored = NotificationPreferences.from_storage({'channels': 'webhook', 'webhook_url': 'http://10.0.0.1/'})
+        self.assertIsNone(stored.webhook_url)
+        self.assertEqual(stored.channels, ['webhook'])
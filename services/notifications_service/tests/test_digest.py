@@ -0,0 +1,74 @@
+import time
+import unittest
+from unittest import mock
+
+import redis
+
+from worker.coalescer import NotificationCoalescer
+from worker.store import DIGEST_DUE_KEY
+
+from .support import make_worker, stored, task_message
+
+
+class DigestTest(unittest.TestCase):
+    """Test buffering info notifications into digests and flushing them."""
+
+    def setUp(self):
+        self.worker = make_worker()
+        self.worker.coalescer = NotificationCoalescer(window=0)
+        self.store = self.worker.store
+        self.store.set_preferences(1, {'digest_interval': 60})
+
+    def _events(self, user_id, *titles):
+        for task_id, title in enumerate(titles):
+            self.worker._handle_task_event(*task_message('task_updated', id=task_id, user_id=user_id,
+                                                         task_title=title))
+
+    def _make_due(self, user_id):
+        self.store.redis_client.zadd(DIGEST_DUE_KEY, {user_id: 0})
+
+    def test_info_notifications_are_buffered_for_digest_users(self):
+        self._events(1, 'A', 'B')
+        self._events(2, 'C')
+        self.worker._handle_task_event(*task_message('task_overdue', id=9, user_id=1, task_title='Late'))
+
+        self.assertEqual([n['event_type'] for n in stored(self.worker, 1)], ['task_overdue'])
+        self.assertEqual(len(stored(self.worker, 2)), 1)
+        flush_at = self.store.redis_client.zscore(DIGEST_DUE_KEY, 1)
+        self.assertAlmostEqual(flush_at, time.time() + 60, delta=5)
+
+    def test_flush_stores_one_summary(self):
+        self._events(1, 'A', 'B', 'C')
+        self._make_due(1)
+
+        self.worker._flush_digests()
+
+        [digest] = stored(self.worker, 1)
+        self.assertEqual(digest['event_type'], 'digest')
+        self.assertEqual(digest['counts'], {'task_updated': 3})
+        self.assertEqual(digest['message'], '3 updates: 3 x Task Updated.')
+        self.assertEqual(len(digest['samples']), 3)
+        self.assertEqual(self.store.take_digests([1]), {})
+        self.assertIsNone(self.store.redis_client.zscore(DIGEST_DUE_KEY, 1))
+
+    def test_users_not_due_are_left_buffered(self):
+        self._events(1, 'A')
+        self.worker._flush_digests()
+        self.assertEqual(stored(self.worker, 1), [])
+
+    def test_failed_push_keeps_the_digest(self):
+        self._events(1, 'A', 'B')
+        self._make_due(1)
+
+        with mock.patch.object(self.store, 'push_many', side_effect=redis.ConnectionError('down')):
+            self.worker._flush_digests()
+        self.assertEqual(stored(self.worker, 1), [])
+        self.assertIsNotNone(self.store.redis_client.zscore(DIGEST_DUE_KEY, 1))
+
+        # Events arriving before the retry are added to the claimed buffer
+        self._events(1, 'C')
+        self.worker._flush_digests()
+
+        [digest] = stored(self.worker, 1)
+        self.assertEqual(digest['counts'], {'task_updated': 3})
+        self.assertEqual(self.store.take_digests([1]), {})
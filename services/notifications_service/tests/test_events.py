@@ -0,0 +1,51 @@
+import unittest
+
+from worker.events import (
+    BINARY_CONTENT_TYPE, InvalidEvent, decode_notification_event, decode_task_event, encode_notification_event,
+    encode_task_event,
+)
+
+
+class EventCodecTest(unittest.TestCase):
+    """Test that the binary codec round-trips events and rejects bodies it can't represent or parse."""
+
+    def test_round_trip(self):
+        body = encode_task_event('task_due_soon', {'id': 7, 'user_id': 3, 'title': 'Ship it',
+                                                   'due_date': '2024-01-02T03:04:05+00:00', 'status': 'todo'})
+        self.assertEqual(decode_task_event(BINARY_CONTENT_TYPE, body), ('task_due_soon', {
+            'id': 7, 'user_id': 3, 'title': 'Ship it', 'task_title': 'Ship it',
+            'due_date': '2024-01-02T03:04:05+00:00', 'status': 'todo',
+        }))
+
+        body = encode_notification_event(3, {'title': 'Hi', 'message': 'x' * 65535, 'type': 'warning'})
+        self.assertEqual(decode_notification_event(BINARY_CONTENT_TYPE, body),
+                         (3, {'title': 'Hi', 'message': 'x' * 65535, 'type': 'warning'}))
+
+    def test_strings_longer_than_their_length_field_are_refused(self):
+        with self.assertRaises(ValueError):
+            encode_notification_event(3, {'title': 'Hi', 'message': 'x' * 65536})
+        with self.assertRaises(ValueError):
+            encode_task_event('task_created', {'id': 1, 'user_id': 1, 'title': 'é' * 40000})
+        with self.assertRaises(ValueError):
+            encode_task_event('x' * 256, {'id': 1, 'user_id': 1})
+
+    def test_truncated_bodies_are_invalid(self):
+        tasks = [encode_task_event('task_created', {'id': 1, 'user_id': 1, 'title': 'Title', **extra})
+                 for extra in ({}, {'status': 'todo'})]
+        notifications = [encode_notification_event(1, {'title': 'Title', 'message': 'Message', **extra})
+                         for extra in ({}, {'source': 'x'})]
+        for cut in range(1, 12):
+            for body in tasks:
+                with self.assertRaises(InvalidEvent):
+                    decode_task_event(BINARY_CONTENT_TYPE, body[:-cut])
+            for body in notifications:
+                with self.assertRaises(InvalidEvent):
+                    decode_notification_event(BINARY_CONTENT_TYPE, body[:-cut])
+
+    def test_extra_must_be_an_object(self):
+        with self.assertRaises(InvalidEvent):
+            decode_task_event('application/json', b'{"type": "task_created", "data": [1]}')
+        body = bytearray(encode_notification_event(1, {'title': '', 'message': '', 'source': 'x'}))
+        body[-len(b'{"source":"x"}'):] = b'["source","x"]'
+        with self.assertRaises(InvalidEvent):
+            decode_notification_event(BINARY_CONTENT_TYPE, bytes(body))
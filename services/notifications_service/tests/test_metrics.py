@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+import fakeredis
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import app as notifications_app
+from worker.coalescer import NotificationCoalescer
+from worker.store import NotificationStore
+
+from .support import make_worker, task_message
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class WorkerMetricsTest(unittest.TestCase):
+    """Test the counters and histograms recorded while consuming."""
+
+    def test_message_outcomes_and_latency(self):
+        worker = make_worker()
+        worker.coalescer = NotificationCoalescer(window=0)
+        channel = mock.Mock()
+        ok = sample('notifications_messages_total', queue='task_events', outcome='ok')
+        dead = sample('notifications_messages_total', queue='task_events', outcome='dead')
+        latency = sample('notifications_event_processing_seconds_count', event_type='task_created')
+        pushes = sample('notifications_redis_operation_seconds_count', operation='push_many')
+
+        properties, body = task_message('task_created', id=1, user_id=1, task_title='A')
+        properties.headers = {'x-published-at': 1.0}
+        worker._on_message('task_events', channel, mock.Mock(delivery_tag=1), properties, body)
+        worker._on_message('task_events', channel, mock.Mock(delivery_tag=2),
+                           *task_message('task_created', id=2))
+
+        self.assertEqual(sample('notifications_messages_total', queue='task_events', outcome='ok'), ok + 1)
+        self.assertEqual(sample('notifications_messages_total', queue='task_events', outcome='dead'), dead + 1)
+        self.assertEqual(sample('notifications_event_processing_seconds_count', event_type='task_created'),
+                         latency + 1)
+        self.assertEqual(sample('notifications_redis_operation_seconds_count', operation='push_many'), pushes + 1)
+        self.assertGreater(sample('notifications_consumer_lag_seconds_sum', queue='task_events'), 0)
+
+
+class HttpMetricsTest(unittest.TestCase):
+    """Test request latency labels and the scrape endpoint."""
+
+    def setUp(self):
+        store = NotificationStore(fakeredis.FakeRedis(server=fakeredis.FakeServer()))
+        notifications_app.app.dependency_overrides[notifications_app.get_store] = lambda: store
+        self.addCleanup(notifications_app.app.dependency_overrides.clear)
+        self.client = TestClient(notifications_app.app)
+
+    def test_latency_is_labelled_by_route_template(self):
+        route = '/notifications/{user_id}'
+        before = sample('notifications_http_request_seconds_count', method='GET', route=route, status='200')
+        for user_id in (1, 2, 3):
+            self.assertEqual(self.client.get(f'/notifications/{user_id}').status_code, 200)
+        self.assertEqual(sample('notifications_http_request_seconds_count', method='GET', route=route,
+                                status='200'), before + 3)
+        self.assertIsNone(REGISTRY.get_sample_value('notifications_http_request_seconds_count',
+                                                    {'method': 'GET', 'route': '/notifications/1', 'status': '200'}))
+
+    def test_scrape_endpoint(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('notifications_messages_total', response.text)
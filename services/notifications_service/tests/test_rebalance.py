@@ -0,0 +1,125 @@
+import json
+import unittest
+from unittest import mock
+
+import fakeredis
+import redis
+
+from worker.rebalance import _merge_users, rebalance
+from worker.sharding import HashRing, ShardedNotificationStore
+from worker.store import NotificationStore
+
+OLD = ['redis://node-a:6379', 'redis://node-b:6379']
+NEW = OLD + ['redis://node-c:6379']
+
+
+class RebalanceTest(unittest.TestCase):
+    """Test moving users between Redis nodes, each a separate fakeredis server."""
+
+    def setUp(self):
+        patcher = mock.patch('redis.from_url', fakeredis.FakeRedis.from_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.nodes = {url: redis.from_url(url) for url in NEW}
+        for client in self.nodes.values():
+            client.flushall()
+
+        old_ring, new_ring = HashRing(OLD), HashRing(NEW)
+        self.moving = [u for u in range(1, 200) if old_ring.get_node(u) != new_ring.get_node(u)][:5]
+        self.user_id = self.moving[0]
+        self.source = NotificationStore(self.nodes[old_ring.get_node(self.user_id)])
+        self.target = NotificationStore(self.nodes[new_ring.get_node(self.user_id)])
+
+    @staticmethod
+    def _notifications(store, user_id):
+        items, _ = store.page(user_id, 0, 1000)
+        return [(json.loads(item)['id'], json.loads(item)['message']) for item in items]
+
+    def test_moves_only_users_whose_node_changed(self):
+        old_store = ShardedNotificationStore(OLD)
+        for user_id in range(1, 200):
+            old_store.push(user_id, [{'message': f'{user_id}'}])
+
+        moved = rebalance(OLD, NEW)
+
+        self.assertEqual(sum(moved.values()), sum(1 for u in range(1, 200)
+                                                  if HashRing(OLD).get_node(u) != HashRing(NEW).get_node(u)))
+        new_store = ShardedNotificationStore(NEW)
+        for user_id in range(1, 200):
+            self.assertEqual(self._notifications(new_store, user_id), [('1', str(user_id))])
+        self.assertEqual(rebalance(OLD, NEW), {url: 0 for url in NEW})
+
+    def test_merges_with_notifications_already_on_the_target(self):
+        self.source.push(self.user_id, [{'message': 'old 1'}, {'message': 'old 2'}, {'message': 'old 3'}])
+        self.source.mark_read(self.user_id, ['2'])
+        self.source.set_preferences(self.user_id, {'channels': 'email', 'email': 'old@example.com'})
+        # Pushed and read on the new node after the ring changed, before the move
+        self.target.push(self.user_id, [{'message': 'new 1'}, {'message': 'new 2'}])
+        self.target.mark_read(self.user_id, ['1'])
+        self.target.set_preferences(self.user_id, {'channels': 'webhook'})
+
+        rebalance(OLD, NEW)
+
+        self.assertEqual(self._notifications(self.target, self.user_id), [
+            ('5', 'new 2'), ('4', 'new 1'), ('3', 'old 3'), ('2', 'old 2'), ('1', 'old 1'),
+        ])
+        read = self.target.redis_client
+        self.assertTrue(read.exists(self.target.read_key(self.user_id, '4')))
+        self.assertTrue(read.exists(self.target.read_key(self.user_id, '2')))
+        self.assertFalse(read.exists(self.target.read_key(self.user_id, '1')))
+        self.assertEqual(self.target.get_preferences_many([self.user_id])[self.user_id], {'channels': 'webhook'})
+        self.assertEqual(self.source.redis_client.keys(f'notifications:*:{self.user_id}*'), [])
+
+        # Ids carry on from the merged counter
+        self.assertEqual(self.target.push(self.user_id, [{'message': 'next'}]), 6)
+        items, newest, _, _ = self.target.since(self.user_id, 4, 10)
+        self.assertEqual([json.loads(item)['message'] for item in items], ['next', 'new 2'])
+
+    def test_second_run_picks_up_writes_to_the_old_node(self):
+        self.source.push(self.user_id, [{'message': 'a'}])
+        rebalance(OLD, NEW)
+        # A worker still on the old ring
+        self.source.push(self.user_id, [{'message': 'late'}])
+
+        rebalance(OLD, NEW)
+
+        self.assertEqual([m for _, m in self._notifications(self.target, self.user_id)], ['a', 'late'])
+        self.assertEqual([i for i, _ in self._notifications(self.target, self.user_id)], ['2', '1'])
+
+    def test_merges_digest_buffers(self):
+        self.source.buffer_digest({self.user_id: [{'event_type': 'task_updated', 'message': 'x'}]},
+                                  {self.user_id: 0})
+        self.target.buffer_digest({self.user_id: [{'event_type': 'task_updated', 'message': 'y', 'count': 2}]},
+                                  {self.user_id: 0})
+
+        rebalance(OLD, NEW)
+
+        counts, samples = self.target.take_digests([self.user_id])[self.user_id]
+        self.assertEqual(counts, {'task_updated': 3})
+        self.assertEqual(samples, ['y', 'x'])
+
+    def test_failed_merge_puts_users_back(self):
+        for user_id in self.moving:
+            NotificationStore(self.nodes[HashRing(OLD).get_node(user_id)]).push(user_id, [{'message': 'kept'}])
+
+        calls = []
+
+        def target_goes_away(client, user_ids, taken):
+            calls.append(client)
+            if len(calls) == 1:
+                raise redis.ConnectionError('target went away')
+            return _merge_users(client, user_ids, taken)
+
+        with mock.patch('worker.rebalance._merge_users', side_effect=target_goes_away):
+            with self.assertRaises(redis.ConnectionError):
+                rebalance(OLD, NEW)
+
+        old_store = ShardedNotificationStore(OLD)
+        for user_id in self.moving:
+            self.assertEqual([m for _, m in self._notifications(old_store, user_id)], ['kept'])
+
+    def test_dry_run_changes_nothing(self):
+        self.source.push(self.user_id, [{'message': 'a'}])
+        moved = rebalance(OLD, NEW, dry_run=True)
+        self.assertEqual(sum(moved.values()), 1)
+        self.assertEqual(self._notifications(self.source, self.user_id), [('1', 'a')])
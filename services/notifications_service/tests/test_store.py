@@ -0,0 +1,105 @@
+import json
+import unittest
+
+import fakeredis
+
+from worker.store import NotificationStore
+
+
+class NotificationStoreSinceTest(unittest.TestCase):
+    """Test reading notifications newer than a seen id."""
+
+    def setUp(self):
+        self.store = NotificationStore(fakeredis.FakeRedis())
+
+    def _push(self, user_id, count):
+        for start in range(0, count, 50):
+            self.store.push(user_id, [{'message': str(i)} for i in range(start, min(start + 50, count))])
+
+    @staticmethod
+    def _ids(items):
+        return [int(json.loads(item)['id']) for item in items]
+
+    def test_since_returns_oldest_new_items_first_page(self):
+        self._push(1, 30)
+        items, newest, has_more, truncated = self.store.since(1, 5, 10)
+        self.assertEqual(self._ids(items), list(range(15, 5, -1)))
+        self.assertEqual(newest, 15)
+        self.assertTrue(has_more)
+        self.assertFalse(truncated)
+
+        items, newest, has_more, truncated = self.store.since(1, 25, 10)
+        self.assertEqual(self._ids(items), [30, 29, 28, 27, 26])
+        self.assertEqual(newest, 30)
+        self.assertFalse(has_more)
+
+    def test_nothing_new(self):
+        self._push(1, 3)
+        self.assertEqual(self.store.since(1, 3, 10), ([], None, False, False))
+
+    def test_gap_longer_than_the_list_is_clamped_and_flagged(self):
+        self._push(1, 300)
+        self.assertEqual(self.store.redis_client.llen(NotificationStore.list_key(1)), 100)
+
+        for since in (0, 150):
+            items, newest, has_more, truncated = self.store.since(1, since, 20)
+            # The oldest notifications still stored: ids 201..220
+            self.assertEqual(self._ids(items), list(range(220, 200, -1)))
+            self.assertEqual(newest, 220)
+            self.assertTrue(has_more)
+            self.assertTrue(truncated)
+
+        # Following on from there reads the rest without a gap
+        items, newest, has_more, truncated = self.store.since(1, 220, 100)
+        self.assertEqual(self._ids(items), list(range(300, 220, -1)))
+        self.assertFalse(has_more)
+        self.assertFalse(truncated)
+
+    def test_cleared_list_moves_past_the_gap(self):
+        self._push(1, 10)
+        self.store.clear(1)
+        self.assertEqual(self.store.since(1, 4, 20), ([], 10, False, True))
+
+    def test_since_ahead_of_head_restarts(self):
+        self._push(1, 3)
+        items, newest, _, truncated = self.store.since(1, 99, 10)
+        self.assertEqual(self._ids(items), [3, 2, 1])
+        self.assertEqual(newest, 3)
+        self.assertFalse(truncated)
+
+
+class NotificationStoreTest(unittest.TestCase):
+    """Test pushes, pages and cursors."""
+
+    def setUp(self):
+        self.store = NotificationStore(fakeredis.FakeRedis(), max_items=10)
+
+    def test_push_assigns_contiguous_ids(self):
+        first = [{'message': 'a'}, {'message': 'b'}]
+        self.assertEqual(self.store.push(7, first), 2)
+        self.assertEqual([n['id'] for n in first], ['1', '2'])
+        self.assertEqual(self.store.push_many({7: [{'message': 'c'}], 8: [{}]}), {7: 3, 8: 1})
+
+        items, total = self.store.page(7, 0, 10)
+        self.assertEqual(total, 3)
+        self.assertEqual([json.loads(item)['message'] for item in items], ['c', 'b', 'a'])
+        self.assertEqual(json.loads(self.store.page(8, 0, 1)[0][0]), {'id': '1'})
+
+    def test_list_is_trimmed(self):
+        self.store.push(1, [{'message': str(i)} for i in range(25)])
+        items, total = self.store.page(1, 0, 100)
+        self.assertEqual(total, 10)
+        self.assertEqual(json.loads(items[0])['id'], '25')
+
+    def test_before_pages_are_stable_while_pushing(self):
+        self.store.push(1, [{'message': str(i)} for i in range(8)])
+        items, cursor = self.store.before(1, 0, 3)
+        self.assertEqual([json.loads(i)['id'] for i in items], ['8', '7', '6'])
+        self.assertEqual(cursor, 6)
+
+        self.store.push(1, [{'message': 'new'}])
+        items, cursor = self.store.before(1, cursor, 3)
+        self.assertEqual([json.loads(i)['id'] for i in items], ['5', '4', '3'])
+        items, cursor = self.store.before(1, cursor, 3)
+        self.assertEqual([json.loads(i)['id'] for i in items], ['2', '1'])
+        self.assertIsNone(cursor)
@@ -0,0 +1,158 @@
+import json
+import unittest
+from unittest import mock
+
+import pika
+import redis
+
+from worker import notification_worker
+from worker.coalescer import NotificationCoalescer
+from worker.events import InvalidEvent, encode_notification_event
+
+from .support import make_worker, stored, task_message
+
+
+def deliver(worker, queue, properties, body, tag):
+    worker._on_message(queue, worker.channel, mock.Mock(delivery_tag=tag), properties, body)
+
+
+class RetryRoutingTest(unittest.TestCase):
+    """Test that failed messages go to delay queues and then the dead-letter queue."""
+
+    def setUp(self):
+        self.worker = make_worker()
+        self.worker.coalescer = NotificationCoalescer(window=0)
+        self.worker.channel = mock.Mock()
+
+    def published(self):
+        call = self.worker.channel.basic_publish.call_args
+        return call.kwargs['routing_key'], call.kwargs['properties'].headers
+
+    def test_handler_errors_are_retried_with_growing_delays(self):
+        properties, body = task_message('task_created', id=1, user_id=1, task_title='A')
+        with mock.patch.object(self.worker.store, 'push_many', side_effect=redis.ConnectionError('down')):
+            for retries in range(len(notification_worker.RETRY_DELAYS)):
+                properties.headers = {'x-retry-count': retries} if retries else {}
+                deliver(self.worker, 'task_events', properties, body, tag=retries)
+                target, headers = self.published()
+                self.assertEqual(target, f'task_events.retry.{retries}')
+                self.assertEqual(headers['x-retry-count'], retries + 1)
+                self.assertIn('down', headers['x-last-error'])
+
+            properties.headers = {'x-retry-count': len(notification_worker.RETRY_DELAYS)}
+            deliver(self.worker, 'task_events', properties, body, tag=99)
+        self.assertEqual(self.published()[0], 'task_events.dead')
+        # Every message was acked once it had been re-published
+        self.assertEqual(self.worker.channel.basic_ack.call_count, len(notification_worker.RETRY_DELAYS) + 1)
+
+    def test_invalid_events_go_straight_to_dead_letter(self):
+        properties, body = task_message('task_created', id=1, title='No user')
+        deliver(self.worker, 'task_events', properties, body, tag=1)
+        self.assertEqual(self.published()[0], 'task_events.dead')
+
+        properties.content_type = 'application/x-taskflow-event'
+        deliver(self.worker, 'notification_events', properties, b'garbage', tag=2)
+        self.assertEqual(self.published()[0], 'notification_events.dead')
+
+        body = encode_notification_event(1, {'title': 'Title', 'message': 'Cut short'})
+        deliver(self.worker, 'notification_events', properties, body[:-3], tag=3)
+        self.assertEqual(self.published()[0], 'notification_events.dead')
+
+    def test_message_is_requeued_when_republishing_fails(self):
+        self.worker.channel.basic_publish.side_effect = pika.exceptions.AMQPError('broker gone')
+        properties, body = task_message('task_created', id=1, title='No user')
+        deliver(self.worker, 'task_events', properties, body, tag=7)
+        self.worker.channel.basic_nack.assert_called_once_with(7, requeue=True)
+        self.worker.channel.basic_ack.assert_not_called()
+
+    def test_successful_direct_notification_is_acked(self):
+        properties = mock.Mock(content_type='application/json', headers={}, timestamp=None)
+        body = json.dumps({'user_id': 3, 'notification': {'title': 'Hi', 'message': 'there'}}).encode()
+        deliver(self.worker, 'notification_events', properties, body, tag=5)
+        self.worker.channel.basic_ack.assert_called_once_with(5)
+        self.assertEqual(stored(self.worker, 3)[0]['title'], 'Hi')
+
+
+class CoalescedAckTest(unittest.TestCase):
+    """Test that coalesced messages are acked only once their notification is stored."""
+
+    def setUp(self):
+        self.worker = make_worker()
+        self.worker.coalescer = NotificationCoalescer(window=2.0)
+        self.worker.channel = mock.Mock()
+        self.worker.running = True
+
+    def deliver_updates(self, tags):
+        for tag in tags:
+            deliver(self.worker, 'task_events', *task_message('task_updated', id=1, user_id=1, task_title='A'), tag=tag)
+
+    def test_acked_after_flush(self):
+        self.deliver_updates([1, 2, 3])
+        self.worker.channel.basic_ack.assert_not_called()
+
+        self.worker._flush_batches(self.worker.coalescer.drain(force=True))
+
+        self.assertEqual([c.args for c in self.worker.channel.basic_ack.call_args_list], [(1,), (2,), (3,)])
+        self.assertEqual(stored(self.worker, 1)[0]['count'], 3)
+        self.assertEqual(self.worker._held, 0)
+
+    def test_failed_flush_keeps_messages_unacked_and_retries(self):
+        self.deliver_updates([1, 2])
+        with mock.patch.object(self.worker.store, 'push_many', side_effect=redis.ConnectionError('down')):
+            self.worker._flush_batches(self.worker.coalescer.drain(force=True))
+        self.worker.channel.basic_ack.assert_not_called()
+        self.assertEqual(self.worker._held, 2)
+
+        self.worker._flush_batches(self.worker.coalescer.drain(force=True))
+        self.assertEqual(self.worker.channel.basic_ack.call_count, 2)
+        self.assertEqual(len(stored(self.worker, 1)), 1)
+
+    def test_flushes_when_prefetch_is_full(self):
+        with mock.patch.object(notification_worker, 'PREFETCH_COUNT', 3):
+            self.deliver_updates([1, 2])
+            self.worker.channel.basic_ack.assert_not_called()
+            self.deliver_updates([3])
+        self.assertEqual(self.worker.channel.basic_ack.call_count, 3)
+
+    def test_reconnect_drops_held_messages(self):
+        self.deliver_updates([1, 2])
+        self.worker.rabbitmq_connection = mock.Mock(is_open=True)
+
+        self.worker._close_connection()
+
+        self.assertEqual(len(self.worker.coalescer), 0)
+        self.assertEqual(self.worker._held, 0)
+        # Redelivered by the broker and stored then, not now
+        self.assertEqual(stored(self.worker, 1), [])
+
+
+class ReconnectTest(unittest.TestCase):
+    """Test that each connection gets one set of timers."""
+
+    def test_timers_are_scheduled_once_per_connection(self):
+        worker = make_worker()
+        connections = []
+
+        def connect(params):
+            connection = mock.Mock(is_closed=False, is_open=True)
+            channel = connection.channel.return_value
+            if len(connections) < 2:
+                channel.start_consuming.side_effect = pika.exceptions.ChannelClosedByBroker(406, 'bad ack')
+            else:
+                def stop():
+                    worker.running = False
+                channel.start_consuming.side_effect = stop
+            connections.append(connection)
+            return connection
+
+        worker.running = True
+        with mock.patch('pika.BlockingConnection', side_effect=connect), \
+                mock.patch.object(worker._stop_event, 'wait'), mock.patch('builtins.print'):
+            worker._run()
+
+        self.assertEqual(len(connections), 3)
+        for connection in connections:
+            # Coalescer flush, digest flush and queue depth poll
+            self.assertEqual(connection.call_later.call_count, 3)
+        for connection in connections[:2]:
+            connection.close.assert_called_once()
@@ -0,0 +1,12 @@
+from .notification_worker import NotificationWorker
+from .reminder_scheduler import ReminderScheduler
+from .sharding import HashRing, ShardedNotificationStore
+from .store import NotificationStore
+
+__all__ = [
+    'HashRing',
+    'NotificationWorker',
+    'NotificationStore',
+    'ReminderScheduler',
+    'ShardedNotificationStore',
+]
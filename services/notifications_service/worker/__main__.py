@@ -0,0 +1,73 @@
+"""
+Standalone notification worker process.
+
+    python -m worker
+
+Consumes task and notification events and runs the due-date reminder
+scheduler outside the API's HTTP workers, so API processes can be scaled
+and reloaded independently. SIGTERM/SIGINT stop it after the consumer has
+flushed coalesced notifications. Metrics are served on WORKER_METRICS_PORT.
+"""
+
+import logging
+import signal
+import sys
+import threading
+
+import pika
+import redis
+from decouple import config
+from prometheus_client import start_http_server
+
+from . import NotificationWorker, ReminderScheduler, ShardedNotificationStore
+
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379')
+RABBITMQ_URL = config('RABBITMQ_URL', default='amqp://localhost:5672')
+REDIS_SHARD_URLS = config('REDIS_SHARD_URLS', default=REDIS_URL).split(',')
+REMINDER_SCHEDULER_ENABLED = config('REMINDER_SCHEDULER_ENABLED', default=True, cast=bool)
+WORKER_METRICS_PORT = config('WORKER_METRICS_PORT', default=9100, cast=int)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+
+
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format='%(message)s')
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+
+    start_http_server(WORKER_METRICS_PORT)
+    redis_client = redis.from_url(REDIS_URL)
+    redis_client.ping()
+    store = ShardedNotificationStore(REDIS_SHARD_URLS)
+    store.ping()
+
+    params = pika.URLParameters(RABBITMQ_URL)
+    worker = NotificationWorker(redis_client, pika.BlockingConnection(params), store=store,
+                                connection_params=params)
+    worker.start()
+    scheduler = None
+    if REMINDER_SCHEDULER_ENABLED:
+        scheduler = ReminderScheduler(redis_client, pika.BlockingConnection(params))
+        scheduler.start()
+
+    # Exit non-zero if the consumer thread dies so the supervisor restarts us
+    healthy = True
+    while not stop.wait(5):
+        if not worker.thread.is_alive():
+            healthy = False
+            break
+
+    if scheduler:
+        scheduler.stop()
+        if not scheduler.rabbitmq_connection.is_closed:
+            scheduler.rabbitmq_connection.close()
+    worker.stop()
+    if worker.rabbitmq_connection and not worker.rabbitmq_connection.is_closed:
+        worker.rabbitmq_connection.close()
+    store.close()
+    redis_client.close()
+    return 0 if healthy else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Coalescing buffer that merges bursts of task events into single notifications.
+"""
+
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class NotificationCoalescer:
+    """Merge notifications for the same (user, task, event type) within a window.
+
+    Each added notification may carry an ``_acks`` list (e.g. the delivery
+    tags of its messages); merged notifications keep the acks of every
+    event they replace, so the caller can acknowledge them once stored.
+    """
+
+    def __init__(self, window: float, max_pending: int = 10000):
+        self.window = window
+        self.max_pending = max_pending
+        # Insertion order equals first-seen order, so due entries are always at the front
+        self._pending: Dict[Tuple[int, Any, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id: int, notification: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """Buffer a notification; returns True when the buffer is full and should be flushed."""
+        now = time.monotonic() if now is None else now
+        key = (user_id, notification.get('task_id'), notification.get('event_type'))
+
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = {
+                    'user_id': user_id,
+                    'notification': notification,
+                    'count': 1,
+                    'first_seen': now,
+                }
+            else:
+                # Show the latest task data
+                if '_acks' in entry['notification']:
+                    notification['_acks'] = entry['notification']['_acks'] + notification.get('_acks', [])
+                entry['notification'] = notification
+                entry['count'] += 1
+            return len(self._pending) >= self.max_pending
+
+    def drain(self, now: Optional[float] = None, force: bool = False) -> Dict[int, List[Dict[str, Any]]]:
+        """Remove entries whose window has elapsed and return them grouped by user."""
+        now = time.monotonic() if now is None else now
+        deadline = now - self.window
+        ready: Dict[int, List[Dict[str, Any]]] = {}
+
+        with self._lock:
+            for key in list(self._pending):
+                entry = self._pending[key]
+                if not force and entry['first_seen'] > deadline:
+                    break
+                del self._pending[key]
+                ready.setdefault(entry['user_id'], []).append(self._finalize(entry))
+
+        return ready
+
+    @staticmethod
+    def _finalize(entry: Dict[str, Any]) -> Dict[str, Any]:
+        notification = entry['notification']
+        count = entry['count']
+        notification['count'] = count
+        if count > 1:
+            notification['message'] = f"{notification['message']} ({count} events)"
+        return notification
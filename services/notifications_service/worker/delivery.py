@@ -0,0 +1,373 @@
+"""
+Outbound delivery of notifications over email and webhooks.
+
+The dispatcher owns an asyncio event loop on its own thread so slow SMTP
+servers or webhook receivers never block the pika consumer. The consumer
+hands jobs over with ``submit()``; the loop then:
+
+- POSTs webhooks through one pooled httpx client, with a concurrency cap per
+  destination host (kept only while the host has requests in flight)
+- groups emails into batches and sends each batch over a single SMTP session
+- retries failures with exponential backoff and jitter, up to a maximum
+  number of attempts
+
+``stop()`` waits for email batches already handed to SMTP to finish.
+
+Webhook URLs are user input, so they must be https, and the host is
+resolved before each POST: if any address is private, loopback,
+link-local or otherwise not public the job is rejected, and the request
+goes to the checked address (with the original Host and TLS server name)
+so the name can't resolve somewhere else in between. Redirects are not
+followed. WEBHOOK_ALLOW_LOCAL lifts both checks for local development.
+"""
+
+import asyncio
+import ipaddress
+import random
+import smtplib
+import socket
+import threading
+from contextlib import asynccontextmanager
+from email.message import EmailMessage
+from typing import Dict, Any, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from decouple import config
+from email_validator import EmailNotValidError, validate_email
+
+from .log import log_error
+
+DELIVERY_QUEUE_SIZE = config('DELIVERY_QUEUE_SIZE', default=10000, cast=int)
+DELIVERY_CONCURRENCY = config('DELIVERY_CONCURRENCY', default=50, cast=int)
+DELIVERY_PER_HOST_LIMIT = config('DELIVERY_PER_HOST_LIMIT', default=10, cast=int)
+DELIVERY_MAX_ATTEMPTS = config('DELIVERY_MAX_ATTEMPTS', default=5, cast=int)
+DELIVERY_BACKOFF_BASE = config('DELIVERY_BACKOFF_BASE', default=1.0, cast=float)
+DELIVERY_BACKOFF_MAX = config('DELIVERY_BACKOFF_MAX', default=300.0, cast=float)
+WEBHOOK_TIMEOUT = config('WEBHOOK_TIMEOUT', default=5.0, cast=float)
+# Local development only: allow http:// and private or loopback webhook destinations
+WEBHOOK_ALLOW_LOCAL = config('WEBHOOK_ALLOW_LOCAL', default=False, cast=bool)
+
+SMTP_HOST = config('SMTP_HOST', default='')
+SMTP_PORT = config('SMTP_PORT', default=25, cast=int)
+SMTP_USER = config('SMTP_USER', default='')
+SMTP_PASSWORD = config('SMTP_PASSWORD', default='')
+SMTP_USE_TLS = config('SMTP_USE_TLS', default=False, cast=bool)
+SMTP_FROM = config('SMTP_FROM', default='notifications@taskflow.local')
+SMTP_BATCH_SIZE = config('SMTP_BATCH_SIZE', default=50, cast=int)
+SMTP_BATCH_WAIT = config('SMTP_BATCH_WAIT', default=0.5, cast=float)
+SMTP_MAX_SESSIONS = config('SMTP_MAX_SESSIONS', default=4, cast=int)
+
+CHANNELS = ('email', 'webhook')
+
+
+class UnsafeDestination(ValueError):
+    """Raised for webhook URLs that must not be called."""
+
+
+def check_webhook_url(url: str, allow_local: bool = WEBHOOK_ALLOW_LOCAL) -> str:
+    """Validate the form of a webhook URL and return it; the host is checked again when resolved."""
+    parts = urlsplit(url)
+    if parts.scheme != 'https' and not (allow_local and parts.scheme == 'http'):
+        raise UnsafeDestination("Webhook URLs must use https")
+    if not parts.hostname:
+        raise UnsafeDestination("Webhook URL has no host")
+    if parts.username or parts.password:
+        raise UnsafeDestination("Webhook URLs can't contain credentials")
+    try:
+        address = ipaddress.ip_address(parts.hostname)
+    except ValueError:
+        return url
+    if not allow_local and not is_public_address(address):
+        raise UnsafeDestination(f"Webhook host {parts.hostname} is not a public address")
+    return url
+
+
+def is_public_address(address) -> bool:
+    """Whether an IP address is globally routable (not private, loopback, link-local, reserved...)."""
+    if isinstance(address, str):
+        address = ipaddress.ip_address(address.split('%')[0])
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def check_email(address: str) -> str:
+    """Normalize an email address; raises EmailNotValidError for invalid ones."""
+    return validate_email(address, check_deliverability=False).normalized
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given (1-based) attempt."""
+    delay = min(DELIVERY_BACKOFF_BASE * (2 ** (attempt - 1)), DELIVERY_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class HostLimits:
+    """Per-host concurrency caps; a host's semaphore is dropped when its last request finishes."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._hosts: Dict[str, Tuple[asyncio.Semaphore, int]] = {}
+
+    def __len__(self):
+        return len(self._hosts)
+
+    @asynccontextmanager
+    async def hold(self, host: str):
+        semaphore, users = self._hosts.get(host, (None, 0))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit)
+        self._hosts[host] = (semaphore, users + 1)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            semaphore, users = self._hosts[host]
+            if users == 1:
+                del self._hosts[host]
+            else:
+                self._hosts[host] = (semaphore, users - 1)
+
+
+class DeliveryDispatcher:
+    """Asyncio dispatcher for email and webhook notifications."""
+
+    def __init__(self, smtp_host: str = SMTP_HOST, smtp_port: int = SMTP_PORT,
+                 allow_local: bool = WEBHOOK_ALLOW_LOCAL):
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.allow_local = allow_local
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread = None
+        self._ready = threading.Event()
+        self._queue: Optional[asyncio.Queue] = None
+        self._email_queue: Optional[asyncio.Queue] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._host_limits = HostLimits(DELIVERY_PER_HOST_LIMIT)
+        self._email_batches: Set[asyncio.Task] = set()
+        self._smtp_sessions: Optional[asyncio.Semaphore] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self.stats = {'delivered': 0, 'retried': 0, 'failed': 0, 'dropped': 0}
+
+    def start(self):
+        """Start the event loop thread."""
+        if self.thread and self.thread.is_alive():
+            return
+        self._ready.clear()
+        self.thread = threading.Thread(target=self._run_loop, name='delivery-dispatcher')
+        self.thread.daemon = True
+        self.thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        """Stop accepting jobs and shut the loop down."""
+        if self.loop and self._stopping:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+        if self.thread:
+            self.thread.join()
+
+    def submit(self, user_id: int, notification: Dict[str, Any], preferences: Dict[str, str]):
+        """Queue a notification on every channel the user enabled (thread-safe)."""
+        if not self.loop:
+            return
+        for channel in preferences.get('channels', '').split(','):
+            destination = preferences.get('webhook_url' if channel == 'webhook' else channel)
+            if channel not in CHANNELS or not destination:
+                continue
+            if channel == 'email' and not self.smtp_host:
+                continue
+            try:
+                if channel == 'email':
+                    destination = check_email(destination)
+                else:
+                    check_webhook_url(destination, self.allow_local)
+            except (EmailNotValidError, UnsafeDestination) as e:
+                # Stored before preferences were validated
+                self.stats['failed'] += 1
+                log_error('delivery_rejected', channel=channel, user_id=user_id, error=str(e))
+                continue
+            job = {
+                'channel': channel,
+                'destination': destination,
+                'user_id': user_id,
+                'notification': notification,
+                'attempt': 0,
+            }
+            self.loop.call_soon_threadsafe(self._enqueue, job)
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+            self.loop = None
+
+    async def _main(self):
+        self._queue = asyncio.Queue(maxsize=DELIVERY_QUEUE_SIZE)
+        self._email_queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._smtp_sessions = asyncio.Semaphore(SMTP_MAX_SESSIONS)
+        self._http = httpx.AsyncClient(
+            timeout=WEBHOOK_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=DELIVERY_CONCURRENCY,
+                max_keepalive_connections=DELIVERY_CONCURRENCY
+            ),
+        )
+        tasks = [asyncio.create_task(self._consume()) for _ in range(DELIVERY_CONCURRENCY)]
+        tasks.append(asyncio.create_task(self._batch_emails()))
+        self._ready.set()
+
+        await self._stopping.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Batches already handed to SMTP finish rather than being dropped with the loop
+        await asyncio.gather(*self._email_batches, return_exceptions=True)
+        await self._http.aclose()
+
+    def _enqueue(self, job: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            log_error('delivery_dropped', channel=job['channel'], user_id=job['user_id'])
+
+    def _retry(self, job: Dict[str, Any], error: Exception):
+        """Schedule another attempt with backoff, or give up."""
+        job['attempt'] += 1
+        if job['attempt'] >= DELIVERY_MAX_ATTEMPTS:
+            self.stats['failed'] += 1
+            log_error('delivery_failed', channel=job['channel'], destination=job['destination'],
+                      attempts=job['attempt'], error=str(error))
+            return
+        self.stats['retried'] += 1
+        self.loop.call_later(backoff_delay(job['attempt']), self._enqueue, job)
+
+    async def _consume(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job['channel'] == 'webhook':
+                    await self._send_webhook(job)
+                else:
+                    await self._email_queue.put(job)
+            finally:
+                self._queue.task_done()
+
+    async def _send_webhook(self, job: Dict[str, Any]):
+        try:
+            url, headers, extensions = await self._resolve_webhook(job['destination'])
+        except UnsafeDestination as e:
+            self.stats['failed'] += 1
+            log_error('delivery_rejected', channel='webhook', destination=job['destination'], error=str(e))
+            return
+        except OSError as e:
+            # DNS failure
+            self._retry(job, e)
+            return
+
+        async with self._host_limits.hold(urlsplit(job['destination']).netloc):
+            try:
+                response = await self._http.post(url, headers=headers, extensions=extensions, json={
+                    'user_id': job['user_id'],
+                    'notification': job['notification'],
+                })
+            except httpx.HTTPError as e:
+                self._retry(job, e)
+                return
+
+        if response.status_code < 300:
+            self.stats['delivered'] += 1
+        elif response.status_code == 429 or response.status_code >= 500:
+            self._retry(job, Exception(f"HTTP {response.status_code}"))
+        else:
+            # Client errors will not succeed on retry
+            self.stats['failed'] += 1
+            log_error('delivery_rejected', channel='webhook', destination=job['destination'],
+                      status=response.status_code)
+
+    async def _resolve_webhook(self, destination: str) -> Tuple[str, Dict[str, str], Dict[str, str]]:
+        """Resolve and check a webhook host; returns (url pinned to the address, headers, extensions)."""
+        check_webhook_url(destination, self.allow_local)
+        parts = urlsplit(destination)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        infos = await self.loop.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+        addresses = [info[4][0] for info in infos]
+        if not self.allow_local:
+            for address in addresses:
+                if not is_public_address(address):
+                    raise UnsafeDestination(f"Webhook host {parts.hostname} resolves to {address}")
+
+        address = addresses[0]
+        host = f"[{address}]" if ':' in address else address
+        url = parts._replace(netloc=f"{host}:{port}").geturl()
+        extensions = {'sni_hostname': parts.hostname} if parts.scheme == 'https' else {}
+        return url, {'Host': parts.netloc}, extensions
+
+    async def _batch_emails(self):
+        """Group queued emails so each SMTP session sends many messages."""
+        while True:
+            batch = [await self._email_queue.get()]
+            deadline = self.loop.time() + SMTP_BATCH_WAIT
+            while len(batch) < SMTP_BATCH_SIZE:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._email_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._smtp_sessions.acquire()
+            # The loop only keeps weak references to tasks
+            task = asyncio.create_task(self._send_email_batch(batch))
+            self._email_batches.add(task)
+            task.add_done_callback(self._email_batches.discard)
+
+    async def _send_email_batch(self, batch: List[Dict[str, Any]]):
+        try:
+            retryable, rejected = await asyncio.to_thread(self._smtp_send, batch)
+        except (smtplib.SMTPException, OSError) as e:
+            # The whole session failed; retry every message
+            retryable, rejected = [(job, e) for job in batch], []
+        finally:
+            self._smtp_sessions.release()
+
+        self.stats['delivered'] += len(batch) - len(retryable) - len(rejected)
+        self.stats['failed'] += len(rejected)
+        for job, error in rejected:
+            log_error('delivery_rejected', channel='email', destination=job['destination'], error=str(error))
+        for job, error in retryable:
+            self._retry(job, error)
+
+    def _smtp_send(self, batch: List[Dict[str, Any]]):
+        """Send a batch over one SMTP session.
+
+        Returns (retryable, rejected) lists of (job, error) pairs.
+        """
+        retryable, rejected = [], []
+        with smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=WEBHOOK_TIMEOUT) as smtp:
+            if SMTP_USE_TLS:
+                smtp.starttls()
+            if SMTP_USER:
+                smtp.login(SMTP_USER, SMTP_PASSWORD)
+            for job in batch:
+                notification = job['notification']
+                message = EmailMessage()
+                message['From'] = SMTP_FROM
+                message['To'] = job['destination']
+                message['Subject'] = notification.get('title', 'TaskFlow notification')
+                message.set_content(notification.get('message', ''))
+                try:
+                    smtp.send_message(message)
+                except smtplib.SMTPRecipientsRefused as e:
+                    rejected.append((job, e))
+                except smtplib.SMTPResponseException as e:
+                    if 400 <= e.smtp_code < 500:
+                        retryable.append((job, e))
+                    else:
+                        rejected.append((job, e))
+        return retryable, rejected
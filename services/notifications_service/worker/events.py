@@ -0,0 +1,25 @@
+"""
+Versioned schema for messages on the ``task_events`` and ``notification_events`` queues.
+
+The codec lives in ``taskflow_common.events``, shared with the tasks
+service; this module re-exports it with this service's producer encoding.
+"""
+
+from typing import Dict, Any, Tuple
+
+from decouple import config
+from taskflow_common import events as codec
+from taskflow_common.events import (  # noqa: F401
+    BINARY_CONTENT_TYPE, EVENT_TYPE_CODES, EVENT_TYPE_NAMES, HEADER, JSON_CONTENT_TYPE, KIND_NOTIFICATION,
+    KIND_TASK, LEVEL_CODES, LEVEL_NAMES, MAGIC, NO_DATE, NOTIFICATION_V1, SCHEMA_VERSION, TASK_V1,
+    InvalidEvent, decode_notification_event, decode_task_event, encode_notification_event, encode_task_event,
+)
+
+# Encoding used by producers in this service; set to 'json' while rolling out to older consumers
+EVENT_ENCODING = config('EVENT_ENCODING', default='binary')
+
+
+def task_event_message(event_type: str, data: Dict[str, Any],
+                       encoding: str = EVENT_ENCODING) -> Tuple[str, bytes]:
+    """Return (content_type, body) for publishing a task event."""
+    return codec.task_event_message(event_type, data, encoding)
@@ -0,0 +1,36 @@
+"""
+Low-overhead structured logging for the message hot path.
+
+Per-message events are sampled at LOG_SAMPLE_RATE and written as one JSON
+object per line; errors are always logged.
+"""
+
+import json
+import logging
+import random
+import time
+
+from decouple import config
+
+LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', default=0.01, cast=float)
+
+logger = logging.getLogger('notifications')
+
+
+def _emit(level: int, event: str, fields: dict):
+    record = {'ts': round(time.time(), 3), 'level': logging.getLevelName(level), 'event': event}
+    record.update(fields)
+    logger.log(level, json.dumps(record, default=str))
+
+
+def log_sampled(event: str, **fields):
+    """Log a hot-path event for a random sample of calls."""
+    if LOG_SAMPLE_RATE <= 0 or (LOG_SAMPLE_RATE < 1 and random.random() >= LOG_SAMPLE_RATE):
+        return
+    if logger.isEnabledFor(logging.INFO):
+        _emit(logging.INFO, event, dict(fields, sample_rate=LOG_SAMPLE_RATE))
+
+
+def log_error(event: str, **fields):
+    """Log an error event unconditionally."""
+    _emit(logging.ERROR, event, fields)
@@ -0,0 +1,64 @@
+"""
+Prometheus metrics for the notifications service.
+"""
+
+import functools
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+EVENT_LATENCY = Histogram(
+    'notifications_event_processing_seconds',
+    'Time to process one message, by event type',
+    ['event_type'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+REDIS_LATENCY = Histogram(
+    'notifications_redis_operation_seconds',
+    'Redis round-trip time by store operation',
+    ['operation'],
+    buckets=(.0002, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+)
+QUEUE_DEPTH = Gauge(
+    'notifications_queue_depth',
+    'Messages waiting in each RabbitMQ queue',
+    ['queue']
+)
+CONSUMER_LAG = Histogram(
+    'notifications_consumer_lag_seconds',
+    'Time between publish and start of processing',
+    ['queue'],
+    buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+BATCH_SIZE = Histogram(
+    'notifications_batch_size',
+    'Items per batched write or publish',
+    ['stage'],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+)
+MESSAGES = Counter(
+    'notifications_messages_total',
+    'Consumed messages by outcome',
+    ['queue', 'outcome']
+)
+HTTP_LATENCY = Histogram(
+    'notifications_http_request_seconds',
+    'HTTP endpoint latency',
+    ['method', 'route', 'status']
+)
+
+
+def observe_redis(operation: str):
+    """Decorator recording the wall time of a store method under `operation`."""
+    histogram = REDIS_LATENCY.labels(operation=operation)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -2,25 +2,74 @@
 Notification worker for processing events and sending notifications.
 """
 
-import json
+import random
 import time
 import threading
 from datetime import datetime
-from typing import Dict, Any
+from functools import partial
+from typing import Dict, Any, List
 import pika
 import redis
 from decouple import config
 
+from . import tracing
+from .coalescer import NotificationCoalescer
+from .delivery import DeliveryDispatcher
+from .events import InvalidEvent, decode_notification_event, decode_task_event
+from .log import log_error, log_sampled
+from .metrics import BATCH_SIZE, CONSUMER_LAG, EVENT_LATENCY, MESSAGES, QUEUE_DEPTH
+from .preferences import PreferenceCache
+from .store import NotificationStore
+
+# Seconds to merge repeated events for the same user/task/event type (0 disables)
+COALESCE_WINDOW = config('NOTIFICATION_COALESCE_WINDOW', default=2.0, cast=float)
+COALESCE_MAX_PENDING = config('NOTIFICATION_COALESCE_MAX_PENDING', default=10000, cast=int)
+
+# Digest mode: info notifications for opted-in users are summarised every digest_interval
+DIGEST_DEFAULT_INTERVAL = config('DIGEST_DEFAULT_INTERVAL', default=0, cast=int)
+DIGEST_FLUSH_INTERVAL = config('DIGEST_FLUSH_INTERVAL', default=30.0, cast=float)
+DIGEST_FLUSH_BATCH = config('DIGEST_FLUSH_BATCH', default=500, cast=int)
+PREFERENCES_CACHE_TTL = config('PREFERENCES_CACHE_TTL', default=60.0, cast=float)
+
+# Failed messages are re-published to <queue>.retry.<n> (TTL = delay, dead-lettered
+# back to <queue>) and moved to <queue>.dead once the delays are used up
+RETRY_DELAYS = [int(d) for d in config('MESSAGE_RETRY_DELAYS', default='5,30,300').split(',')]
+# Unacked messages per consumer. Coalesced task events stay unacked until their
+# notification is stored, so this also caps the coalescing buffer: it is flushed
+# early once it holds this many messages, and delivery pauses while Redis is down.
+PREFETCH_COUNT = config('RABBITMQ_PREFETCH_COUNT', default=200, cast=int)
+RECONNECT_BACKOFF_BASE = config('RECONNECT_BACKOFF_BASE', default=1.0, cast=float)
+RECONNECT_BACKOFF_MAX = config('RECONNECT_BACKOFF_MAX', default=60.0, cast=float)
+QUEUE_DEPTH_POLL_INTERVAL = config('QUEUE_DEPTH_POLL_INTERVAL', default=15.0, cast=float)
+
 
 class NotificationWorker:
     """Worker class for processing notifications."""
     
-    def __init__(self, redis_client: redis.Redis, rabbitmq_connection: pika.BlockingConnection):
+    def __init__(self, redis_client: redis.Redis, rabbitmq_connection: pika.BlockingConnection,
+                 store=None, connection_params: pika.connection.Parameters = None):
         self.redis_client = redis_client
+        # Either a NotificationStore or a ShardedNotificationStore
+        self.store = store or NotificationStore(redis_client)
         self.rabbitmq_connection = rabbitmq_connection
+        # Used to reconnect when the broker connection drops
+        self.connection_params = connection_params
         self.channel = None
         self.running = False
         self.thread = None
+        self._stop_event = threading.Event()
+        # Coalesced notifications a flush could not write, and the delivery tags of their messages
+        self._unflushed: Dict[int, List[Dict[str, Any]]] = {}
+        self._unflushed_acks: List[int] = []
+        # Messages consumed but not acked yet, because their notification is still buffered
+        self._held = 0
+        self.handlers = {
+            'task_events': self._handle_task_event,
+            'notification_events': self._handle_notification_event,
+        }
+        self.coalescer = NotificationCoalescer(COALESCE_WINDOW, COALESCE_MAX_PENDING)
+        self.preferences = PreferenceCache(self.store, ttl=PREFERENCES_CACHE_TTL)
+        self.dispatcher = DeliveryDispatcher()
         
         # Notification templates
         self.templates = {
@@ -62,6 +111,8 @@ class NotificationWorker:
             return
         
         self.running = True
+        self._stop_event.clear()
+        self.dispatcher.start()
         self.thread = threading.Thread(target=self._run)
         self.thread.daemon = True
         self.thread.start()
@@ -70,82 +121,262 @@ class NotificationWorker:
     def stop(self):
         """Stop the notification worker."""
         self.running = False
+        self._stop_event.set()
         if self.thread:
             self.thread.join()
         if self.channel and not self.channel.is_closed:
             self.channel.close()
+        self.dispatcher.stop()
         print("Notification worker stopped")
     
     def _run(self):
-        """Main worker loop."""
+        """Main worker loop; reconnects with backoff instead of recursing.
+        
+        Every attempt gets a new connection, so the timers scheduled on the
+        previous one die with it instead of piling up.
+        """
+        attempt = 0
+        while self.running:
+            try:
+                if self.rabbitmq_connection is None or self.rabbitmq_connection.is_closed:
+                    self.rabbitmq_connection = pika.BlockingConnection(self.connection_params)
+                self.channel = self.rabbitmq_connection.channel()
+                self.channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+                
+                # Declare queues and set up consumers with manual acks
+                for queue in self.handlers:
+                    self._declare_queues(queue)
+                    self.channel.basic_consume(
+                        queue=queue,
+                        on_message_callback=partial(self._on_message, queue)
+                    )
+                
+                # Flush coalesced notifications and due digests from the consumer thread
+                self._schedule_flush()
+                self.rabbitmq_connection.call_later(DIGEST_FLUSH_INTERVAL, self._flush_digests)
+                self._poll_queue_depth()
+                
+                attempt = 0
+                print("Waiting for messages. To exit press CTRL+C")
+                self.channel.start_consuming()
+                
+            except Exception as e:
+                if not self.running:
+                    break
+                self._close_connection()
+                delay = min(RECONNECT_BACKOFF_BASE * (2 ** attempt), RECONNECT_BACKOFF_MAX)
+                delay *= random.uniform(0.5, 1.0)
+                attempt += 1
+                print(f"Error in notification worker: {e}; reconnecting in {delay:.1f}s")
+                self._stop_event.wait(delay)
+    
+    def _close_connection(self):
+        """Close the broker connection after an error and forget unacked work.
+        
+        The broker redelivers every unacked message to the next connection, and
+        their delivery tags are not valid there, so buffered notifications are
+        dropped rather than stored twice.
+        """
         try:
-            self.channel = self.rabbitmq_connection.channel()
-            
-            # Declare queues
-            self.channel.queue_declare(queue='task_events', durable=True)
-            self.channel.queue_declare(queue='notification_events', durable=True)
-            
-            # Set up consumers
-            self.channel.basic_consume(
-                queue='task_events',
-                on_message_callback=self._process_task_event,
-                auto_ack=True
-            )
-            
-            self.channel.basic_consume(
-                queue='notification_events',
-                on_message_callback=self._process_notification_event,
-                auto_ack=True
-            )
-            
-            print("Waiting for messages. To exit press CTRL+C")
-            self.channel.start_consuming()
-            
+            if self.rabbitmq_connection is not None and self.rabbitmq_connection.is_open:
+                self.rabbitmq_connection.close()
         except Exception as e:
-            print(f"Error in notification worker: {e}")
-            if self.running:
-                # Retry after a delay
-                time.sleep(5)
-                self._run()
-    
-    def _process_task_event(self, channel, method, properties, body):
-        """Process task-related events."""
+            log_error('connection_close_failed', error=str(e))
+        self.rabbitmq_connection = None
+        self.channel = None
+        self.coalescer.drain(force=True)
+        self._unflushed, self._unflushed_acks, self._held = {}, [], 0
+    
+    def _declare_queues(self, queue: str):
+        """Declare a queue with its retry (delay) queues and dead-letter queue."""
+        self.channel.queue_declare(queue=queue, durable=True)
+        self.channel.queue_declare(queue=f"{queue}.dead", durable=True)
+        for index, delay in enumerate(RETRY_DELAYS):
+            self.channel.queue_declare(queue=f"{queue}.retry.{index}", durable=True, arguments={
+                'x-message-ttl': delay * 1000,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': queue,
+            })
+    
+    def _poll_queue_depth(self):
+        """Record queue depths with passive declares on the consumer channel."""
         try:
-            event_data = json.loads(body)
-            event_type = event_data.get('type')
-            task_data = event_data.get('data', {})
-            user_id = task_data.get('user_id')
-            
-            if not user_id:
-                print(f"No user_id in event: {event_data}")
-                return
-            
-            # Generate notification based on event type
-            notification = self._create_notification(event_type, task_data)
-            if notification:
-                self._store_notification(user_id, notification)
-                print(f"Processed task event: {event_type} for user {user_id}")
-            
+            for queue in self.handlers:
+                result = self.channel.queue_declare(queue=queue, passive=True)
+                QUEUE_DEPTH.labels(queue=queue).set(result.method.message_count)
         except Exception as e:
-            print(f"Error processing task event: {e}")
+            log_error('queue_depth_failed', error=str(e))
+        if self.running:
+            self.rabbitmq_connection.call_later(QUEUE_DEPTH_POLL_INTERVAL, self._poll_queue_depth)
     
-    def _process_notification_event(self, channel, method, properties, body):
-        """Process direct notification events."""
+    def _on_message(self, queue, channel, method, properties, body):
+        """Run the handler for a message, then ack it.
+        
+        Handlers that buffer a notification keep the message unacked; it is
+        acked by the flush that stores it. Failures are re-published to a delay
+        queue (or the dead-letter queue) before the ack, so one bad message
+        never blocks the rest of the queue.
+        """
+        start = time.perf_counter()
+        published_at = (properties.headers or {}).get('x-published-at') or properties.timestamp
+        if published_at:
+            CONSUMER_LAG.labels(queue=queue).observe(max(time.time() - float(published_at), 0))
+        
         try:
-            event_data = json.loads(body)
-            user_id = event_data.get('user_id')
-            notification_data = event_data.get('notification', {})
-            
-            if not user_id or not notification_data:
-                print(f"Invalid notification event: {event_data}")
+            with tracing.start_span(f'{queue}.consume', parent=tracing.extract(properties.headers),
+                                    queue=queue) as span:
+                event_type, held = self.handlers[queue](properties, body, method.delivery_tag)
+                span.set('event_type', event_type)
+            EVENT_LATENCY.labels(event_type=event_type or 'ignored').observe(time.perf_counter() - start)
+            MESSAGES.labels(queue=queue, outcome='ok').inc()
+            if held:
+                return
+        except Exception as e:
+            try:
+                target = self._retry_or_dead_letter(channel, queue, properties, body, e)
+                MESSAGES.labels(queue=queue, outcome='dead' if target.endswith('.dead') else 'retry').inc()
+            except Exception as publish_error:
+                log_error('republish_failed', queue=queue, error=str(publish_error))
+                MESSAGES.labels(queue=queue, outcome='requeued').inc()
+                channel.basic_nack(method.delivery_tag, requeue=True)
                 return
-            
-            # Store the notification
-            self._store_notification(user_id, notification_data)
-            print(f"Processed notification event for user {user_id}")
-            
+        channel.basic_ack(method.delivery_tag)
+    
+    def _retry_or_dead_letter(self, channel, queue, properties, body, error: Exception) -> str:
+        headers = dict(properties.headers or {})
+        retries = int(headers.get('x-retry-count', 0))
+        headers['x-last-error'] = str(error)[:500]
+        
+        # Undecodable or invalid payloads (ValueError, incl. InvalidEvent) will never succeed
+        if isinstance(error, ValueError) or retries >= len(RETRY_DELAYS):
+            target = f"{queue}.dead"
+        else:
+            target = f"{queue}.retry.{retries}"
+            headers['x-retry-count'] = retries + 1
+        
+        channel.basic_publish(
+            exchange='',
+            routing_key=target,
+            body=body,
+            properties=pika.BasicProperties(
+                content_type=properties.content_type,
+                delivery_mode=2,
+                headers=headers
+            )
+        )
+        log_error('message_failed', queue=queue, target=target, retries=retries, error=str(error))
+        return target
+    
+    def _schedule_flush(self):
+        """Schedule the next coalescer flush on the connection's timer."""
+        interval = self.coalescer.window / 2 if self.coalescer.enabled else 1.0
+        self.rabbitmq_connection.call_later(interval, self._flush_pending)
+    
+    def _flush_pending(self):
+        """Store coalesced notifications whose window has elapsed."""
+        force = not self.running
+        self._flush_batches(self.coalescer.drain(force=force))
+        
+        if self.running:
+            self._schedule_flush()
+        elif self.channel and self.channel.is_open:
+            self.channel.stop_consuming()
+    
+    def _flush_batches(self, batches: Dict[int, List[Dict[str, Any]]]):
+        """Write drained coalescer batches, then ack their messages.
+        
+        If Redis fails the batches are kept, still unacked, for the next flush;
+        once PREFETCH_COUNT messages are held the broker stops delivering more.
+        """
+        # Retry anything a previous flush could not write
+        for user_id, notifications in self._unflushed.items():
+            batches.setdefault(user_id, [])[:0] = notifications
+        acks = self._unflushed_acks + [
+            tag for notifications in batches.values() for n in notifications for tag in n.pop('_acks', ())
+        ]
+        self._unflushed, self._unflushed_acks = {}, []
+        if batches:
+            BATCH_SIZE.labels(stage='coalesce_flush').observe(sum(len(n) for n in batches.values()))
+        
+        try:
+            self._store_batches(batches)
+        except Exception as e:
+            self._unflushed, self._unflushed_acks = batches, acks
+            log_error('flush_failed', pending=sum(len(n) for n in batches.values()), held=self._held,
+                      error=str(e))
+            return
+        
+        for tag in acks:
+            self.channel.basic_ack(tag)
+        self._held -= len(acks)
+    
+    def _flush_digests(self):
+        """Collapse due digest buffers into one summary notification per user."""
+        try:
+            while True:
+                user_ids = self.store.pop_due_digests(time.time(), DIGEST_FLUSH_BATCH)
+                if not user_ids:
+                    break
+                BATCH_SIZE.labels(stage='digest_flush').observe(len(user_ids))
+                digests = self.store.take_digests(user_ids)
+                try:
+                    if digests:
+                        self._push({
+                            user_id: [self._create_digest_notification(counts, samples)]
+                            for user_id, (counts, samples) in digests.items()
+                        })
+                except Exception:
+                    # The claimed buffers stay in Redis; try these users again next flush
+                    self.store.retry_digests(user_ids, time.time())
+                    raise
+                self.store.ack_digests(user_ids)
+                if len(user_ids) < DIGEST_FLUSH_BATCH:
+                    break
         except Exception as e:
-            print(f"Error processing notification event: {e}")
+            log_error('digest_flush_failed', error=str(e))
+        
+        if self.running:
+            self.rabbitmq_connection.call_later(DIGEST_FLUSH_INTERVAL, self._flush_digests)
+    
+    def _handle_task_event(self, properties, body, delivery_tag=None):
+        """Process task-related events; returns (event type, whether the message is held for a flush)."""
+        event_type, task_data = decode_task_event(properties.content_type, body)
+        user_id = task_data.get('user_id')
+        
+        if not user_id:
+            raise InvalidEvent(f"No user_id in {event_type} event for task {task_data.get('id')}")
+        
+        # Generate notification based on event type
+        notification = self._create_notification(event_type, task_data)
+        if not notification:
+            return None, False
+        self._attach_trace(notification)
+        
+        held = self.coalescer.enabled
+        if held:
+            if delivery_tag is not None:
+                notification['_acks'] = [delivery_tag]
+                self._held += 1
+            if self.coalescer.add(user_id, notification) or self._held >= PREFETCH_COUNT:
+                # Buffer is full, or the broker won't send more until we ack: write everything out now
+                self._flush_batches(self.coalescer.drain(force=True))
+        else:
+            self._store_batches({user_id: [notification]})
+        log_sampled('task_event_processed', event_type=event_type, user_id=user_id)
+        return event_type, held
+    
+    def _handle_notification_event(self, properties, body, delivery_tag=None):
+        """Process direct notification events; they are stored before the message is acked."""
+        user_id, notification_data = decode_notification_event(properties.content_type, body)
+        
+        if not user_id or not notification_data:
+            raise InvalidEvent(f"Invalid notification event for user {user_id}")
+        
+        # Store the notification
+        self._attach_trace(notification_data)
+        self._store_notification(user_id, notification_data)
+        log_sampled('notification_event_processed', user_id=user_id)
+        return 'direct', False
     
     def _create_notification(self, event_type: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a notification from an event."""
@@ -161,38 +392,120 @@ class NotificationWorker:
             message = f"Task {task_data.get('title', 'Unknown')} - {template['title']}"
         
         return {
-            'id': f"{event_type}_{task_data.get('id', 'unknown')}_{int(time.time())}",
             'title': template['title'],
             'message': message,
             'type': template['type'],
             'event_type': event_type,
             'task_id': task_data.get('id'),
             'created_at': datetime.utcnow().isoformat(),
-            'read': False
+            'read': False,
+            'count': 1
+        }
+    
+    def _create_digest_notification(self, counts: Dict[str, int], samples: List[str]) -> Dict[str, Any]:
+        """Create a summary notification from digest counts."""
+        total = sum(counts.values())
+        parts = [
+            f"{count} x {self.templates.get(event_type, {}).get('title', event_type)}"
+            for event_type, count in sorted(counts.items(), key=lambda item: -item[1])
+        ]
+        return {
+            'title': 'Activity Digest',
+            'message': f"{total} updates: {', '.join(parts)}.",
+            'type': 'info',
+            'event_type': 'digest',
+            'counts': counts,
+            'samples': samples,
+            'created_at': datetime.utcnow().isoformat(),
+            'read': False,
+            'count': total
         }
     
+    def _split_digest(self, batches: Dict[int, List[Dict[str, Any]]]) -> Dict[int, List[Dict[str, Any]]]:
+        """Buffer info notifications for users in digest mode; return the rest."""
+        candidates = [
+            user_id for user_id, notifications in batches.items()
+            if any(n.get('type') == 'info' for n in notifications)
+        ]
+        if not candidates:
+            return batches
+        
+        preferences = self.preferences.get_many(candidates)
+        now = time.time()
+        immediate, digest, flush_at = {}, {}, {}
+        for user_id, notifications in batches.items():
+            interval = int(preferences.get(user_id, {}).get('digest_interval', DIGEST_DEFAULT_INTERVAL))
+            for notification in notifications:
+                if interval > 0 and notification.get('type') == 'info':
+                    digest.setdefault(user_id, []).append(notification)
+                else:
+                    immediate.setdefault(user_id, []).append(notification)
+            if user_id in digest:
+                flush_at[user_id] = now + interval
+        
+        if digest:
+            self.store.buffer_digest(digest, flush_at)
+        return immediate
+    
+    def _push(self, batches: Dict[int, List[Dict[str, Any]]]):
+        """Store notifications, then hand them to external channels users opted into."""
+        BATCH_SIZE.labels(stage='push').observe(sum(len(n) for n in batches.values()))
+        self.store.push_many(batches)
+        
+        preferences = self.preferences.get_many(list(batches))
+        for user_id, notifications in batches.items():
+            user_preferences = preferences.get(user_id)
+            if not user_preferences or not user_preferences.get('channels'):
+                continue
+            for notification in notifications:
+                self.dispatcher.submit(user_id, notification, user_preferences)
+    
+    @staticmethod
+    def _attach_trace(notification: Dict[str, Any]):
+        """Remember the consuming span on a sampled notification until it is stored."""
+        span = tracing.current_span()
+        if span is not None and span.context.sampled:
+            notification['_trace'] = (span.context, time.time_ns())
+    
+    @staticmethod
+    def _pop_traces(batches: Dict[int, List[Dict[str, Any]]]) -> list:
+        return [n.pop('_trace') for notifications in batches.values() for n in notifications if '_trace' in n]
+    
+    @staticmethod
+    def _record_store_spans(traces: list, start_ns: int):
+        """Close the trace of each sampled notification with the (possibly batched) write."""
+        end_ns = time.time_ns()
+        for parent, handled_ns in traces:
+            tracing.record_span('notification.store', parent, start_ns, end_ns,
+                                coalesce_wait_ms=(start_ns - handled_ns) / 1e6)
+    
     def _store_notification(self, user_id: int, notification: Dict[str, Any]):
         """Store notification in Redis."""
-        try:
-            notifications_key = f"notifications:user:{user_id}"
-            
-            # Store notification
-            notification_json = json.dumps(notification)
-            self.redis_client.lpush(notifications_key, notification_json)
-            
-            # Keep only last 100 notifications per user
-            self.redis_client.ltrim(notifications_key, 0, 99)
-            
-            # Set expiration (30 days)
-            self.redis_client.expire(notifications_key, 86400 * 30)
-            
-        except Exception as e:
-            print(f"Error storing notification: {e}")
+        self._store_notifications(user_id, [notification])
+    
+    def _store_notifications(self, user_id: int, notifications: List[Dict[str, Any]]):
+        """Store a batch of notifications for one user in a single round trip."""
+        # Ids come from the per-user sequence, assigned atomically with the push
+        traces, start_ns = self._pop_traces({user_id: notifications}), time.time_ns()
+        self._push({user_id: notifications})
+        self._record_store_spans(traces, start_ns)
+    
+    def _store_batches(self, batches: Dict[int, List[Dict[str, Any]]]):
+        """Store task notifications for many users, one pipeline per Redis node.
+        
+        Info notifications for users in digest mode go to their digest buffer.
+        """
+        if not batches:
+            return
+        traces, start_ns = self._pop_traces(batches), time.time_ns()
+        batches = self._split_digest(batches)
+        if batches:
+            self._push(batches)
+        self._record_store_spans(traces, start_ns)
     
     def send_notification(self, user_id: int, title: str, message: str, notification_type: str = 'info'):
         """Send a direct notification to a user."""
         notification = {
-            'id': f"direct_{int(time.time())}",
             'title': title,
             'message': message,
             'type': notification_type,
@@ -202,4 +515,4 @@ class NotificationWorker:
         }
         
         self._store_notification(user_id, notification)
-        print(f"Sent direct notification to user {user_id}: {title}")
+        log_sampled('direct_notification_sent', user_id=user_id, title=title)
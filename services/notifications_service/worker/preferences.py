@@ -0,0 +1,47 @@
+"""
+In-process cache of per-user notification preferences.
+"""
+
+import threading
+import time
+from typing import Dict, List
+
+
+class PreferenceCache:
+    """Cache user preference hashes with a short TTL to keep lookups off Redis."""
+
+    def __init__(self, store, ttl: float = 60.0, max_entries: int = 100000):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, user_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        """Return preferences for users, loading misses in one batch."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry and entry[0] > now:
+                    found[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+
+        if missing:
+            loaded = self.store.get_preferences_many(missing)
+            with self._lock:
+                if len(self._entries) + len(loaded) > self.max_entries:
+                    self._entries.clear()
+                for user_id, preferences in loaded.items():
+                    self._entries[user_id] = (now + self.ttl, preferences)
+            found.update(loaded)
+        return found
+
+    def get(self, user_id: int) -> Dict[str, str]:
+        return self.get_many([user_id])[user_id]
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
@@ -0,0 +1,245 @@
+"""
+Move notification keys after the set of Redis shards changes.
+
+Scans every old node for ``notifications:*`` keys, works out each user's
+owner on the new ring and moves the users that changed node. Run it after
+adding the new node to REDIS_SHARD_URLS; a second run picks up anything
+written to an old node while the first one was in progress.
+
+The service keeps running during a move, so both nodes can hold data for
+the same user: the API and workers already push to the new owner, and a
+worker still on the old ring may push to the old one. A user is therefore
+taken off the old node in one script (later pushes there start fresh keys
+for the next run) and merged into the new node in another, instead of
+being copied over it:
+
+- notifications already on the new node stay in front as the newest, the
+  moved ones follow, and the whole list is renumbered from the sum of both
+  id counters so ids stay contiguous and above any id a client has seen
+  (read markers follow their notification to its new id)
+- preferences on the new node win; digest counts are added up
+- read markers for notifications no longer in the list are dropped
+
+If the merge fails, the taken data is merged back into the old node.
+
+Example with local Redis processes:
+    redis-server --port 6380 --daemonize yes
+    redis-server --port 6381 --daemonize yes
+    python -m worker.rebalance \
+        --from redis://localhost:6379,redis://localhost:6380 \
+        --to redis://localhost:6379,redis://localhost:6380,redis://localhost:6381
+"""
+
+import argparse
+from typing import Dict, List, Set
+
+import redis
+
+from .sharding import HashRing
+from .store import DIGEST_SAMPLE_SIZE, NOTIFICATIONS_MAX, NOTIFICATIONS_TTL, READ_MARKER_TTL, NotificationStore
+
+# KEYS: list, seq, prefs, digest, digest samples, flushing digest, flushing
+# samples. ARGV: read marker prefix. Deletes the user's keys (and the read
+# markers of listed notifications) and returns them as JSON; a digest
+# claimed by an unfinished flush is moved as part of the buffer.
+TAKE_USER_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+local read = {}
+for _, item in ipairs(items) do
+    local id = string.match(item, '^{"id": "(%d+)"')
+    if id and redis.call('DEL', ARGV[1] .. id) == 1 then
+        table.insert(read, id)
+    end
+end
+local digest = redis.call('HGETALL', KEYS[4])
+for _, value in ipairs(redis.call('HGETALL', KEYS[6])) do
+    table.insert(digest, value)
+end
+local samples = redis.call('LRANGE', KEYS[5], 0, -1)
+for _, sample in ipairs(redis.call('LRANGE', KEYS[7], 0, -1)) do
+    table.insert(samples, sample)
+end
+local taken = cjson.encode({
+    seq = tonumber(redis.call('GET', KEYS[2]) or '0'),
+    items = items,
+    read = read,
+    prefs = redis.call('HGETALL', KEYS[3]),
+    digest = digest,
+    samples = samples,
+})
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], KEYS[7])
+return taken
+"""
+
+# KEYS: list, seq, prefs, digest, digest samples. ARGV: taken JSON, max
+# length, ttl, read marker prefix, read marker ttl, digest sample size.
+# Merges a taken user into the keys on this node; returns the new head.
+MERGE_USER_SCRIPT = """
+local taken = cjson.decode(ARGV[1])
+local max_items = tonumber(ARGV[2])
+local prefix = ARGV[4]
+local head = taken.seq + tonumber(redis.call('GET', KEYS[2]) or '0')
+
+local taken_read = {}
+for _, id in ipairs(taken.read) do
+    taken_read[id] = true
+end
+local merged = {}
+local function renumber(item, from_target)
+    local id = string.match(item, '^{"id": "(%d+)"')
+    if #merged >= max_items then
+        if id and from_target then
+            redis.call('DEL', prefix .. id)
+        end
+        return
+    end
+    local new_id = tostring(head - #merged)
+    if id then
+        item = '{"id": "' .. new_id .. '"' .. string.sub(item, #id + 10)
+        -- Newest first, so a marker never lands on one not yet renamed
+        if from_target and id ~= new_id and redis.call('EXISTS', prefix .. id) == 1 then
+            redis.call('RENAME', prefix .. id, prefix .. new_id)
+        elseif not from_target and taken_read[id] then
+            redis.call('SET', prefix .. new_id, 'true', 'EX', ARGV[5])
+        end
+    end
+    table.insert(merged, item)
+end
+for _, item in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+    renumber(item, true)
+end
+for _, item in ipairs(taken.items) do
+    renumber(item, false)
+end
+redis.call('DEL', KEYS[1])
+if #merged > 0 then
+    redis.call('RPUSH', KEYS[1], unpack(merged))
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+if head > 0 then
+    redis.call('SET', KEYS[2], head, 'EX', ARGV[3])
+end
+
+if #taken.prefs > 0 and redis.call('EXISTS', KEYS[3]) == 0 then
+    redis.call('HSET', KEYS[3], unpack(taken.prefs))
+end
+for i = 1, #taken.digest, 2 do
+    redis.call('HINCRBY', KEYS[4], taken.digest[i], taken.digest[i + 1])
+end
+if #taken.digest > 0 then
+    redis.call('EXPIRE', KEYS[4], ARGV[3])
+end
+if #taken.samples > 0 then
+    redis.call('RPUSH', KEYS[5], unpack(taken.samples))
+    redis.call('LTRIM', KEYS[5], 0, tonumber(ARGV[6]) - 1)
+    redis.call('EXPIRE', KEYS[5], ARGV[3])
+end
+return head
+"""
+
+
+def _user_keys(user_id: int) -> List[str]:
+    return [
+        NotificationStore.list_key(user_id),
+        NotificationStore.seq_key(user_id),
+        NotificationStore.prefs_key(user_id),
+        NotificationStore.digest_key(user_id),
+        NotificationStore.digest_samples_key(user_id),
+    ]
+
+
+def rebalance(old_urls: List[str], new_urls: List[str], batch_size: int = 500,
+              dry_run: bool = False) -> Dict[str, int]:
+    """Move users whose owner changed between the two rings; returns moved users per target."""
+    ring = HashRing(new_urls)
+    clients = {url: redis.from_url(url) for url in set(old_urls) | set(new_urls)}
+    moved: Dict[str, int] = {url: 0 for url in new_urls}
+
+    for source in old_urls:
+        done: Set[int] = set()
+        batch: List[bytes] = []
+        for key in clients[source].scan_iter(match='notifications:*', count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                _move_batch(clients, source, ring, batch, moved, done, dry_run)
+                batch = []
+        if batch:
+            _move_batch(clients, source, ring, batch, moved, done, dry_run)
+
+    return moved
+
+
+def _move_batch(clients, source, ring, keys, moved, done, dry_run):
+    by_target: Dict[str, List[int]] = {}
+    stale_markers = []
+    for key in keys:
+        user_id = NotificationStore.user_id_from_key(key)
+        if user_id is None:
+            continue
+        target = ring.get_node(user_id)
+        if target == source:
+            continue
+        if key.startswith(b'notifications:read:'):
+            # Markers of listed notifications move with the list; any left are for trimmed ones
+            stale_markers.append(key)
+        if user_id not in done:
+            done.add(user_id)
+            by_target.setdefault(target, []).append(user_id)
+
+    for target, user_ids in by_target.items():
+        moved[target] += len(user_ids)
+        if not dry_run:
+            _move_users(clients[source], clients[target], user_ids)
+
+    if stale_markers and not dry_run:
+        clients[source].delete(*stale_markers)
+
+
+def _move_users(source: redis.Redis, target: redis.Redis, user_ids: List[int]):
+    take = source.register_script(TAKE_USER_SCRIPT)
+    pipe = source.pipeline(transaction=False)
+    for user_id in user_ids:
+        take(keys=_user_keys(user_id) + [
+            NotificationStore.digest_flushing_key(user_id), NotificationStore.digest_samples_flushing_key(user_id),
+        ], args=[NotificationStore.read_key(user_id, '')], client=pipe)
+    taken = pipe.execute()
+
+    # Anything that didn't land on the target goes back; the next run retries it
+    try:
+        results = _merge_users(target, user_ids, taken)
+    except (redis.ConnectionError, redis.TimeoutError):
+        _merge_users(source, user_ids, taken)
+        raise
+    failed = [index for index, result in enumerate(results) if isinstance(result, Exception)]
+    if failed:
+        _merge_users(source, [user_ids[i] for i in failed], [taken[i] for i in failed])
+        raise results[failed[0]]
+
+
+def _merge_users(client: redis.Redis, user_ids: List[int], taken: List[bytes]) -> list:
+    merge = client.register_script(MERGE_USER_SCRIPT)
+    # MULTI, so a dropped connection leaves none of the batch merged rather than part of it
+    pipe = client.pipeline(transaction=True)
+    for user_id, data in zip(user_ids, taken):
+        merge(keys=_user_keys(user_id), args=[
+            data, NOTIFICATIONS_MAX, NOTIFICATIONS_TTL, NotificationStore.read_key(user_id, ''),
+            READ_MARKER_TTL, DIGEST_SAMPLE_SIZE,
+        ], client=pipe)
+    return pipe.execute(raise_on_error=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--from', dest='old', required=True, help='Comma-separated current shard URLs')
+    parser.add_argument('--to', dest='new', required=True, help='Comma-separated new shard URLs')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    moved = rebalance(args.old.split(','), args.new.split(','), args.batch_size, args.dry_run)
+    for url, count in moved.items():
+        print(f"{'Would move' if args.dry_run else 'Moved'} {count} users to {url}")
+
+
+if __name__ == '__main__':
+    main()
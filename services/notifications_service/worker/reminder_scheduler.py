@@ -0,0 +1,204 @@
+"""
+Leader-elected scheduler that turns due reminder entries into task events.
+"""
+
+import json
+import time
+import uuid
+import threading
+from typing import List, Tuple, Dict, Any, Optional
+import pika
+import redis
+from decouple import config
+
+from .events import task_event_message
+from .metrics import BATCH_SIZE
+
+REMINDER_TICK_INTERVAL = config('REMINDER_TICK_INTERVAL', default=5.0, cast=float)
+REMINDER_BATCH_SIZE = config('REMINDER_BATCH_SIZE', default=500, cast=int)
+REMINDER_LEADER_TTL = config('REMINDER_LEADER_TTL', default=30, cast=int)
+
+# Maps index member prefixes (written by the tasks service) to event types
+EVENT_TYPES = {
+    'due_soon': 'task_due_soon',
+    'overdue': 'task_overdue',
+}
+
+# Pop up to ARGV[2] members scored <= ARGV[1] and return (member, payload) pairs.
+# ZRANGEBYSCORE ... LIMIT is O(log N + M), so the cost of a tick depends on the
+# number of due reminders, not on the size of the index.
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due == 0 then
+    return {}
+end
+redis.call('ZREM', KEYS[1], unpack(due))
+local result = {}
+for _, member in ipairs(due) do
+    local sep = string.find(member, ':', 1, true)
+    local task_id = string.sub(member, sep + 1)
+    result[#result + 1] = member
+    result[#result + 1] = redis.call('HGET', KEYS[2], task_id) or false
+    if string.sub(member, 1, sep - 1) == 'overdue' then
+        redis.call('HDEL', KEYS[2], task_id)
+    end
+end
+return result
+"""
+
+# Extend the lease only if we still hold it
+RENEW_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ReminderScheduler:
+    """Publish task_due_soon / task_overdue events from the reminder index."""
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        rabbitmq_connection: pika.BlockingConnection,
+        schedule_key: str = 'reminders:schedule',
+        payload_key: str = 'reminders:payload',
+        leader_key: str = 'reminders:leader',
+        batch_size: int = REMINDER_BATCH_SIZE,
+        interval: float = REMINDER_TICK_INTERVAL,
+    ):
+        self.redis_client = redis_client
+        self.rabbitmq_connection = rabbitmq_connection
+        self.schedule_key = schedule_key
+        self.payload_key = payload_key
+        self.leader_key = leader_key
+        self.batch_size = batch_size
+        self.interval = interval
+        self.instance_id = uuid.uuid4().hex
+        self.channel = None
+        self.thread = None
+        self._stop_event = threading.Event()
+        self._pop_due = self.redis_client.register_script(POP_DUE_SCRIPT)
+        self._renew_leader = self.redis_client.register_script(RENEW_LEADER_SCRIPT)
+        self._release_leader = self.redis_client.register_script(RELEASE_LEADER_SCRIPT)
+
+    def start(self):
+        """Start the scheduler loop."""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        print("Reminder scheduler started")
+
+    def stop(self):
+        """Stop the scheduler loop and release leadership."""
+        self._stop_event.set()
+        if self.thread:
+            self.thread.join()
+        try:
+            self._release_leader(keys=[self.leader_key], args=[self.instance_id])
+        except redis.RedisError:
+            pass
+        if self.channel and not self.channel.is_closed:
+            self.channel.close()
+        print("Reminder scheduler stopped")
+
+    def _run(self):
+        """Tick while leader; followers just keep trying to take over."""
+        while not self._stop_event.is_set():
+            try:
+                if self._acquire_leadership():
+                    self.tick()
+                # Service heartbeats on our otherwise idle connection
+                self.rabbitmq_connection.process_data_events(time_limit=0)
+            except Exception as e:
+                print(f"Error in reminder scheduler: {e}")
+            self._stop_event.wait(self.interval)
+
+    def _acquire_leadership(self) -> bool:
+        """Take or renew the leader lease."""
+        ttl_ms = REMINDER_LEADER_TTL * 1000
+        if self.redis_client.set(self.leader_key, self.instance_id, nx=True, px=ttl_ms):
+            return True
+        return bool(self._renew_leader(keys=[self.leader_key], args=[self.instance_id, ttl_ms]))
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """Publish every reminder that is due, one batch at a time."""
+        now = time.time() if now is None else now
+        published = 0
+
+        while True:
+            due = self._pop_due_batch(now)
+            if not due:
+                break
+            events = self._build_events(due)
+            try:
+                self._publish_batch(events)
+            except Exception:
+                # Put the batch back so the next leader tick retries it
+                self._reschedule(due, now)
+                raise
+            published += len(events)
+            if len(due) < self.batch_size:
+                break
+
+        return published
+
+    def _pop_due_batch(self, now: float) -> List[Tuple[str, Optional[bytes]]]:
+        raw = self._pop_due(keys=[self.schedule_key, self.payload_key], args=[now, self.batch_size])
+        return [
+            (member.decode() if isinstance(member, bytes) else member, payload)
+            for member, payload in zip(raw[::2], raw[1::2])
+        ]
+
+    def _build_events(self, due: List[Tuple[str, Optional[bytes]]]) -> List[Dict[str, Any]]:
+        events = []
+        for member, payload in due:
+            kind = member.split(':', 1)[0]
+            event_type = EVENT_TYPES.get(kind)
+            if not event_type or not payload:
+                continue
+            events.append({'type': event_type, 'data': json.loads(payload)})
+        return events
+
+    def _reschedule(self, due: List[Tuple[str, Optional[bytes]]], now: float):
+        pipe = self.redis_client.pipeline(transaction=False)
+        for member, payload in due:
+            pipe.zadd(self.schedule_key, {member: now})
+            if payload:
+                pipe.hset(self.payload_key, member.split(':', 1)[1], payload)
+        pipe.execute()
+
+    def _publish_batch(self, events: List[Dict[str, Any]]):
+        """Publish a batch of reminder events to the task_events queue."""
+        if not events:
+            return
+        if self.channel is None or self.channel.is_closed:
+            self.channel = self.rabbitmq_connection.channel()
+            self.channel.queue_declare(queue='task_events', durable=True)
+
+        BATCH_SIZE.labels(stage='reminder_publish').observe(len(events))
+        published_at = time.time()
+        for event in events:
+            content_type, body = task_event_message(event['type'], event['data'])
+            self.channel.basic_publish(
+                exchange='',
+                routing_key='task_events',
+                body=body,
+                properties=pika.BasicProperties(
+                    content_type=content_type,
+                    delivery_mode=2,
+                    headers={'x-published-at': published_at}
+                )
+            )
@@ -0,0 +1,138 @@
+"""
+Consistent-hash sharding of notification storage across Redis nodes.
+
+All keys for a user (list, id counter, read markers) live on the node that
+owns ``user_id`` on the hash ring, so the per-user Lua scripts keep working
+unchanged. Adding a node moves only about 1/N of the users; see
+``worker/rebalance.py`` for moving their keys.
+"""
+
+import bisect
+import hashlib
+from typing import Dict, Any, List, Optional, Tuple
+import redis
+
+from .store import NotificationStore
+
+DEFAULT_VIRTUAL_NODES = 160
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = DEFAULT_VIRTUAL_NODES):
+        if not nodes:
+            raise ValueError("HashRing needs at least one node")
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def get_node(self, key) -> str:
+        """Return the node owning `key`."""
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[index]
+
+
+class ShardedNotificationStore:
+    """NotificationStore facade that routes each user to its Redis node."""
+
+    def __init__(self, redis_urls: List[str], **store_options):
+        self.ring = HashRing(redis_urls)
+        self.clients: Dict[str, redis.Redis] = {url: redis.from_url(url) for url in redis_urls}
+        self.stores: Dict[str, NotificationStore] = {
+            url: NotificationStore(client, **store_options) for url, client in self.clients.items()
+        }
+
+    def for_user(self, user_id: int) -> NotificationStore:
+        return self.stores[self.ring.get_node(user_id)]
+
+    def push(self, user_id: int, notifications: List[Dict[str, Any]]) -> int:
+        return self.for_user(user_id).push(user_id, notifications)
+
+    def push_many(self, batches: Dict[int, List[Dict[str, Any]]]) -> Dict[int, int]:
+        """Group batches by node and write each group with one pipeline."""
+        by_node: Dict[str, Dict[int, List[Dict[str, Any]]]] = {}
+        for user_id, notifications in batches.items():
+            by_node.setdefault(self.ring.get_node(user_id), {})[user_id] = notifications
+
+        heads = {}
+        for node, node_batches in by_node.items():
+            heads.update(self.stores[node].push_many(node_batches))
+        return heads
+
+    def page(self, user_id: int, offset: int, limit: int) -> Tuple[List[bytes], int]:
+        return self.for_user(user_id).page(user_id, offset, limit)
+
+    def since(self, user_id: int, since: int, limit: int) -> Tuple[List[bytes], Optional[int], bool, bool]:
+        return self.for_user(user_id).since(user_id, since, limit)
+
+    def before(self, user_id: int, cursor: int, limit: int) -> Tuple[List[bytes], Optional[int]]:
+        return self.for_user(user_id).before(user_id, cursor, limit)
+
+    def mark_read(self, user_id: int, notification_ids: List[str]):
+        self.for_user(user_id).mark_read(user_id, notification_ids)
+
+    def clear(self, user_id: int):
+        self.for_user(user_id).clear(user_id)
+
+    def _group_by_node(self, user_ids) -> Dict[str, List[int]]:
+        by_node: Dict[str, List[int]] = {}
+        for user_id in user_ids:
+            by_node.setdefault(self.ring.get_node(user_id), []).append(user_id)
+        return by_node
+
+    def get_preferences_many(self, user_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        preferences = {}
+        for node, node_users in self._group_by_node(user_ids).items():
+            preferences.update(self.stores[node].get_preferences_many(node_users))
+        return preferences
+
+    def set_preferences(self, user_id: int, preferences: Dict[str, Any]):
+        self.for_user(user_id).set_preferences(user_id, preferences)
+
+    def buffer_digest(self, batches: Dict[int, List[Dict[str, Any]]], flush_at: Dict[int, float]):
+        for node, node_users in self._group_by_node(batches).items():
+            self.stores[node].buffer_digest({u: batches[u] for u in node_users}, flush_at)
+
+    def pop_due_digests(self, now: float, limit: int) -> List[int]:
+        """Claim due users from every node, up to `limit` in total."""
+        users: List[int] = []
+        for store in self.stores.values():
+            if len(users) >= limit:
+                break
+            users.extend(store.pop_due_digests(now, limit - len(users)))
+        return users
+
+    def take_digests(self, user_ids: List[int]) -> Dict[int, Tuple[Dict[str, int], List[str]]]:
+        # Buffers are read through the ring, so a due entry left on an old
+        # node after a rebalance still finds the moved buffer
+        digests = {}
+        for node, node_users in self._group_by_node(user_ids).items():
+            digests.update(self.stores[node].take_digests(node_users))
+        return digests
+
+    def ack_digests(self, user_ids: List[int]):
+        for node, node_users in self._group_by_node(user_ids).items():
+            self.stores[node].ack_digests(node_users)
+
+    def retry_digests(self, user_ids: List[int], flush_at: float):
+        for node, node_users in self._group_by_node(user_ids).items():
+            self.stores[node].retry_digests(node_users, flush_at)
+
+    def ping(self):
+        """Ping every node; raises if any is unreachable."""
+        for client in self.clients.values():
+            client.ping()
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
@@ -0,0 +1,356 @@
+"""
+Redis storage for per-user notification lists.
+
+Notifications are kept newest-first in ``notifications:user:<id>``. Every
+push takes ids from a per-user counter (``notifications:seq:<id>``) inside
+the same Lua script, so ids are contiguous and the list at index ``i`` always
+holds id ``head - i``. That lets readers translate ``since``/``cursor`` ids
+straight into LRANGE bounds without decoding any stored payload.
+"""
+
+import json
+from typing import Dict, Any, List, Optional, Tuple
+import redis
+
+from .metrics import observe_redis
+
+NOTIFICATIONS_MAX = 100
+NOTIFICATIONS_TTL = 86400 * 30  # 30 days
+READ_MARKER_TTL = 86400 * 30
+DIGEST_SAMPLE_SIZE = 5
+DIGEST_DUE_KEY = 'notifications:digest:due'
+
+# KEYS: list, seq. ARGV: max length, ttl, then JSON objects without an "id".
+PUSH_SCRIPT = """
+local count = #ARGV - 2
+local seq = redis.call('INCRBY', KEYS[2], count) - count
+for i = 3, #ARGV do
+    seq = seq + 1
+    local body = ARGV[i]
+    if body == '{}' then
+        redis.call('LPUSH', KEYS[1], '{"id": "' .. seq .. '"}')
+    else
+        redis.call('LPUSH', KEYS[1], '{"id": "' .. seq .. '", ' .. string.sub(body, 2))
+    end
+end
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return seq
+"""
+
+# KEYS: list, seq. ARGV: since, limit. Returns {head, first_index, truncated,
+# items...} with the oldest `limit` notifications newer than `since`. The list
+# only keeps the newest max_items, so a gap longer than that starts at the
+# oldest stored item and sets truncated.
+SINCE_SCRIPT = """
+local head = tonumber(redis.call('GET', KEYS[2]) or '0')
+local since = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+if since > head then
+    since = 0
+end
+local new = head - since
+local truncated = 0
+local stored = redis.call('LLEN', KEYS[1])
+if new > stored then
+    new = stored
+    truncated = 1
+end
+if new <= 0 then
+    return {head, 0, truncated}
+end
+local first = math.max(new - limit, 0)
+local result = redis.call('LRANGE', KEYS[1], first, new - 1)
+table.insert(result, 1, truncated)
+table.insert(result, 1, first)
+table.insert(result, 1, head)
+return result
+"""
+
+# KEYS: list, seq. ARGV: cursor, limit. Returns {head, first_index, items...}
+# with notifications older than `cursor` (0 starts from the newest).
+BEFORE_SCRIPT = """
+local head = tonumber(redis.call('GET', KEYS[2]) or '0')
+local cursor = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local first = 0
+if cursor > 0 and cursor <= head + 1 then
+    first = head - cursor + 1
+end
+local result = redis.call('LRANGE', KEYS[1], first, first + limit - 1)
+table.insert(result, 1, first)
+table.insert(result, 1, head)
+return result
+"""
+
+# KEYS: due set. ARGV: now, limit. Atomically claims users whose digest is due.
+POP_DUE_DIGESTS_SCRIPT = """
+local users = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #users > 0 then
+    redis.call('ZREM', KEYS[1], unpack(users))
+end
+return users
+"""
+
+
+# KEYS: digest, samples, flushing digest, flushing samples. ARGV: sample size,
+# ttl. Moves the buffers to the flushing keys, adding them to anything left
+# there by a flush that failed, and returns {counts..., '', samples...}.
+TAKE_DIGEST_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('RENAME', KEYS[1], KEYS[3])
+    end
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('RENAME', KEYS[2], KEYS[4])
+    end
+else
+    local counts = redis.call('HGETALL', KEYS[1])
+    for i = 1, #counts, 2 do
+        redis.call('HINCRBY', KEYS[3], counts[i], counts[i + 1])
+    end
+    local samples = redis.call('LRANGE', KEYS[2], 0, -1)
+    for i = #samples, 1, -1 do
+        redis.call('LPUSH', KEYS[4], samples[i])
+    end
+    redis.call('LTRIM', KEYS[4], 0, tonumber(ARGV[1]) - 1)
+    redis.call('DEL', KEYS[1], KEYS[2])
+    redis.call('EXPIRE', KEYS[3], ARGV[2])
+    redis.call('EXPIRE', KEYS[4], ARGV[2])
+end
+local result = redis.call('HGETALL', KEYS[3])
+table.insert(result, '')
+for _, sample in ipairs(redis.call('LRANGE', KEYS[4], 0, -1)) do
+    table.insert(result, sample)
+end
+return result
+"""
+
+
+class NotificationStore:
+    """Read and write notification lists for users."""
+
+    def __init__(self, redis_client: redis.Redis, max_items: int = NOTIFICATIONS_MAX,
+                 ttl: int = NOTIFICATIONS_TTL):
+        self.redis_client = redis_client
+        self.max_items = max_items
+        self.ttl = ttl
+        self._push = redis_client.register_script(PUSH_SCRIPT)
+        self._since = redis_client.register_script(SINCE_SCRIPT)
+        self._before = redis_client.register_script(BEFORE_SCRIPT)
+        self._pop_due_digests = redis_client.register_script(POP_DUE_DIGESTS_SCRIPT)
+        self._take_digest = redis_client.register_script(TAKE_DIGEST_SCRIPT)
+
+    @staticmethod
+    def list_key(user_id: int) -> str:
+        return f"notifications:user:{user_id}"
+
+    @staticmethod
+    def seq_key(user_id: int) -> str:
+        return f"notifications:seq:{user_id}"
+
+    @staticmethod
+    def read_key(user_id: int, notification_id: str) -> str:
+        return f"notifications:read:{user_id}:{notification_id}"
+
+    @staticmethod
+    def prefs_key(user_id: int) -> str:
+        return f"notifications:prefs:{user_id}"
+
+    @staticmethod
+    def digest_key(user_id: int) -> str:
+        return f"notifications:digest:{user_id}"
+
+    @staticmethod
+    def digest_samples_key(user_id: int) -> str:
+        return f"notifications:digest_samples:{user_id}"
+
+    @staticmethod
+    def digest_flushing_key(user_id: int) -> str:
+        return f"notifications:digest_flushing:{user_id}"
+
+    @staticmethod
+    def digest_samples_flushing_key(user_id: int) -> str:
+        return f"notifications:digest_samples_flushing:{user_id}"
+
+    @staticmethod
+    def user_id_from_key(key) -> Optional[int]:
+        """Extract the owning user id from any per-user notification key."""
+        if isinstance(key, bytes):
+            key = key.decode()
+        parts = key.split(':')
+        if len(parts) < 3 or parts[0] != 'notifications':
+            return None
+        try:
+            return int(parts[2])
+        except ValueError:
+            return None
+
+    def push(self, user_id: int, notifications: List[Dict[str, Any]]) -> int:
+        """Append notifications (oldest first), assign their ids and return the newest id."""
+        return self.push_many({user_id: notifications})[user_id]
+
+    @observe_redis('push_many')
+    def push_many(self, batches: Dict[int, List[Dict[str, Any]]]) -> Dict[int, int]:
+        """Push notifications for several users in one pipeline.
+
+        Returns the newest id per user.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id, notifications in batches.items():
+            bodies = [json.dumps({k: v for k, v in n.items() if k != 'id'}) for n in notifications]
+            self._push(
+                keys=[self.list_key(user_id), self.seq_key(user_id)],
+                args=[self.max_items, self.ttl, *bodies],
+                client=pipe
+            )
+
+        heads = {}
+        for (user_id, notifications), head in zip(batches.items(), pipe.execute()):
+            heads[user_id] = head = int(head)
+            for offset, notification in enumerate(notifications):
+                notification['id'] = str(head - len(notifications) + 1 + offset)
+        return heads
+
+    @observe_redis('page')
+    def page(self, user_id: int, offset: int, limit: int) -> Tuple[List[bytes], int]:
+        """Offset page plus total length, in one round trip."""
+        key = self.list_key(user_id)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.lrange(key, offset, offset + limit - 1)
+        pipe.llen(key)
+        items, total = pipe.execute()
+        return items, total
+
+    @observe_redis('since')
+    def since(self, user_id: int, since: int, limit: int) -> Tuple[List[bytes], Optional[int], bool, bool]:
+        """Notifications newer than `since`, newest first.
+
+        Returns (items, newest id returned, whether more new items remain,
+        whether some newer items were already trimmed or expired). When
+        nothing newer is left at all, the newest id is the head so the
+        caller moves past the gap.
+        """
+        head, first, truncated, *items = self._since(
+            keys=[self.list_key(user_id), self.seq_key(user_id)], args=[since, limit]
+        )
+        if items:
+            newest = head - first
+        else:
+            newest = head if truncated else None
+        return items, newest, bool(items) and first > 0, bool(truncated)
+
+    @observe_redis('before')
+    def before(self, user_id: int, cursor: int, limit: int) -> Tuple[List[bytes], Optional[int]]:
+        """Notifications older than `cursor`, newest first, and the next cursor.
+
+        Cursors are notification ids, so pages stay put while new items arrive.
+        """
+        head, first, *items = self._before(
+            keys=[self.list_key(user_id), self.seq_key(user_id)], args=[cursor, limit]
+        )
+        next_cursor = head - (first + len(items) - 1) if len(items) == limit else None
+        return items, next_cursor
+
+    @observe_redis('mark_read')
+    def mark_read(self, user_id: int, notification_ids: List[str]):
+        """Set read markers for notifications in one round trip."""
+        if not notification_ids:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for notification_id in notification_ids:
+            pipe.set(self.read_key(user_id, notification_id), "true", ex=READ_MARKER_TTL)
+        pipe.execute()
+
+    @observe_redis('clear')
+    def clear(self, user_id: int):
+        """Delete a user's notifications; the id counter is kept so ids never repeat."""
+        self.redis_client.delete(self.list_key(user_id))
+
+    @observe_redis('get_preferences_many')
+    def get_preferences_many(self, user_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        """Load delivery preferences for several users in one round trip."""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hgetall(self.prefs_key(user_id))
+        return {
+            user_id: {k.decode(): v.decode() for k, v in prefs.items()}
+            for user_id, prefs in zip(user_ids, pipe.execute())
+        }
+
+    @observe_redis('set_preferences')
+    def set_preferences(self, user_id: int, preferences: Dict[str, Any]):
+        """Replace a user's delivery preferences."""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(self.prefs_key(user_id))
+        if preferences:
+            pipe.hset(self.prefs_key(user_id), mapping={k: str(v) for k, v in preferences.items()})
+        pipe.execute()
+
+    @observe_redis('buffer_digest')
+    def buffer_digest(self, batches: Dict[int, List[Dict[str, Any]]], flush_at: Dict[int, float]):
+        """Count notifications into per-user digest buffers instead of storing them.
+
+        Only event counts and a few sample messages are kept, and the user is
+        added to the due set (keeping any earlier flush time).
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id, notifications in batches.items():
+            for notification in notifications:
+                pipe.hincrby(self.digest_key(user_id), notification.get('event_type', 'other'),
+                             notification.get('count', 1))
+            samples_key = self.digest_samples_key(user_id)
+            pipe.lpush(samples_key, *(n.get('message', '') for n in notifications))
+            pipe.ltrim(samples_key, 0, DIGEST_SAMPLE_SIZE - 1)
+            pipe.expire(self.digest_key(user_id), self.ttl)
+            pipe.expire(samples_key, self.ttl)
+            pipe.zadd(DIGEST_DUE_KEY, {user_id: flush_at[user_id]}, nx=True)
+        pipe.execute()
+
+    @observe_redis('pop_due_digests')
+    def pop_due_digests(self, now: float, limit: int) -> List[int]:
+        """Claim up to `limit` users whose digest interval has elapsed."""
+        return [int(u) for u in self._pop_due_digests(keys=[DIGEST_DUE_KEY], args=[now, limit])]
+
+    @observe_redis('take_digests')
+    def take_digests(self, user_ids: List[int]) -> Dict[int, Tuple[Dict[str, int], List[str]]]:
+        """Claim digest buffers for a flush; returns (counts, sample messages) per user.
+
+        The buffers move to flushing keys, so events arriving meanwhile start
+        new ones. ``ack_digests`` deletes the flushing keys once the summary
+        is stored; until then they are kept and the next take for the user
+        includes them again.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            self._take_digest(keys=[
+                self.digest_key(user_id), self.digest_samples_key(user_id),
+                self.digest_flushing_key(user_id), self.digest_samples_flushing_key(user_id),
+            ], args=[DIGEST_SAMPLE_SIZE, self.ttl], client=pipe)
+
+        digests = {}
+        for user_id, result in zip(user_ids, pipe.execute()):
+            split = result.index(b'')
+            counts, samples = result[:split], result[split + 1:]
+            if counts:
+                digests[user_id] = (
+                    {counts[i].decode(): int(counts[i + 1]) for i in range(0, len(counts), 2)},
+                    [sample.decode() for sample in samples],
+                )
+        return digests
+
+    @observe_redis('ack_digests')
+    def ack_digests(self, user_ids: List[int]):
+        """Drop the claimed digest buffers after their summaries were stored."""
+        if user_ids:
+            self.redis_client.delete(*(
+                key for user_id in user_ids
+                for key in (self.digest_flushing_key(user_id), self.digest_samples_flushing_key(user_id))
+            ))
+
+    @observe_redis('retry_digests')
+    def retry_digests(self, user_ids: List[int], flush_at: float):
+        """Mark users whose digest flush failed as due again (their claimed buffers are kept)."""
+        if user_ids:
+            self.redis_client.zadd(DIGEST_DUE_KEY, {user_id: flush_at for user_id in user_ids}, nx=True)
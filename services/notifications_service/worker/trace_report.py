@@ -0,0 +1,97 @@
+"""
+Per-stage latency breakdown from exported trace files.
+
+Reads the JSON-lines span files written by both services, joins spans by
+trace id and reports percentiles for each stage of a task write turning into
+a stored notification:
+
+    http.request          Django request that wrote the task
+    task_event.publish    publishing the event to RabbitMQ
+    queue wait            publish end to consume start
+    task_events.consume   worker handler
+    coalesce wait         handler end to the batched Redis write
+    notification.store    Redis write
+    end to end            first span start to store end
+
+Example:
+    python -m worker.trace_report traces/*.jsonl* ../tasks_service/traces/*.jsonl*
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from typing import Dict, Any, Iterable, List
+
+
+def load_spans(paths: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Group spans from all files by trace id."""
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    span = json.loads(line)
+                    traces[span['trace_id']].append(span)
+    return traces
+
+
+def stage_durations(spans: List[Dict[str, Any]]) -> Dict[str, List[float]]:
+    """Milliseconds spent in each stage of one trace."""
+    stages: Dict[str, List[float]] = defaultdict(list)
+    by_id = {span['span_id']: span for span in spans}
+    for span in spans:
+        stages[span['name']].append((span['end_ns'] - span['start_ns']) / 1e6)
+        parent = by_id.get(span['parent_id'])
+        if span['name'].endswith('.consume') and parent is not None:
+            stages['queue wait'].append((span['start_ns'] - parent['end_ns']) / 1e6)
+        if span['name'] == 'notification.store':
+            stages['coalesce wait'].append(span['attributes'].get('coalesce_wait_ms', 0))
+
+    stored = [span['end_ns'] for span in spans if span['name'] == 'notification.store']
+    if stored:
+        stages['end to end'].append((max(stored) - min(span['start_ns'] for span in spans)) / 1e6)
+    return stages
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def report(traces: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    totals: Dict[str, List[float]] = defaultdict(list)
+    for spans in traces.values():
+        for stage, durations in stage_durations(spans).items():
+            totals[stage].extend(durations)
+
+    order = ['http.request', 'task_event.publish', 'queue wait', 'task_events.consume',
+             'notification_events.consume', 'coalesce wait', 'notification.store', 'end to end']
+    stages = [s for s in order if s in totals] + sorted(s for s in totals if s not in order)
+    return [
+        {
+            'stage': stage,
+            'count': len(totals[stage]),
+            'p50': percentile(totals[stage], 50),
+            'p95': percentile(totals[stage], 95),
+            'p99': percentile(totals[stage], 99),
+            'max': max(totals[stage]),
+        }
+        for stage in stages
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='Span files (JSON lines)')
+    args = parser.parse_args()
+
+    traces = load_spans(args.paths)
+    print(f"{len(traces)} traces")
+    print(f"{'stage':<30}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for row in report(traces):
+        print(f"{row['stage']:<30}{row['count']:>8}{row['p50']:>10.2f}{row['p95']:>10.2f}"
+              f"{row['p99']:>10.2f}{row['max']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
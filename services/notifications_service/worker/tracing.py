@@ -0,0 +1,29 @@
+"""
+Minimal W3C trace context tracing.
+
+The tracer and span format are shared with the tasks service
+(``taskflow_common.tracing``); this module configures them for this
+service. Sampled spans are written as JSON lines to TRACE_EXPORT_PATH, one
+file per process, and ``python -m worker.trace_report`` merges the files of
+both services into per-stage latency breakdowns.
+"""
+
+from decouple import config
+from taskflow_common.tracing import (  # noqa: F401
+    FileExporter, Span, SpanContext, Tracer, current_span, extract, inject, parse_traceparent,
+)
+
+TRACE_SAMPLE_RATE = config('TRACE_SAMPLE_RATE', default=0.0, cast=float)
+TRACE_EXPORT_PATH = config('TRACE_EXPORT_PATH', default='traces/notifications-{pid}.jsonl')
+TRACE_EXPORT_BATCH = config('TRACE_EXPORT_BATCH', default=256, cast=int)
+# Span files are rotated at this size, keeping TRACE_EXPORT_BACKUP_COUNT old ones
+TRACE_EXPORT_MAX_BYTES = config('TRACE_EXPORT_MAX_BYTES', default=50 * 1024 * 1024, cast=int)
+TRACE_EXPORT_BACKUP_COUNT = config('TRACE_EXPORT_BACKUP_COUNT', default=3, cast=int)
+SERVICE_NAME = 'notifications'
+
+exporter = FileExporter(SERVICE_NAME, TRACE_EXPORT_PATH, TRACE_EXPORT_BATCH,
+                        TRACE_EXPORT_MAX_BYTES, TRACE_EXPORT_BACKUP_COUNT)
+# Messages come from the tasks service, so their sampled flag is trusted as is
+tracer = Tracer(exporter, TRACE_SAMPLE_RATE)
+start_span = tracer.start_span
+record_span = tracer.record_span
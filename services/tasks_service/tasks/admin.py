@@ -1,48 +1,85 @@
 from django.contrib import admin
+from django.db.models import Q
 from .models import Task, TaskComment, TaskAttachment
+from .pagination import ApproximateCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables too big to count or scan.
+    
+    Counts come from planner estimates, the filtered/total count pair is not
+    shown (it costs a second COUNT), and dates are browsed with the bounded
+    date hierarchy in ``admin/tasks/change_list.html``.
+    """
+    
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    date_hierarchy = 'created_at'
 
 
 @admin.register(Task)
-class TaskAdmin(admin.ModelAdmin):
+class TaskAdmin(LargeTableAdmin):
     """Admin configuration for Task model."""
     
     list_display = ['title', 'user_id', 'priority', 'status', 'due_date', 'created_at']
-    list_filter = ['priority', 'status', 'created_at', 'due_date']
-    search_fields = ['title', 'description']
+    list_filter = ['priority', 'status']
+    search_fields = ['title']
+    search_help_text = 'Task or user ID, or the start of the title (case-sensitive)'
     ordering = ['-created_at']
-    readonly_fields = ['created_at', 'updated_at', 'completed_at']
+    readonly_fields = ['created_at', 'updated_at', 'completed_at', 'version']
+    raw_id_fields = ['parent']
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Only lookups an index can answer: ids exactly, titles by prefix
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(Q(id=int(term)) | Q(user_id=int(term))), False
+        return queryset.filter(title__startswith=term), False
     
     fieldsets = (
         (None, {
-            'fields': ('title', 'description', 'user_id')
+            'fields': ('title', 'description', 'user_id', 'parent', 'tags')
         }),
         ('Status & Priority', {
             'fields': ('priority', 'status', 'due_date')
         }),
         ('Timestamps', {
-            'fields': ('created_at', 'updated_at', 'completed_at'),
+            'fields': ('created_at', 'updated_at', 'completed_at', 'version'),
             'classes': ('collapse',)
         }),
     )
 
 
 @admin.register(TaskComment)
-class TaskCommentAdmin(admin.ModelAdmin):
+class TaskCommentAdmin(LargeTableAdmin):
     """Admin configuration for TaskComment model."""
     
     list_display = ['task', 'user_id', 'created_at']
-    list_filter = ['created_at']
-    search_fields = ['content', 'task__title']
+    list_select_related = ['task']
+    search_fields = ['task__id']
+    search_help_text = 'Task ID'
     ordering = ['-created_at']
     readonly_fields = ['created_at', 'updated_at']
+    raw_id_fields = ['task']
+    
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term.isdigit():
+            return (queryset.none() if term else queryset), False
+        return queryset.filter(task_id=int(term)), False
 
 
 @admin.register(TaskAttachment)
-class TaskAttachmentAdmin(admin.ModelAdmin):
+class TaskAttachmentAdmin(LargeTableAdmin):
     """Admin configuration for TaskAttachment model."""
     
     list_display = ['file_name', 'task', 'user_id', 'file_size', 'created_at']
-    list_filter = ['mime_type', 'created_at']
-    search_fields = ['file_name', 'task__title']
+    list_select_related = ['task']
+    search_fields = ['file_name__startswith']
+    search_help_text = 'Start of the file name (case-sensitive)'
     ordering = ['-created_at']
     readonly_fields = ['created_at']
+    raw_id_fields = ['task']
@@ -0,0 +1,123 @@
+"""
+Moving finished tasks out of the hot tables.
+
+``done`` and ``cancelled`` tasks untouched for ``TASK_ARCHIVE_AFTER_DAYS``
+are copied, with their comments, attachments and tag rows, into the
+``*_archive`` tables and deleted from the live ones, a small batch per
+transaction so locks stay short. Rows keep their ids. Other rows pointing
+at a task (e.g. import references, closure and dependency rows) are deleted
+with it. A task with subtasks still live stays until they have been
+archived.
+
+The move is plain SQL: no model signals run, so rollup counts stay as they
+are (``backfill_rollups`` counts archived tasks too) and no events are sent. Tag counts only cover live tasks, so they are
+lowered. Archived tasks are read-only and only show up in the API with
+``?include_archived=1``.
+"""
+
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .hierarchy import FINISHED_STATUSES
+from . import facets, tagging
+from .models import (ArchivedTask, ArchivedTaskAttachment, ArchivedTaskComment, ArchivedTaskTag, Task,
+                     TaskAttachment, TaskComment, TaskTag)
+
+ARCHIVE_MODELS = {
+    Task: ArchivedTask,
+    TaskComment: ArchivedTaskComment,
+    TaskAttachment: ArchivedTaskAttachment,
+    TaskTag: ArchivedTaskTag,
+}
+
+
+def archivable(older_than: Optional[timedelta] = None, using: str = 'default'):
+    """Live tasks old and finished enough to archive."""
+    if older_than is None:
+        older_than = timedelta(days=settings.TASK_ARCHIVE_AFTER_DAYS)
+    return Task.objects.using(using).filter(status__in=FINISHED_STATUSES,
+                                            updated_at__lt=timezone.now() - older_than).exclude(
+        Exists(Task.objects.filter(parent=OuterRef('pk'))))
+
+
+def _where(cursor, column, ids):
+    return f"WHERE {cursor.db.ops.quote_name(column)} IN ({', '.join(['%s'] * len(ids))})"
+
+
+def _copy(cursor, model, column, ids, extra=None):
+    """Copy the rows whose ``column`` is in ``ids`` to the model's archive table."""
+    qn = cursor.db.ops.quote_name
+    extra = extra or {}
+    columns = [qn(field.column) for field in model._meta.concrete_fields]
+    cursor.execute(
+        f"INSERT INTO {qn(ARCHIVE_MODELS[model]._meta.db_table)} "
+        f"({', '.join(columns + [qn(name) for name in extra])}) "
+        f"SELECT {', '.join(columns + ['%s'] * len(extra))} FROM {qn(model._meta.db_table)} "
+        f"{_where(cursor, column, ids)}",
+        [*extra.values(), *ids],
+    )
+
+
+def _delete(cursor, model, column, ids) -> int:
+    table = cursor.db.ops.quote_name(model._meta.db_table)
+    cursor.execute(f"DELETE FROM {table} {_where(cursor, column, ids)}", ids)
+    return cursor.rowcount
+
+
+def archive_batch(queryset, batch_size: int, using: str = 'default') -> Dict[str, int]:
+    """Archive up to ``batch_size`` tasks from ``queryset`` in one transaction."""
+    connection = connections[using]
+    # Every table with a foreign key to tasks, including hidden ones (related_name='+'),
+    # but not subtasks: archivable() leaves out tasks that still have any
+    relations = [field for field in Task._meta.get_fields(include_hidden=True)
+                 if (field.one_to_many or field.one_to_one) and field.auto_created and not field.concrete
+                 and field.related_model is not Task]
+    moved = {}
+    with transaction.atomic(using=using):
+        # Locked so a task can't be reopened mid-move; rows locked by a writer wait for the next batch
+        rows = list(queryset.select_for_update(skip_locked=True).order_by('id')
+                    .values_list('id', 'user_id')[:batch_size])
+        if not rows:
+            return moved
+        ids = [task_id for task_id, _ in rows]
+        transaction.on_commit(lambda: facets.invalidate(user_id for _, user_id in rows), using=using)
+        archived_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        tagging.forget(ids, using)
+        with connection.cursor() as cursor:
+            _copy(cursor, Task, 'id', ids, {'archived_at': archived_at})
+            for relation in relations:
+                model, column = relation.related_model, relation.field.column
+                if model in ARCHIVE_MODELS:
+                    _copy(cursor, model, column, ids)
+                moved[model._meta.db_table] = _delete(cursor, model, column, ids)
+            moved[Task._meta.db_table] = _delete(cursor, Task, 'id', ids)
+    return moved
+
+
+def archive_finished(older_than: Optional[timedelta] = None, batch_size: Optional[int] = None,
+                     using: str = 'default', max_batches: Optional[int] = None, pause: float = 0.0,
+                     on_batch: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, int]:
+    """Archive batches until nothing is left (or ``max_batches``); return rows moved per table."""
+    batch_size = batch_size or settings.TASK_ARCHIVE_BATCH_SIZE
+    queryset = archivable(older_than, using)
+    totals = {}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(queryset, batch_size, using)
+        if not moved:
+            break
+        batches += 1
+        for table, count in moved.items():
+            totals[table] = totals.get(table, 0) + count
+        if on_batch:
+            on_batch(moved)
+        if pause:
+            # Let replicas and other writers catch up between batches
+            time.sleep(pause)
+    return totals
@@ -0,0 +1,183 @@
+"""
+Publishing task events to the notifications service.
+
+Events are encoded with the codec shared with the notifications service
+(``taskflow_common.events``). ``TASK_EVENT_ENCODING = 'json'`` falls back
+to the JSON documents older consumers understand.
+
+``publish_task_event`` doesn't talk to RabbitMQ. It adds the encoded event
+to the ``task_event_outbox`` table in the transaction that saves the task,
+so an event exists exactly when its change commits, and requests never wait
+on the broker. ``OutboxRelay`` publishes pending rows in id order with
+publisher confirms and deletes them once the broker has acknowledged them.
+Rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED``, so any number
+of relays can run. While the broker is unreachable rows wait in the table
+and the relay reconnects with backoff. Delivery is at least once: a relay
+that dies between publishing and deleting sends those rows again.
+
+Each web process runs a relay thread, started after fork by the first
+commit that adds an event and woken by later ones. Set
+``TASK_EVENT_RELAY_THREAD = False`` to leave publishing to
+``manage.py relay_task_events`` instead.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+import time
+
+import pika
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from taskflow_common.events import (  # noqa: F401
+    BINARY_CONTENT_TYPE, HEADER, JSON_CONTENT_TYPE, SCHEMA_VERSION, encode_task_event,
+)
+from taskflow_common.events import task_event_message as encode_message
+
+from . import tracing
+from .models import TaskEventOutbox
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_QUEUE = 'task_events'
+
+
+def task_event_data(task):
+    """Fields the notification templates use for a task."""
+    return {
+        'id': task.id,
+        'user_id': task.user_id,
+        'title': task.title,
+        'task_title': task.title,
+        'due_date': task.due_date.isoformat() if task.due_date else None,
+        'status': task.status,
+        'priority': task.priority,
+    }
+
+
+def task_event_message(event_type, data, encoding=None):
+    """Return (content_type, body) for a task event."""
+    return encode_message(event_type, data, encoding or settings.TASK_EVENT_ENCODING)
+
+
+class OutboxRelay:
+    """Publish outbox rows to the task_events queue over one long-lived connection."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._connection = None
+        self._channel = None
+
+    def wake(self):
+        """Have the relay publish now, starting its thread in this process if needed."""
+        if not settings.TASK_EVENT_RELAY_THREAD:
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                # A connection inherited over fork belongs to the parent
+                self._pid, self._connection, self._channel = os.getpid(), None, None
+                self._thread = threading.Thread(target=self.run, name='task-event-relay', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def run(self):
+        """Publish pending events until the process exits."""
+        backoff = 0
+        while True:
+            self._wake.wait(settings.TASK_EVENT_RELAY_INTERVAL)
+            self._wake.clear()
+            try:
+                while self.drain():
+                    pass
+                if self._connection is not None:
+                    # Answers heartbeats while idle
+                    self._connection.process_data_events(0)
+                backoff = 0
+            except (pika.exceptions.AMQPError, DatabaseError) as e:
+                self.close()
+                backoff = min(max(backoff * 2, 1), settings.TASK_EVENT_RELAY_MAX_BACKOFF)
+                logger.warning("Failed to publish task events, retrying in %ss: %s", backoff, e)
+                time.sleep(backoff)
+            finally:
+                close_old_connections()
+
+    def drain(self) -> int:
+        """Publish one batch of pending events and delete them; returns how many were sent.
+
+        Raises ``AMQPError`` when the broker doesn't take the batch; its rows stay.
+        """
+        with transaction.atomic(using='default'):
+            rows = list(TaskEventOutbox.objects.using('default').select_for_update(skip_locked=True)
+                        .order_by('id')[:settings.TASK_EVENT_RELAY_BATCH_SIZE])
+            if not rows:
+                return 0
+            channel = self._ensure_channel()
+            for row in rows:
+                parent = tracing.extract(row.headers)
+                span = (tracing.start_span('task_event.publish', parent=parent, event_type=row.event_type)
+                        if parent is not None else contextlib.nullcontext())
+                with span:
+                    channel.basic_publish(
+                        exchange='',
+                        routing_key=TASK_EVENTS_QUEUE,
+                        body=bytes(row.body),
+                        properties=pika.BasicProperties(
+                            content_type=row.content_type,
+                            delivery_mode=2,
+                            headers=tracing.inject(dict(row.headers, **{'x-published-at': time.time()}))
+                        )
+                    )
+            TaskEventOutbox.objects.using('default').filter(id__in=[row.id for row in rows]).delete()
+        return len(rows)
+
+    def _ensure_channel(self):
+        if self._channel is None or self._channel.is_closed:
+            self.close()
+            params = pika.URLParameters(settings.RABBITMQ_URL)
+            params.heartbeat = settings.TASK_EVENT_HEARTBEAT
+            # A broker that blocks publishers (e.g. low on disk) fails the batch instead of hanging it
+            params.blocked_connection_timeout = settings.TASK_EVENT_HEARTBEAT
+            self._connection = pika.BlockingConnection(params)
+            channel = self._connection.channel()
+            channel.queue_declare(queue=TASK_EVENTS_QUEUE, durable=True)
+            # basic_publish raises unless the broker confirms the message
+            channel.confirm_delivery()
+            self._channel = channel
+        return self._channel
+
+    def close(self):
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+
+relay = OutboxRelay()
+
+
+def publish_task_event(event_type, task, changes=None, using=None):
+    """Add an event for a task to the outbox, in the current transaction.
+
+    ``changes`` (``{field: (old, new)}``, from ``Task.saved_changes``) is sent
+    along so consumers can tell what an update touched. The relay is woken
+    once the transaction commits.
+    """
+    if not settings.TASK_EVENTS_ENABLED:
+        return
+    data = task_event_data(task)
+    if changes:
+        # Long text stays out of the event; consumers re-read the task if they need it
+        data['changes'] = {
+            name: [old, new] for name, (old, new) in changes.items() if name not in ('updated_at', 'version', 'description')
+        }
+    content_type, body = task_event_message(event_type, data)
+    using = using or 'default'
+    TaskEventOutbox.objects.using(using).create(event_type=event_type, content_type=content_type, body=body,
+                                                headers=tracing.inject({}))
+    transaction.on_commit(relay.wake, using=using)
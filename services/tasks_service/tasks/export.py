@@ -0,0 +1,87 @@
+"""
+Streaming task exports.
+
+Rows come from ``values_list(...).iterator(chunk_size=...)``, which on
+Postgres reads through a server-side cursor, and are encoded one chunk at a
+time into a ``StreamingHttpResponse``. Only one chunk of rows and its
+encoded bytes are held in memory, whatever the size of the export.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .serializers import TaskSerializer
+
+FIELDS = TaskSerializer.Meta.fields
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _csv_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, list):
+        return ','.join(value)  # Tags, which can't contain commas
+    return value
+
+
+def encode_csv(rows, size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for chunk in _chunks(rows, size):
+        writer.writerows([_csv_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def encode_ndjson(rows, size):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for chunk in _chunks(rows, size):
+        yield ''.join(encoder.encode(dict(zip(FIELDS, row))) + '\n' for row in chunk).encode()
+
+
+def gzip_stream(chunks):
+    # wbits=31: gzip container, so the download is a plain .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_response(queryset, export_format, compress=False):
+    content_type, extension = FORMATS[export_format]
+    size = settings.TASK_EXPORT_CHUNK_SIZE
+    rows = queryset.values_list(*FIELDS).iterator(chunk_size=size)
+    body = (encode_csv if export_format == 'csv' else encode_ndjson)(rows, size)
+    filename = f"tasks.{extension}"
+    if compress:
+        body = gzip_stream(body)
+        content_type, filename = 'application/gzip', f"{filename}.gz"
+    response = StreamingHttpResponse(body, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
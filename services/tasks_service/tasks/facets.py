@@ -0,0 +1,115 @@
+"""
+Status x priority x overdue counts for the task list's filter chips.
+
+``counts`` answers them with one ``GROUP BY status, priority, overdue``
+over the tasks the list would show for the same search and filters.
+
+Results are cached in Redis per user and query string. Each user has a
+generation counter that every task write bumps after commit, in the same
+places the reminder index is synced, and cache keys include it. So a
+write makes all of that user's entries unreachable at once. The
+generation is read before the counts are computed, so counts that race
+with a write are stored under the old generation and never served. That
+only holds for counts read from the primary; a replica can still be
+behind a write whose generation bump is already visible.
+Entries expire after ``TASK_FACETS_CACHE_TTL`` seconds, which also bounds
+how late a task shows up as overdue once its due date passes. Without
+Redis the counts are computed on every request.
+"""
+
+import hashlib
+import json
+import logging
+from typing import Callable, Iterable
+
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import BooleanField, Case, Count, Q, Value, When
+from django.utils import timezone
+
+from . import reminders
+from .models import AbstractTask
+from .reminders import OPEN_STATUSES
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'task-facets:gen:{user_id}'
+ENTRY_KEY = 'task-facets:{user_id}:{generation}:{digest}'
+# List parameters that don't change the counts
+IGNORED_PARAMS = {'page', 'cursor', 'ordering'}
+
+
+def counts(queryset) -> dict:
+    """Per (status, priority, overdue) counts of ``queryset``, plus the totals of each chip."""
+    overdue = Case(When(Q(due_date__lt=timezone.now(), status__in=OPEN_STATUSES), then=Value(True)),
+                   default=Value(False), output_field=BooleanField())
+    rows = (queryset.order_by().annotate(overdue=overdue)
+            .values('status', 'priority', 'overdue').annotate(count=Count('id')))
+    result = {
+        'total': 0,
+        'status': {value: 0 for value, _ in AbstractTask.STATUS_CHOICES},
+        'priority': {value: 0 for value, _ in AbstractTask.PRIORITY_CHOICES},
+        'overdue': 0,
+        'buckets': [],
+    }
+    for row in rows:
+        result['total'] += row['count']
+        result['status'][row['status']] = result['status'].get(row['status'], 0) + row['count']
+        result['priority'][row['priority']] = result['priority'].get(row['priority'], 0) + row['count']
+        result['overdue'] += row['count'] if row['overdue'] else 0
+        result['buckets'].append(row)
+    return result
+
+
+def merge(*results: dict) -> dict:
+    """Add up ``counts`` results, e.g. of live and archived tasks."""
+    merged = {'total': 0, 'status': {}, 'priority': {}, 'overdue': 0, 'buckets': []}
+    for result in results:
+        merged['total'] += result['total']
+        merged['overdue'] += result['overdue']
+        merged['buckets'] += result['buckets']
+        for dim in ('status', 'priority'):
+            for value, count in result[dim].items():
+                merged[dim][value] = merged[dim].get(value, 0) + count
+    return merged
+
+
+def _digest(params) -> str:
+    items = sorted((name, params.getlist(name)) for name in params if name not in IGNORED_PARAMS)
+    return hashlib.sha1(json.dumps(items).encode()).hexdigest()
+
+
+def cached(user_id: int, params, compute: Callable[[], dict]) -> dict:
+    """The counts for ``params`` from the cache, or from ``compute()`` and then cached."""
+    try:
+        client = reminders.get_redis()
+        generation = int(client.get(GENERATION_KEY.format(user_id=user_id)) or 0)
+        key = ENTRY_KEY.format(user_id=user_id, generation=generation, digest=_digest(params))
+        hit = client.get(key)
+    except redis.RedisError as e:
+        logger.warning("Failed to read cached task facets: %s", e)
+        return compute()
+    if hit is not None:
+        return json.loads(hit)
+
+    result = compute()
+    try:
+        client.set(key, json.dumps(result, cls=DjangoJSONEncoder), ex=settings.TASK_FACETS_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning("Failed to cache task facets: %s", e)
+    return result
+
+
+def invalidate(user_ids: Iterable[int]):
+    """Bump the generation of each user, so their cached counts are no longer read."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    try:
+        pipe = reminders.get_redis().pipeline(transaction=False)
+        for user_id in sorted(user_ids):
+            pipe.incr(GENERATION_KEY.format(user_id=user_id))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Failed to invalidate task facets: %s", e)
@@ -0,0 +1,46 @@
+import django_filters
+from rest_framework.filters import OrderingFilter
+
+from . import tagging
+from .models import AbstractTask
+
+
+class TaskFilterSet(django_filters.FilterSet):
+    """
+    Filters of the task list, export and facets.
+    
+    Declared without a model, so the same filters apply to live and
+    archived tasks. ``tags`` keeps tasks having all of the comma-separated
+    tags, ``tags_any`` those having at least one.
+    """
+    
+    status = django_filters.ChoiceFilter(choices=AbstractTask.STATUS_CHOICES)
+    priority = django_filters.ChoiceFilter(choices=AbstractTask.PRIORITY_CHOICES)
+    tags = django_filters.CharFilter(method='filter_tags')
+    tags_any = django_filters.CharFilter(method='filter_tags_any')
+    
+    def filter_tags(self, queryset, name, value):
+        return tagging.filter_all(queryset, tagging.parse(value))
+    
+    def filter_tags_any(self, queryset, name, value):
+        return tagging.filter_any(queryset, tagging.parse(value))
+
+
+class TaskOrderingFilter(OrderingFilter):
+    """
+    ``OrderingFilter`` that sorts ``priority`` by rank rather than by name.
+    
+    Ties are broken by ``id`` in the direction of the first field, so the
+    order is total and ``KeysetPagination`` can seek past any row.
+    """
+    
+    aliases = {'priority': 'priority_rank'}
+    
+    def get_ordering(self, request, queryset, view):
+        ordering = []
+        for term in super().get_ordering(request, queryset, view) or []:
+            name = term.lstrip('-')
+            ordering.append(term[:len(term) - len(name)] + self.aliases.get(name, name))
+        if not any(term.lstrip('-') in ('id', 'pk') for term in ordering):
+            ordering.append('-id' if ordering and ordering[0].startswith('-') else 'id')
+        return ordering
@@ -0,0 +1,161 @@
+"""
+Subtask trees and blocking dependencies.
+
+``Task.parent`` is the tree; ``TaskClosure`` holds one row per (ancestor,
+descendant) pair at every depth, so subtree listings and progress counts
+are one indexed lookup on ``ancestor_id`` whatever the depth. ``Task.save``
+keeps it up to date in the task's own transaction: moving a task drops the
+links from its old ancestors to its subtree and adds the cross product of
+the new parent's ancestors and the subtree. Setting a parent inside the
+task's own subtree raises ``CycleError``.
+
+``TaskDependency`` rows say a task depends on another; a task is blocked
+while any task it depends on is unfinished. A new dependency is rejected
+if the task is already reachable from it, checked with a recursive CTE.
+
+Tree and dependency edits for one user are serialized with a
+transaction-scoped advisory lock on Postgres, so two concurrent edits can't
+form a cycle that neither would see alone. SQLite has one writer at a time.
+"""
+
+from typing import Optional
+
+from django.db import connections
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+FINISHED_STATUSES = ('done', 'cancelled')
+
+# Arbitrary namespace for pg_advisory_xact_lock(key1, key2)
+LOCK_NAMESPACE = 4701
+
+
+class CycleError(Exception):
+    """The parent or dependency would make a task its own ancestor or blocker."""
+
+
+def _tables(connection):
+    from .models import Task, TaskClosure, TaskDependency
+    qn = connection.ops.quote_name
+    return (qn(Task._meta.db_table), qn(TaskClosure._meta.db_table), qn(TaskDependency._meta.db_table))
+
+
+def lock_user(user_id: int, using: str = 'default'):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [LOCK_NAMESPACE, user_id])
+
+
+def check_parent(task, using: str = 'default'):
+    """Lock the owner's trees and make sure ``task.parent_id`` is a valid parent for ``task``."""
+    from .models import Task, TaskClosure
+    lock_user(task.user_id, using)
+    if task.pk is not None and task.parent_id == task.pk:
+        raise CycleError("A task can't be its own parent")
+    if not Task.objects.using(using).filter(pk=task.parent_id, user_id=task.user_id).exists():
+        raise CycleError(f"Task {task.parent_id} is not one of this user's tasks")
+    if task.pk is not None and TaskClosure.objects.using(using).filter(
+            ancestor_id=task.pk, descendant_id=task.parent_id).exists():
+        raise CycleError(f"Task {task.parent_id} is a subtask of task {task.pk}")
+
+
+def move(task_id: int, old_parent_id: Optional[int], new_parent_id: Optional[int], using: str = 'default'):
+    """Update the closure rows for ``task_id`` (and its subtree) changing parent."""
+    connection = connections[using]
+    _, closure, _ = _tables(connection)
+    subtree = f"SELECT descendant_id FROM {closure} WHERE ancestor_id = %s UNION ALL SELECT %s"
+    with connection.cursor() as cursor:
+        if old_parent_id is not None:
+            cursor.execute(f"""
+                DELETE FROM {closure}
+                WHERE descendant_id IN ({subtree}) AND ancestor_id NOT IN ({subtree})
+            """, [task_id] * 4)
+        if new_parent_id is not None:
+            cursor.execute(f"""
+                INSERT INTO {closure} (ancestor_id, descendant_id, depth)
+                SELECT a.ancestor_id, s.descendant_id, a.depth + s.depth + 1
+                FROM (SELECT ancestor_id, depth FROM {closure} WHERE descendant_id = %s
+                      UNION ALL SELECT %s, 0) a
+                CROSS JOIN (SELECT descendant_id, depth FROM {closure} WHERE ancestor_id = %s
+                            UNION ALL SELECT %s, 0) s
+            """, [new_parent_id, new_parent_id, task_id, task_id])
+
+
+def rebuild_closure(using: str = 'default'):
+    """Recompute every closure row from ``Task.parent`` (after bulk loads that skip ``save``)."""
+    connection = connections[using]
+    tasks, closure, _ = _tables(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {closure}")
+        cursor.execute(f"""
+            WITH RECURSIVE pairs (ancestor_id, descendant_id, depth) AS (
+                SELECT parent_id, id, 1 FROM {tasks} WHERE parent_id IS NOT NULL
+                UNION ALL
+                SELECT t.parent_id, p.descendant_id, p.depth + 1
+                FROM pairs p JOIN {tasks} t ON t.id = p.ancestor_id
+                WHERE t.parent_id IS NOT NULL
+            )
+            INSERT INTO {closure} (ancestor_id, descendant_id, depth)
+            SELECT ancestor_id, descendant_id, depth FROM pairs
+        """)
+
+
+def subtree(task_id: int, max_depth: Optional[int] = None, using: str = 'default'):
+    """Every subtask below ``task_id``, annotated with its ``depth``, in one indexed query."""
+    from .models import Task
+    # One filter() call, so both conditions apply to the same closure row
+    lookups = {'ancestor_links__ancestor_id': task_id}
+    if max_depth is not None:
+        lookups['ancestor_links__depth__lte'] = max_depth
+    return Task.objects.using(using).filter(**lookups).annotate(depth=F('ancestor_links__depth'))
+
+
+def blocking(task_id: int, using: str = 'default'):
+    """Unfinished tasks ``task_id`` depends on."""
+    from .models import Task
+    return Task.objects.using(using).filter(dependents__task_id=task_id).exclude(status__in=FINISHED_STATUSES)
+
+
+def annotate_progress(queryset):
+    """Add ``subtasks_total``/``subtasks_done`` (all depths, cancelled ones left out) and ``blocked``."""
+    from .models import TaskClosure, TaskDependency
+    links = TaskClosure.objects.filter(ancestor_id=OuterRef('pk')).exclude(descendant__status='cancelled')
+
+    def count(filter_q):
+        return Coalesce(Subquery(
+            links.filter(filter_q).order_by().values('ancestor_id').annotate(n=Count('pk')).values('n'),
+            output_field=IntegerField(),
+        ), Value(0))
+
+    return queryset.annotate(
+        subtasks_total=count(Q()),
+        subtasks_done=count(Q(descendant__status='done')),
+        blocked=Exists(TaskDependency.objects.filter(task_id=OuterRef('pk'))
+                       .exclude(depends_on__status__in=FINISHED_STATUSES)),
+    )
+
+
+def add_dependency(task, depends_on, using: str = 'default'):
+    """Make ``task`` depend on ``depends_on``; raises ``CycleError`` if it already blocks it."""
+    from .models import TaskDependency
+    if task.user_id != depends_on.user_id:
+        raise CycleError("Tasks can only depend on tasks of the same user")
+    if task.pk == depends_on.pk:
+        raise CycleError("A task can't depend on itself")
+    connection = connections[using]
+    _, _, dependencies = _tables(connection)
+    lock_user(task.user_id, using)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH RECURSIVE reach (id) AS (
+                SELECT depends_on_id FROM {dependencies} WHERE task_id = %s
+                UNION
+                SELECT d.depends_on_id FROM {dependencies} d JOIN reach r ON d.task_id = r.id
+            )
+            SELECT 1 FROM reach WHERE id = %s LIMIT 1
+        """, [depends_on.pk, task.pk])
+        if cursor.fetchone():
+            raise CycleError(f"Task {depends_on.pk} already depends on task {task.pk}")
+    dependency, _ = TaskDependency.objects.using(using).get_or_create(task=task, depends_on=depends_on)
+    return dependency
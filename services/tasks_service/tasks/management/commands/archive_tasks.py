@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.archive import archivable, archive_finished
+
+
+class Command(BaseCommand):
+    help = (
+        "Move done/cancelled tasks not updated for --older-than-days, with their "
+        "comments and attachments, to the archive tables in small batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.TASK_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.TASK_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the tasks that would move')
+
+    def handle(self, *args, **options):
+        older_than = timedelta(days=options['older_than_days'])
+        if options['dry_run']:
+            count = archivable(older_than, options['database']).count()
+            self.stdout.write(f"{count} tasks would be archived")
+            return
+
+        def on_batch(moved):
+            if options['verbosity'] > 1:
+                self.stdout.write(', '.join(f"{table}: {count}" for table, count in moved.items()))
+
+        started = time.perf_counter()
+        totals = archive_finished(older_than, options['batch_size'], options['database'],
+                                  options['max_batches'], options['pause'], on_batch)
+        elapsed = time.perf_counter() - started
+        moved = ', '.join(f"{count} from {table}" for table, count in totals.items()) or 'nothing'
+        self.stdout.write(f"Archived {moved} in {elapsed:.1f}s")
@@ -0,0 +1,84 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from tasks import rollups
+from tasks.models import ArchivedTask, Task, TaskRollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily task rollups from the live and archived tasks tables (archived "
+        "tasks keep counting in their users' history). Users are split into "
+        "ranges of --chunk-users ids; each range is recomputed with GROUP BY queries "
+        "and replaced in its own transaction, --workers ranges at a time. Task writes "
+        "for a range that land while it is being rebuilt may be missed; rerun the "
+        "range (--users FIRST:LAST) if that matters."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-users', type=int, default=1000, help='User ids per chunk')
+        parser.add_argument('--workers', type=int, default=4, help='Chunks rebuilt in parallel')
+        parser.add_argument('--users', metavar='FIRST:LAST', help='Only this range of user ids')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['users']:
+            first, _, last = options['users'].partition(':')
+            first, last = int(first), int(last or first)
+        else:
+            bounds = [model.objects.using(using).aggregate(first=Min('user_id'), last=Max('user_id'))
+                      for model in (Task, ArchivedTask)]
+            firsts = [b['first'] for b in bounds if b['first'] is not None]
+            if not firsts:
+                self.stdout.write("No tasks to roll up")
+                return
+            first, last = min(firsts), max(b['last'] for b in bounds if b['last'] is not None)
+
+        workers = options['workers']
+        if connections[using].vendor == 'sqlite':
+            workers = 1  # One writer at a time; more threads would only wait on the lock
+        size = options['chunk_users']
+        chunks = [(low, min(low + size - 1, last)) for low in range(first, last + 1, size)]
+
+        started = time.perf_counter()
+        if workers > 1:
+            pool = ThreadPoolExecutor(max_workers=workers)
+            results = pool.map(lambda chunk: self.rebuild_in_thread(*chunk, using), chunks)
+        else:
+            pool, results = None, (self.rebuild(*chunk, using) for chunk in chunks)
+        try:
+            for low, high, buckets, elapsed in results:
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"users {low}-{high}: {buckets} buckets in {elapsed:.1f}s")
+        finally:
+            if pool:
+                pool.shutdown()
+        self.stdout.write(f"Rebuilt rollups for users {first}-{last} in {len(chunks)} chunks "
+                          f"in {time.perf_counter() - started:.1f}s")
+
+    def rebuild(self, low, high, using):
+        started = time.perf_counter()
+        with transaction.atomic(using=using):
+            counts = rollups.bucket_counts(Task.objects.using(using).filter(user_id__range=(low, high)))
+            archived = rollups.bucket_counts(ArchivedTask.objects.using(using).filter(user_id__range=(low, high)))
+            for bucket, values in archived.items():
+                counts[bucket] = [a + b for a, b in zip(counts[bucket], values)]
+            TaskRollup.objects.using(using).filter(user_id__range=(low, high)).delete()
+            TaskRollup.objects.using(using).bulk_create([
+                TaskRollup(user_id=user_id, day=day, status=status, priority=priority,
+                           created=created, completed=completed, overdue=overdue)
+                for (user_id, day, status, priority), (created, completed, overdue) in counts.items()
+            ], batch_size=1000)
+        return low, high, len(counts), time.perf_counter() - started
+
+    def rebuild_in_thread(self, low, high, using):
+        try:
+            return self.rebuild(low, high, using)
+        finally:
+            # Pool threads open their own connections
+            connections.close_all()
@@ -0,0 +1,71 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.importer import FORMATS, KINDS, run_import
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import tasks, comments and attachment metadata from CSV or NDJSON "
+        "(optionally .gz). Files are loaded parents first; rerunning with the same "
+        "SOURCE resumes each file after its last committed batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Name of this import; scopes external ids and checkpoints')
+        for kind in KINDS:
+            parser.add_argument(f'--{kind}', metavar='PATH', help=f'File of {kind} rows')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=settings.TASK_IMPORT_BATCH_SIZE)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--restart', action='store_true', help='Ignore checkpoints and start over')
+        parser.add_argument('--no-reminders', action='store_true',
+                            help='Skip syncing due-date reminders for imported tasks')
+        parser.add_argument('--errors', metavar='PATH', help='Write rejected rows here as NDJSON')
+
+    def handle(self, *args, **options):
+        files = [(kind, options[kind]) for kind in KINDS if options[kind]]
+        if not files:
+            raise CommandError(f"Nothing to import; pass any of {', '.join(f'--{kind}' for kind in KINDS)}")
+
+        error_file = open(options['errors'], 'a', encoding='utf-8') if options['errors'] else None
+        results = []
+        try:
+            for kind, path in files:
+                def on_error(line, message, row, kind=kind, path=path):
+                    if error_file:
+                        error_file.write(json.dumps({'kind': kind, 'file': path, 'line': line,
+                                                     'error': message, 'row': row}, default=str) + '\n')
+
+                def on_batch(result):
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f"{result.kind}: {result.resumed_from + result.read} rows, "
+                                          f"{result.rows_per_sec:,.0f} rows/s")
+
+                result = run_import(
+                    options['source'], kind, path,
+                    file_format=options['format'],
+                    batch_size=options['batch_size'],
+                    using=options['database'],
+                    restart=options['restart'],
+                    sync_reminders=not options['no_reminders'],
+                    on_error=on_error,
+                    on_batch=on_batch,
+                )
+                results.append(result)
+        finally:
+            if error_file:
+                error_file.close()
+
+        for result in results:
+            resumed = f" (resumed after row {result.resumed_from})" if result.resumed_from else ''
+            self.stdout.write(
+                f"{result.kind}: read {result.read}, loaded {result.loaded}, "
+                f"skipped {result.skipped}, rejected {result.rejected} "
+                f"in {result.elapsed:.1f}s, {result.rows_per_sec:,.0f} rows/s{resumed}"
+            )
+        if any(result.rejected for result in results):
+            self.stderr.write("Some rows were rejected" + (f"; see {options['errors']}" if options['errors']
+                                                           else '; pass --errors PATH to keep them'))
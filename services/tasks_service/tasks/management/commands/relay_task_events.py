@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from tasks.events import relay
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish task events from the outbox to RabbitMQ until stopped. Run it when the "
+        "web processes don't (TASK_EVENT_RELAY_THREAD=False); several may run at once."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Relaying task events")
+        relay.run()
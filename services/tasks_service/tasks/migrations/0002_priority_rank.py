@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:08
+
+from django.db import migrations, models, transaction
+from django.db.models import Case, IntegerField, Max, Value, When
+
+# Frozen copy of AbstractTask.PRIORITY_RANKS as of this migration
+PRIORITY_RANKS = {'low': 0, 'medium': 1, 'high': 2, 'urgent': 3}
+BATCH_SIZE = 10000
+
+
+def backfill_priority_rank(apps, schema_editor):
+    """Set the rank of existing rows, one committed id range at a time so locks stay short."""
+    using = schema_editor.connection.alias
+    rank = Case(*[When(priority=priority, then=Value(value)) for priority, value in PRIORITY_RANKS.items()],
+                default=Value(PRIORITY_RANKS['medium']), output_field=IntegerField())
+    for model_name in ('Task', 'ArchivedTask'):
+        # New rows already get medium's rank as the column default
+        rows = apps.get_model('tasks', model_name).objects.using(using).exclude(priority='medium')
+        last = rows.aggregate(last=Max('id'))['last'] or 0
+        for low in range(0, last, BATCH_SIZE):
+            with transaction.atomic(using=using):
+                rows.filter(id__gt=low, id__lte=low + BATCH_SIZE).update(priority_rank=rank)
+
+
+class Migration(migrations.Migration):
+
+    # Each backfill batch commits on its own
+    atomic = False
+
+    dependencies = [
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedtask',
+            name='priority_rank',
+            field=models.PositiveSmallIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='priority_rank',
+            field=models.PositiveSmallIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(backfill_priority_rank, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user_id', 'priority_rank', 'id'], name='tasks_user_priority_rank'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0002_priority_rank'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskEventOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=50)),
+                ('content_type', models.CharField(max_length=100)),
+                ('body', models.BinaryField()),
+                ('headers', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'task_event_outbox',
+            },
+        ),
+    ]
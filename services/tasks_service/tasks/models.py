@@ -1,9 +1,88 @@
-from django.db import models
+import copy
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+from . import hierarchy, rollups, tagging
 
 
-class Task(models.Model):
-    """Task model for task management."""
+class ChangeTrackingMixin:
+    """
+    Track field changes so ``save()`` writes only the modified columns.
+    
+    Values are snapshotted when an instance is loaded or saved. Saving a
+    stored instance passes the changed fields plus ``auto_now`` timestamps as
+    ``update_fields``; an explicit ``update_fields`` is left alone.
+    ``changes`` gives ``{field: (old, new)}`` for unsaved edits and
+    ``saved_changes`` the diff written by the last save.
+    """
+    
+    saved_changes = {}
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot(field.attname for field in cls._meta.concrete_fields
+                           if field.attname in instance.__dict__)
+        return instance
+    
+    def _snapshot(self, attnames):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            loaded = self._loaded_values = {}
+        for attname in attnames:
+            value = self.__dict__[attname]
+            # Mutable values (JSON) are copied so in-place edits show up as changes
+            loaded[attname] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+    
+    @property
+    def changes(self):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return {}
+        changes = {}
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue  # Deferred and never assigned
+            old = loaded.get(field.attname, models.DEFERRED)
+            new = self.__dict__[field.attname]
+            if old is models.DEFERRED or old != new:
+                changes[field.name] = (None if old is models.DEFERRED else old, new)
+        return changes
+    
+    def save(self, *args, **kwargs):
+        tracked = (not self._state.adding and getattr(self, '_loaded_values', None) is not None
+                   and kwargs.get('update_fields') is None and not kwargs.get('force_insert'))
+        changes = self.changes
+        if tracked:
+            kwargs['update_fields'] = list(changes) + [
+                field.name for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False) and field.name not in changes
+            ]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            changes = {name: change for name, change in changes.items() if name in update_fields}
+        self.saved_changes = changes
+        super().save(*args, **kwargs)
+        
+        if update_fields is None:
+            self._snapshot(field.attname for field in self._meta.concrete_fields
+                           if field.attname in self.__dict__)
+        else:
+            self._snapshot(self._meta.get_field(name).attname for name in update_fields)
+    
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot(field.attname for field in self._meta.concrete_fields
+                       if field.attname in self.__dict__ and (fields is None or field.name in fields
+                                                              or field.attname in fields))
+
+
+class VersionConflict(Exception):
+    """A compare-and-swap save found the row at a different version."""
+
+
+class AbstractTask(models.Model):
+    """Columns shared by live and archived tasks."""
     
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -11,6 +90,8 @@ class Task(models.Model):
         ('high', 'High'),
         ('urgent', 'Urgent'),
     ]
+    # Sort order of priorities, lowest first; stored as priority_rank
+    PRIORITY_RANKS = {value: rank for rank, (value, _) in enumerate(PRIORITY_CHOICES)}
     
     STATUS_CHOICES = [
         ('todo', 'To Do'),
@@ -20,75 +101,340 @@ class Task(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
-    title = models.CharField(max_length=200)
+    # db_index: on Postgres this also adds a pattern_ops index for prefix searches
+    title = models.CharField(max_length=200, db_index=True)
     description = models.TextField(blank=True)
     user_id = models.IntegerField()  # Reference to user in auth service
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='medium')
+    # Set from priority on save, so priority ordering can use an index
+    priority_rank = models.PositiveSmallIntegerField(default=PRIORITY_RANKS['medium'], editable=False)
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='todo')
     due_date = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by every write; saves of a loaded task only apply if it is unchanged
+    version = models.PositiveIntegerField(default=1)
+    # Normalized tag list; TaskTag rows mirror it for filtering (see tasks.tagging)
+    tags = models.JSONField(default=list, blank=True)
+    
+    class Meta:
+        abstract = True
+    
+    def __str__(self):
+        return self.title
+
+
+class Task(ChangeTrackingMixin, AbstractTask):
+    """Task model for task management."""
+    
+    # Subtask of; hierarchy.TaskClosure is kept in step by save()
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='subtasks')
     
     class Meta:
         db_table = 'tasks'
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user_id']),
+            # ?ordering=priority and its cursor pages: user_id = ? ORDER BY priority_rank, id
+            models.Index(fields=['user_id', 'priority_rank', 'id'], name='tasks_user_priority_rank'),
             models.Index(fields=['status']),
             models.Index(fields=['priority']),
             models.Index(fields=['due_date']),
+            models.Index(fields=['created_at']),
         ]
     
-    def __str__(self):
-        return self.title
-    
     def save(self, *args, **kwargs):
         # Set completed_at when status changes to 'done'
-        if self.status == 'done' and not self.completed_at:
-            from django.utils import timezone
+        # Remembered for the task_completed event sent after commit
+        self._just_completed = self.status == 'done' and not self.completed_at
+        if self._just_completed:
             self.completed_at = timezone.now()
         elif self.status != 'done' and self.completed_at:
             self.completed_at = None
+        self.tags = tagging.normalize(self.tags)
+        self.priority_rank = self.PRIORITY_RANKS.get(self.priority, self.priority_rank)
+        if kwargs.get('update_fields') is not None and 'priority' in kwargs['update_fields']:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'priority_rank'}
         
-        # Update updated_at timestamp
-        from django.utils import timezone
-        self.updated_at = timezone.now()
+        # Compare-and-swap on the version this instance was loaded at
+        loaded = getattr(self, '_loaded_values', None) or {}
+        self._expected_version = loaded.get('version') if not self._state.adding else None
+        if self._expected_version is not None:
+            self.version = self._expected_version + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'version'}
         
-        super().save(*args, **kwargs)
+        # updated_at is auto_now; ChangeTrackingMixin adds it to update_fields
+        using = kwargs.get('using')
+        created = self._state.adding
+        old_parent_id = None if created else loaded.get('parent_id', self.parent_id)
+        if kwargs.get('update_fields') is not None and not {'parent', 'parent_id'} & set(kwargs['update_fields']):
+            old_parent_id = self.parent_id  # Parent isn't being written
+        try:
+            # The row, its rollup deltas, tag and closure rows commit together. Inside a
+            # caller's transaction this is a savepoint, so a conflict doesn't doom it.
+            with transaction.atomic(using=using):
+                moved = old_parent_id != self.parent_id
+                if moved and self.parent_id is not None:
+                    hierarchy.check_parent(self, using or 'default')
+                super().save(*args, **kwargs)
+                rollups.record_save(self, created, using)
+                tagging.record_save(self, created, using)
+                if moved:
+                    hierarchy.move(self.pk, old_parent_id, self.parent_id, using or 'default')
+        except VersionConflict:
+            self.version = self._expected_version
+            raise
+        finally:
+            self._expected_version = None
+    
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = getattr(self, '_expected_version', None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        # A single UPDATE ... WHERE id = %s AND version = %s
+        if super()._do_update(base_qs.filter(version=expected), using, pk_val, values,
+                              update_fields, forced_update):
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(f"Task {pk_val} is no longer at version {expected}")
+        return False
 
 
-class TaskComment(models.Model):
-    """Task comment model for task discussions."""
+class AbstractTaskComment(models.Model):
+    """Columns shared by live and archived comments."""
     
-    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='comments')
     user_id = models.IntegerField()  # Reference to user in auth service
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        abstract = True
+
+
+class TaskComment(ChangeTrackingMixin, AbstractTaskComment):
+    """Task comment model for task discussions."""
+    
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='comments')
+    
     class Meta:
         db_table = 'task_comments'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"Comment on {self.task.title} by user {self.user_id}"
 
 
-class TaskAttachment(models.Model):
-    """Task attachment model for file uploads."""
+class AbstractTaskAttachment(models.Model):
+    """Columns shared by live and archived attachments."""
     
-    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='attachments')
     user_id = models.IntegerField()  # Reference to user in auth service
-    file_name = models.CharField(max_length=255)
+    file_name = models.CharField(max_length=255, db_index=True)
     file_path = models.CharField(max_length=500)
     file_size = models.IntegerField()
     mime_type = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        db_table = 'task_attachments'
-        ordering = ['-created_at']
+        abstract = True
     
     def __str__(self):
         return f"Attachment: {self.file_name}"
+
+
+class TaskAttachment(AbstractTaskAttachment):
+    """Task attachment model for file uploads."""
+    
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='attachments')
+    
+    class Meta:
+        db_table = 'task_attachments'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+
+class TaskClosure(models.Model):
+    """One row per (ancestor, descendant) pair of the subtask tree (see ``tasks.hierarchy``)."""
+    
+    # The unique constraint below is the ancestor index
+    ancestor = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='descendant_links', db_index=False)
+    descendant = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+    
+    class Meta:
+        db_table = 'task_closure'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='task_closure_pair'),
+        ]
+
+
+class TaskDependency(models.Model):
+    """``task`` can't start until ``depends_on`` is finished."""
+    
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='dependencies', db_index=False)
+    depends_on = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='dependents')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'task_dependencies'
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'depends_on'], name='task_dependency_pair'),
+        ]
+
+
+class AbstractTaskTag(models.Model):
+    """Columns shared by live and archived tag rows."""
+    
+    user_id = models.IntegerField()  # Copied from the task, so filters stay on one index
+    tag = models.CharField(max_length=tagging.MAX_TAG_LENGTH)
+    
+    class Meta:
+        abstract = True
+
+
+class TaskTag(AbstractTaskTag):
+    """One tag of a task, kept in step with ``Task.tags`` by ``save()``."""
+    
+    # The unique constraint below is the task index
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='tag_rows', db_index=False)
+    
+    class Meta:
+        db_table = 'task_tags'
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'tag'], name='task_tag_pair'),
+        ]
+        indexes = [
+            # Covers the tag filters: EXISTS (... user_id = ? AND tag = ? AND task_id = ?)
+            models.Index(fields=['user_id', 'tag', 'task'], name='task_tags_user_tag_task'),
+        ]
+
+
+class TaskTagCount(models.Model):
+    """Number of live tasks of one user carrying a tag (see ``tasks.tagging``)."""
+    
+    user_id = models.IntegerField()
+    tag = models.CharField(max_length=tagging.MAX_TAG_LENGTH)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'task_tag_counts'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'tag'], name='task_tag_count_key'),
+        ]
+
+
+class ArchivedTask(AbstractTask):
+    """A finished task moved out of ``tasks`` by ``manage.py archive_tasks``."""
+    
+    id = models.BigIntegerField(primary_key=True)  # Same id as when it was live
+    parent_id = models.BigIntegerField(null=True, blank=True)
+    title = models.CharField(max_length=200)  # Only the indexes archive reads need
+    archived_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'tasks_archive'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user_id', 'created_at']),
+        ]
+
+
+class ArchivedTaskComment(AbstractTaskComment):
+    """A comment of an archived task."""
+    
+    id = models.BigIntegerField(primary_key=True)
+    task = models.ForeignKey(ArchivedTask, on_delete=models.CASCADE, related_name='comments')
+    
+    class Meta:
+        db_table = 'task_comments_archive'
+        ordering = ['created_at']
+
+
+class ArchivedTaskAttachment(AbstractTaskAttachment):
+    """An attachment of an archived task."""
+    
+    id = models.BigIntegerField(primary_key=True)
+    task = models.ForeignKey(ArchivedTask, on_delete=models.CASCADE, related_name='attachments')
+    file_name = models.CharField(max_length=255)
+    
+    class Meta:
+        db_table = 'task_attachments_archive'
+        ordering = ['-created_at']
+
+
+class ArchivedTaskTag(AbstractTaskTag):
+    """A tag of an archived task."""
+    
+    id = models.BigIntegerField(primary_key=True)
+    task = models.ForeignKey(ArchivedTask, on_delete=models.CASCADE, related_name='tag_rows')
+    
+    class Meta:
+        db_table = 'task_tags_archive'
+
+
+class TaskRollup(models.Model):
+    """Daily task counts for one user, status and priority (see ``tasks.rollups``)."""
+    
+    user_id = models.IntegerField()
+    day = models.DateField()
+    status = models.CharField(max_length=15)
+    priority = models.CharField(max_length=10)
+    created = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'task_rollups'
+        constraints = [
+            # Also the index for per-user date range queries
+            models.UniqueConstraint(fields=['user_id', 'day', 'status', 'priority'], name='task_rollup_bucket'),
+        ]
+
+
+class TaskImportRef(models.Model):
+    """The task an imported source row became, so later rows can refer to it."""
+    
+    source = models.CharField(max_length=100)
+    external_id = models.CharField(max_length=255)
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='+')
+    
+    class Meta:
+        db_table = 'task_import_refs'
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'external_id'], name='task_import_ref_unique'),
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    """Rows of one import file committed so far."""
+    
+    source = models.CharField(max_length=100)
+    kind = models.CharField(max_length=20)
+    rows_done = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'task_import_checkpoints'
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'kind'], name='import_checkpoint_unique'),
+        ]
+
+
+class TaskEventOutbox(models.Model):
+    """A task event committed with its change and not yet published (see ``events``)."""
+    
+    event_type = models.CharField(max_length=50)
+    content_type = models.CharField(max_length=100)
+    body = models.BinaryField()
+    headers = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'task_event_outbox'
@@ -0,0 +1,152 @@
+"""
+Pagination for large task tables.
+
+``ApproximateCountPaginator`` avoids an exact ``COUNT(*)`` over hundreds of
+millions of rows: on Postgres it asks the planner how many rows to expect
+(``pg_class.reltuples`` for an unfiltered table, ``EXPLAIN`` otherwise) and
+only counts exactly when that estimate is small. Other databases always
+count exactly.
+
+``KeysetPagination`` pages without counting or offsets: the cursor holds
+the ordering values of the last row sent and the next page starts after
+them, so every page costs the same index range scan.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Func, Value
+from django.db.models.lookups import GreaterThan, LessThan
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+# Below this many estimated rows an exact count is cheap enough
+APPROXIMATE_COUNT_THRESHOLD = 100000
+
+
+def estimated_count(queryset):
+    """The planner's row estimate for ``queryset``, or None if not available."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            # -1 until the table has been vacuumed or analyzed
+            if row and row[0] >= 0:
+                return row[0]
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximateCountPaginator(Paginator):
+    """Paginator whose count is the planner's estimate once it is large."""
+    
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list) if hasattr(self.object_list, 'query') else None
+        if estimate is None or estimate < APPROXIMATE_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+
+class RowValue(Func):
+    """``(a, b, ...)``, to compare several columns at once as SQL row values."""
+    
+    template = '(%(expressions)s)'
+    
+    def _resolve_output_field(self):
+        # Only ever compared whole; the first column's type stands in for the row
+        return self.get_source_fields()[0]
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """``DjangoJSONEncoder`` that keeps datetimes' microseconds; it cuts them to milliseconds."""
+    
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward cursor pagination on the queryset's ordering.
+    
+    The ordering must all go one way and end with ``id``, as
+    ``TaskOrderingFilter`` makes it. The next page is the rows after the
+    cursor's row value, ``(priority_rank, id) > (%s, %s)``, which an index
+    on ``(user_id, priority_rank, id)`` answers without skipping any rows.
+    Mixed directions (``?ordering=priority,-created_at``) and nullable
+    ordering fields can't be used and are rejected with a 400. Cursor
+    values must round-trip exactly, so datetimes keep their microseconds.
+    """
+    
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = list(queryset.query.order_by)
+        fields = [queryset.model._meta.get_field(term.lstrip('-')) for term in ordering]
+        descending = bool(ordering) and ordering[0].startswith('-')
+        if not fields or not fields[-1].primary_key or any(term.startswith('-') != descending for term in ordering):
+            raise ValidationError({'ordering': 'Cursor pagination needs all ordering fields in the same direction'})
+        if any(field.null for field in fields):
+            raise ValidationError({'ordering': 'Cursor pagination needs an ordering on non-null fields'})
+        
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            values = self.decode_cursor(encoded, fields)
+            after = LessThan if descending else GreaterThan
+            queryset = queryset.filter(after(
+                RowValue(*[F(field.attname) for field in fields]),
+                RowValue(*[Value(value, output_field=field) for value, field in zip(values, fields)]),
+            ))
+        rows = list(queryset[:self.page_size + 1])
+        page = rows[:self.page_size]
+        self.next_values = [getattr(page[-1], field.attname) for field in fields] if len(rows) > len(page) else None
+        return page
+    
+    def decode_cursor(self, encoded, fields):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for value, field in zip(values, fields)]
+        except (binascii.Error, TypeError, ValueError, DjangoValidationError) as exc:
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'}) from exc
+    
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        cursor = base64.urlsafe_b64encode(json.dumps(self.next_values, cls=CursorEncoder).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+    
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+    
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
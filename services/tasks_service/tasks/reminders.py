@@ -0,0 +1,95 @@
+"""
+Redis sorted-set index of upcoming task reminders.
+
+Each open task with a due date has two members in ``reminders:schedule``:
+``due_soon:<id>`` scored at ``due_date - TASK_DUE_SOON_LEAD`` and
+``overdue:<id>`` scored at ``due_date``. The notifications service pops only
+the members whose score has passed, so a tick never scans the whole index.
+
+Only members whose time is still ahead are (re)added: a popped member is a
+reminder that was sent, so edits to a task never send it again. Past members
+are dropped only when the due date itself moves; otherwise one that is due
+but not yet popped still fires.
+"""
+
+import json
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REMINDER_SCHEDULE_KEY = 'reminders:schedule'
+REMINDER_PAYLOAD_KEY = 'reminders:payload'
+REMINDER_KINDS = ('due_soon', 'overdue')
+OPEN_STATUSES = ('todo', 'in_progress', 'review')
+
+_redis_client = None
+
+
+def get_redis():
+    """Return a shared Redis client for the reminder index."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.from_url(settings.REDIS_URL)
+    return _redis_client
+
+
+def _members(task_id):
+    return [f"{kind}:{task_id}" for kind in REMINDER_KINDS]
+
+
+def sync_task_reminders(tasks, due_date_changed=True):
+    """Add, move or remove reminder entries to match the current task state.
+    
+    Pass ``due_date_changed=False`` when only other fields (title, status)
+    changed, so reminders that are due but not yet sent are kept.
+    """
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for task in tasks:
+            if task.due_date and task.status in OPEN_STATUSES:
+                due_ts = task.due_date.timestamp()
+                scores = {
+                    f"due_soon:{task.id}": due_ts - settings.TASK_DUE_SOON_LEAD,
+                    f"overdue:{task.id}": due_ts,
+                }
+                upcoming = {member: score for member, score in scores.items() if score > now}
+                passed = [member for member in scores if member not in upcoming]
+                if upcoming:
+                    pipe.zadd(REMINDER_SCHEDULE_KEY, upcoming)
+                if passed and due_date_changed:
+                    pipe.zrem(REMINDER_SCHEDULE_KEY, *passed)
+                if not upcoming:
+                    if due_date_changed:
+                        pipe.hdel(REMINDER_PAYLOAD_KEY, task.id)
+                    continue
+                pipe.hset(REMINDER_PAYLOAD_KEY, task.id, json.dumps({
+                    'id': task.id,
+                    'user_id': task.user_id,
+                    'title': task.title,
+                    'task_title': task.title,
+                    'due_date': task.due_date.isoformat(),
+                }))
+            else:
+                pipe.zrem(REMINDER_SCHEDULE_KEY, *_members(task.id))
+                pipe.hdel(REMINDER_PAYLOAD_KEY, task.id)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Failed to sync task reminders: %s", e)
+
+
+def clear_task_reminders(task_ids):
+    """Remove reminder entries for deleted tasks."""
+    if not task_ids:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.zrem(REMINDER_SCHEDULE_KEY, *(m for task_id in task_ids for m in _members(task_id)))
+        pipe.hdel(REMINDER_PAYLOAD_KEY, *task_ids)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Failed to clear task reminders: %s", e)
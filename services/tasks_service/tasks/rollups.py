@@ -0,0 +1,124 @@
+"""
+Daily task counts per user, status and priority (``TaskRollup``).
+
+Every task contributes to up to three buckets, keyed by its current status
+and priority:
+
+- ``created`` on the day of ``created_at``
+- ``completed`` on the day of ``completed_at``
+- ``overdue`` on the day of ``due_date``, unless the task was cancelled or
+  completed by its due date
+
+Writes apply the difference between a task's contributions before and
+after, in the same transaction as the write, with one
+``INSERT ... ON CONFLICT DO UPDATE`` that adds to the counters. Days are
+taken in the current time zone, as ``TruncDate`` does for the backfill.
+"""
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connections
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Task fields the contributions depend on
+STATE_FIELDS = ('user_id', 'status', 'priority', 'created_at', 'completed_at', 'due_date')
+METRICS = ('created', 'completed', 'overdue')
+
+Bucket = Tuple[int, object, str, str]  # user_id, day, status, priority
+
+UPSERT_SQL = """
+    INSERT INTO {table} (user_id, day, status, priority, created, completed, overdue)
+    VALUES {values}
+    ON CONFLICT (user_id, day, status, priority) DO UPDATE SET
+        created = {table}.created + EXCLUDED.created,
+        completed = {table}.completed + EXCLUDED.completed,
+        overdue = {table}.overdue + EXCLUDED.overdue
+"""
+UPSERT_BATCH = 500
+
+
+def is_overdue(state: dict) -> bool:
+    due_date, completed_at = state['due_date'], state['completed_at']
+    return (due_date is not None and state['status'] != 'cancelled'
+            and (completed_at is None or completed_at > due_date))
+
+
+def contributions(state: dict) -> List[Tuple[Bucket, int]]:
+    """``(bucket, metric index)`` pairs a task in ``state`` counts towards."""
+    dims = (state['status'], state['priority'])
+    result = [((state['user_id'], timezone.localdate(state['created_at']), *dims), 0)]
+    if state['completed_at'] is not None:
+        result.append(((state['user_id'], timezone.localdate(state['completed_at']), *dims), 1))
+    if is_overdue(state):
+        result.append(((state['user_id'], timezone.localdate(state['due_date']), *dims), 2))
+    return result
+
+
+def diff(before: Iterable[dict], after: Iterable[dict]) -> Dict[Bucket, List[int]]:
+    """Counter deltas for tasks going from the ``before`` states to the ``after`` states."""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for sign, states in ((-1, before), (1, after)):
+        for state in states:
+            for bucket, metric in contributions(state):
+                deltas[bucket][metric] += sign
+    return {bucket: counts for bucket, counts in deltas.items() if any(counts)}
+
+
+def apply(deltas: Dict[Bucket, List[int]], using: str = 'default'):
+    """Add ``deltas`` to the stored buckets, creating missing ones."""
+    if not deltas:
+        return
+    from .models import TaskRollup
+
+    connection = connections[using]
+    table = connection.ops.quote_name(TaskRollup._meta.db_table)
+    # Sorted, so concurrent writers lock the bucket rows in the same order
+    rows = sorted(deltas.items())
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[offset:offset + UPSERT_BATCH]
+            params = []
+            for (user_id, day, status, priority), counts in batch:
+                params += [user_id, connection.ops.adapt_datefield_value(day), status, priority, *counts]
+            values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(batch))
+            cursor.execute(UPSERT_SQL.format(table=table, values=values), params)
+
+
+def task_state(task, overrides: Optional[dict] = None) -> dict:
+    state = {name: getattr(task, name) for name in STATE_FIELDS}
+    state.update(overrides or {})
+    return state
+
+
+def record_save(task, created: bool, using: Optional[str] = None):
+    """Apply the rollup deltas of a ``Task.save`` (``saved_changes`` holds the old values)."""
+    if created:
+        apply(diff([], [task_state(task)]), using or 'default')
+        return
+    changed = {name: old for name, (old, new) in task.saved_changes.items() if name in STATE_FIELDS}
+    if changed:
+        apply(diff([task_state(task, changed)], [task_state(task)]), using or 'default')
+
+
+def record_delete(task, using: Optional[str] = None):
+    apply(diff([task_state(task)], []), using or 'default')
+
+
+def bucket_counts(queryset) -> Dict[Bucket, List[int]]:
+    """Compute the buckets of all tasks in ``queryset`` in the database."""
+    dims = ('user_id', 'day', 'status', 'priority')
+    sources = (
+        queryset.annotate(day=TruncDate('created_at')),
+        queryset.filter(completed_at__isnull=False).annotate(day=TruncDate('completed_at')),
+        queryset.filter(due_date__isnull=False).exclude(status='cancelled').filter(
+            Q(completed_at__isnull=True) | Q(completed_at__gt=F('due_date'))
+        ).annotate(day=TruncDate('due_date')),
+    )
+    counts = defaultdict(lambda: [0, 0, 0])
+    for metric, rows in enumerate(sources):
+        for row in rows.order_by().values(*dims).annotate(n=Count('id')):
+            counts[tuple(row[name] for name in dims)][metric] = row['n']
+    return counts
@@ -0,0 +1,140 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+``ReplicaRoutingMiddleware`` marks GET/HEAD/OPTIONS requests as safe to
+read from a replica. Writes and everything outside a request (management
+commands, Celery tasks) keep using the primary. After a successful write
+the response sets a cookie that pins that client's reads to the primary for
+``READ_YOUR_WRITES_WINDOW`` seconds, long enough for replicas to catch up.
+
+``ReplicaRouter`` picks a replica at random among those whose replication
+lag, checked at most every ``REPLICA_LAG_CHECK_INTERVAL`` seconds per
+process, is under ``REPLICA_MAX_LAG``. Unreachable or lagging replicas are
+skipped; with none left reads fall back to the primary.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = 'default'
+PIN_COOKIE = 'primary_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Postgres hot standby lag in seconds; 0 when it has replayed everything it received
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+
+
+def replication_lag(alias: str) -> float:
+    """Seconds the replica is behind the primary."""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        # No replication status to ask for (e.g. a SQLite copy used locally)
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(POSTGRES_LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaHealth:
+    """Per-process cache of which replicas are fit to serve reads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._healthy: Dict[str, bool] = {}
+        self._checked_at: Dict[str, float] = {}
+
+    def is_healthy(self, alias: str) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at.get(alias, float('-inf')) >= settings.REPLICA_LAG_CHECK_INTERVAL:
+            with self._lock:
+                # Another thread may have refreshed it while we waited
+                if now - self._checked_at.get(alias, float('-inf')) >= settings.REPLICA_LAG_CHECK_INTERVAL:
+                    self._healthy[alias] = self._check(alias)
+                    self._checked_at[alias] = now
+        return self._healthy[alias]
+
+    def _check(self, alias: str) -> bool:
+        try:
+            lag = replication_lag(alias)
+        except DatabaseError as e:
+            logger.warning("Replica %s unavailable, reading from primary: %s", alias, e)
+            return False
+        if lag > settings.REPLICA_MAX_LAG:
+            logger.warning("Replica %s is %.1fs behind, skipping it", alias, lag)
+            return False
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._healthy.clear()
+            self._checked_at.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    """Send reads to a healthy replica when the current request allows it."""
+
+    def db_for_read(self, model, **hints) -> str:
+        if not settings.DATABASE_REPLICAS or not _replica_reads.get():
+            return PRIMARY
+        if connections[PRIMARY].in_atomic_block:
+            # Reads inside a transaction must see its own writes
+            return PRIMARY
+        return pick_replica() or PRIMARY
+
+    def db_for_write(self, model, **hints) -> str:
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> bool:
+        return db == PRIMARY
+
+
+def pick_replica() -> Optional[str]:
+    healthy = [alias for alias in settings.DATABASE_REPLICAS if replica_health.is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+class ReplicaRoutingMiddleware:
+    """Allow replica reads for safe requests from clients not pinned to the primary."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        safe = request.method in SAFE_METHODS
+        token = _replica_reads.set(safe and PIN_COOKIE not in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+
+        if not safe and response.status_code < 400 and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.READ_YOUR_WRITES_WINDOW,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -1,7 +1,29 @@
 from rest_framework import serializers
+from . import tagging
 from .models import Task, TaskComment, TaskAttachment
 
 
+class ParentField(serializers.PrimaryKeyRelatedField):
+    """``parent_id`` in requests; only the requesting user's tasks can be parents."""
+    
+    def get_queryset(self):
+        return Task.objects.filter(user_id=self.context['request'].user_id)
+
+
+class TagsField(serializers.ListField):
+    """A task's tags; stored trimmed, lowercased and without repeats."""
+    
+    def __init__(self, **kwargs):
+        super().__init__(child=serializers.CharField(max_length=tagging.MAX_TAG_LENGTH),
+                         max_length=tagging.MAX_TAGS, **kwargs)
+    
+    def to_internal_value(self, data):
+        tags = tagging.normalize(super().to_internal_value(data))
+        if any(',' in tag for tag in tags):
+            raise serializers.ValidationError("Tags can't contain commas")
+        return tags
+
+
 class TaskSerializer(serializers.ModelSerializer):
     """Serializer for Task model."""
     
@@ -9,17 +31,20 @@ class TaskSerializer(serializers.ModelSerializer):
         model = Task
         fields = [
             'id', 'title', 'description', 'user_id', 'priority', 'status',
-            'due_date', 'created_at', 'updated_at', 'completed_at'
+            'due_date', 'created_at', 'updated_at', 'completed_at', 'version', 'parent_id', 'tags'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'completed_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'completed_at', 'version']
 
 
 class TaskCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating tasks."""
     
+    parent_id = ParentField(source='parent', required=False, allow_null=True)
+    tags = TagsField(required=False)
+    
     class Meta:
         model = Task
-        fields = ['title', 'description', 'priority', 'status', 'due_date']
+        fields = ['title', 'description', 'priority', 'status', 'due_date', 'parent_id', 'tags']
     
     def create(self, validated_data):
         validated_data['user_id'] = self.context['request'].user_id
@@ -29,9 +54,14 @@ class TaskCreateSerializer(serializers.ModelSerializer):
 class TaskUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating tasks."""
     
+    parent_id = ParentField(source='parent', required=False, allow_null=True)
+    tags = TagsField(required=False)
+    
     class Meta:
         model = Task
-        fields = ['title', 'description', 'priority', 'status', 'due_date']
+        fields = ['title', 'description', 'priority', 'status', 'due_date', 'version', 'parent_id', 'tags']
+        # The expected version is read by the view (If-Match or body); the new one is returned
+        read_only_fields = ['version']
 
 
 class TaskCommentSerializer(serializers.ModelSerializer):
@@ -67,6 +97,21 @@ class TaskDetailSerializer(TaskSerializer):
     
     comments = TaskCommentSerializer(many=True, read_only=True)
     attachments = TaskAttachmentSerializer(many=True, read_only=True)
+    # From hierarchy.annotate_progress; archived tasks have no subtasks or dependencies
+    subtasks_total = serializers.IntegerField(read_only=True, default=0)
+    subtasks_done = serializers.IntegerField(read_only=True, default=0)
+    blocked = serializers.BooleanField(read_only=True, default=False)
+    
+    class Meta(TaskSerializer.Meta):
+        fields = TaskSerializer.Meta.fields + [
+            'comments', 'attachments', 'subtasks_total', 'subtasks_done', 'blocked'
+        ]
+
+
+class SubtaskSerializer(TaskSerializer):
+    """A task in a subtree listing, with its depth below the root."""
+    
+    depth = serializers.IntegerField(read_only=True)
     
     class Meta(TaskSerializer.Meta):
-        fields = TaskSerializer.Meta.fields + ['comments', 'attachments']
+        fields = TaskSerializer.Meta.fields + ['depth']
@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import facets, rollups, tagging
+from .events import publish_task_event
+from .models import Task
+from .reminders import sync_task_reminders, clear_task_reminders
+
+
+# Fields copied into the reminder index
+REMINDER_FIELDS = {'title', 'status', 'due_date'}
+
+
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, created, **kwargs):
+    """Keep the reminder index and cached facets in step, and notify the owner."""
+    changes = instance.saved_changes
+    # Saves of instances that weren't loaded aren't tracked, so assume anything changed
+    untracked = kwargs.get('update_fields') is None
+    if created or untracked or REMINDER_FIELDS & changes.keys():
+        due_date_changed = created or untracked or 'due_date' in changes
+        transaction.on_commit(lambda: sync_task_reminders([instance], due_date_changed))
+    user_id = instance.user_id
+    transaction.on_commit(lambda: facets.invalidate([user_id]))
+    
+    if created:
+        event_type = 'task_created'
+    elif getattr(instance, '_just_completed', False):
+        event_type = 'task_completed'
+    else:
+        event_type = 'task_updated'
+    # Written to the outbox in the save's transaction, published after it commits
+    publish_task_event(event_type, instance, changes, kwargs.get('using'))
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    """Drop reminders, rollup and tag counts and cached facets for deleted tasks."""
+    rollups.record_delete(instance, kwargs.get('using'))
+    tagging.record_delete(instance, kwargs.get('using'))
+    task_id, user_id = instance.id, instance.user_id
+    transaction.on_commit(lambda: clear_task_reminders([task_id]))
+    transaction.on_commit(lambda: facets.invalidate([user_id]))
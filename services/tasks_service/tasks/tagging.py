@@ -0,0 +1,119 @@
+"""
+Task tags.
+
+``Task.tags`` holds a task's tags as a JSON list, which is what the API and
+exports show. ``TaskTag`` has one row per (task, tag), indexed on
+``(user_id, tag, task_id)``, and is what ``?tags=``/``?tags_any=`` filter
+on: each tag is an ``EXISTS`` answered from that index alone, the same on
+Postgres and SQLite. ``TaskTagCount`` keeps the number of live tasks per
+user and tag.
+
+``Task.save`` updates the tag rows and counts in the task's own
+transaction, from the difference between the old and new lists. Archived
+tasks take their tag rows with them and drop out of the counts.
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connections
+from django.db.models import Count, Exists, OuterRef
+
+MAX_TAGS = 20
+MAX_TAG_LENGTH = 50
+
+UPSERT_SQL = """
+    INSERT INTO {table} (user_id, tag, count)
+    VALUES {values}
+    ON CONFLICT (user_id, tag) DO UPDATE SET count = {table}.count + EXCLUDED.count
+"""
+UPSERT_BATCH = 500
+
+
+def normalize(tags: Iterable[str]) -> List[str]:
+    """Trimmed, lowercased tags without blanks or repeats, in their first order."""
+    result = []
+    for tag in tags or ():
+        tag = tag.strip().lower()
+        if tag and tag not in result:
+            result.append(tag)
+    return result
+
+
+def parse(value: str) -> List[str]:
+    """Tags from a comma-separated query parameter."""
+    return normalize(value.split(','))
+
+
+def apply_counts(deltas: Dict[Tuple[int, str], int], using: str = 'default'):
+    """Add ``deltas`` to the per-user tag counts, creating missing ones."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    from .models import TaskTagCount
+
+    connection = connections[using]
+    table = connection.ops.quote_name(TaskTagCount._meta.db_table)
+    # Sorted, so concurrent writers lock the count rows in the same order
+    rows = sorted(deltas.items())
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), UPSERT_BATCH):
+            batch = rows[offset:offset + UPSERT_BATCH]
+            params = [value for (user_id, tag), delta in batch for value in (user_id, tag, delta)]
+            values = ', '.join(['(%s, %s, %s)'] * len(batch))
+            cursor.execute(UPSERT_SQL.format(table=table, values=values), params)
+
+
+def _retag(task, old: List[str], new: List[str], using: str):
+    from .models import TaskTag
+    added, removed = set(new) - set(old), set(old) - set(new)
+    if removed:
+        TaskTag.objects.using(using).filter(task_id=task.pk, tag__in=removed).delete()
+    if added:
+        TaskTag.objects.using(using).bulk_create(
+            [TaskTag(task_id=task.pk, user_id=task.user_id, tag=tag) for tag in sorted(added)])
+    deltas = Counter({(task.user_id, tag): 1 for tag in added})
+    deltas.subtract({(task.user_id, tag): 1 for tag in removed})
+    apply_counts(deltas, using)
+
+
+def record_save(task, created: bool, using: Optional[str] = None):
+    """Update the tag rows and counts for a ``Task.save`` (``saved_changes`` holds the old list)."""
+    if created:
+        _retag(task, [], task.tags, using or 'default')
+    elif 'tags' in task.saved_changes:
+        old, new = task.saved_changes['tags']
+        _retag(task, old or [], new, using or 'default')
+
+
+def record_delete(task, using: Optional[str] = None):
+    # The tag rows go with the task (CASCADE)
+    apply_counts({(task.user_id, tag): -1 for tag in task.tags}, using or 'default')
+
+
+def forget(task_ids: List[int], using: str = 'default'):
+    """Take tasks about to be archived out of the counts."""
+    from .models import TaskTag
+    rows = (TaskTag.objects.using(using).filter(task_id__in=task_ids).order_by()
+            .values('user_id', 'tag').annotate(n=Count('id')))
+    apply_counts({(row['user_id'], row['tag']): -row['n'] for row in rows}, using)
+
+
+def _tag_rows(queryset, tags):
+    # TaskTag for tasks, ArchivedTaskTag for archived ones
+    model = queryset.model._meta.get_field('tag_rows').related_model
+    return model.objects.filter(user_id=OuterRef('user_id'), task=OuterRef('pk'), tag__in=tags)
+
+
+def filter_all(queryset, tags: List[str]):
+    """Tasks in ``queryset`` carrying every one of ``tags``."""
+    for tag in tags:
+        queryset = queryset.filter(Exists(_tag_rows(queryset, [tag])))
+    return queryset
+
+
+def filter_any(queryset, tags: List[str]):
+    """Tasks in ``queryset`` carrying at least one of ``tags``."""
+    if not tags:
+        return queryset
+    return queryset.filter(Exists(_tag_rows(queryset, tags)))
@@ -1,8 +1,49 @@
-from django.test import TestCase
-from rest_framework.test import APITestCase
+import csv
+import gzip
+import importlib
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+import threading
+import pika
+from django.apps import apps
+from django.db import OperationalError, connection, transaction
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
 from rest_framework import status
 from django.urls import reverse
-from .models import Task, TaskComment, TaskAttachment
+from django.core.management import call_command
+from taskflow_common.profiling import ProfilingMiddleware, make_profile_token
+from taskflow_common.warmup import warm_up
+from .events import HEADER, BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE, task_event_message
+from .models import (ArchivedTask, Task, TaskClosure, TaskComment, TaskAttachment, TaskDependency, TaskRollup,
+                     TaskEventOutbox, TaskTag, TaskTagCount, VersionConflict)
+from . import events, hierarchy, rollups, tagging, tracing, views
+from .reminders import REMINDER_SCHEDULE_KEY, REMINDER_PAYLOAD_KEY, sync_task_reminders
+from .pagination import ApproximateCountPaginator
+from .serializers import TaskSerializer
+from .importer import OrmLoader, run_import
+from .routing import PIN_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware, replica_health
+
+
+class MockRedisMixin:
+    """Replace the Redis client of the reminder index and facet cache with a mock, ``self.redis``."""
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('tasks.reminders.get_redis')
+        self.redis = patcher.start().return_value
+        self.addCleanup(patcher.stop)
 
 
 class TaskModelTest(TestCase):
@@ -29,6 +70,33 @@ class TaskModelTest(TestCase):
         """Test task string representation."""
         task = Task.objects.create(**self.task_data)
         self.assertEqual(str(task), self.task_data['title'])
+    
+    def test_save_writes_only_changed_columns(self):
+        """Test that saving a loaded task updates the changed fields and timestamps only."""
+        task_id = Task.objects.create(**self.task_data).id
+        task = Task.objects.get(id=task_id)
+        task.status = 'done'
+        
+        with CaptureQueriesContext(connection) as queries:
+            task.save()
+        
+        sql = next(query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE'))
+        set_clause = sql[sql.index(' SET ') + 5:sql.index(' WHERE ')]
+        self.assertEqual(
+            sorted(column.split(' = ')[0].strip('"') for column in set_clause.split(', ')),
+            ['completed_at', 'status', 'updated_at', 'version'],
+        )
+        self.assertEqual(task.saved_changes['status'], ('todo', 'done'))
+        self.assertEqual(task.changes, {})
+    
+    def test_in_place_edits_and_refresh(self):
+        """Test that changes are reported against the loaded values and reset by refresh_from_db."""
+        task = Task.objects.create(**self.task_data)
+        task.title = 'Renamed'
+        self.assertEqual(task.changes, {'title': ('Test Task', 'Renamed')})
+        
+        task.refresh_from_db()
+        self.assertEqual(task.changes, {})
 
 
 class TaskAPITest(APITestCase):
@@ -66,3 +134,1150 @@ class TaskAPITest(APITestCase):
         response = self.client.get(self.task_list_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 1)
+
+
+class TaskReminderIndexTest(MockRedisMixin, TestCase):
+    """Test cases for the due-date reminder index."""
+    
+    def setUp(self):
+        super().setUp()
+        self.pipe = self.redis.pipeline.return_value
+    
+    def test_open_task_with_due_date_is_scheduled(self):
+        """Test that both reminders are scored from the due date."""
+        due = timezone.now() + timedelta(days=3)
+        task = Task(id=5, title='Ship it', user_id=1, status='todo', due_date=due)
+        
+        with self.settings(TASK_DUE_SOON_LEAD=3600):
+            sync_task_reminders([task])
+        
+        self.pipe.zadd.assert_called_once_with(REMINDER_SCHEDULE_KEY, {
+            'due_soon:5': due.timestamp() - 3600,
+            'overdue:5': due.timestamp(),
+        })
+        self.pipe.hset.assert_called_once()
+        self.pipe.execute.assert_called_once()
+    
+    def test_finished_task_is_unscheduled(self):
+        """Test that done tasks are removed from the index."""
+        task = Task(id=5, title='Ship it', user_id=1, status='done',
+                    due_date=timezone.now() + timedelta(days=3))
+        
+        sync_task_reminders([task])
+        
+        self.pipe.zadd.assert_not_called()
+        self.pipe.zrem.assert_called_once_with(REMINDER_SCHEDULE_KEY, 'due_soon:5', 'overdue:5')
+        self.pipe.hdel.assert_called_once_with(REMINDER_PAYLOAD_KEY, 5)
+    
+    def test_save_syncs_on_commit(self):
+        """Test that saving a task refreshes the index after commit."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(title='Later', user_id=1, due_date=timezone.now() + timedelta(days=1))
+        
+        self.pipe.zadd.assert_called_once()
+    
+    def test_sent_reminders_are_not_scheduled_again(self):
+        """Test that edits after a reminder fired only re-add the reminders still ahead."""
+        due = timezone.now() + timedelta(minutes=30)
+        task = Task(id=5, title='Ship it', user_id=1, status='todo', due_date=due)
+        
+        with self.settings(TASK_DUE_SOON_LEAD=3600):
+            sync_task_reminders([task], due_date_changed=False)
+        
+        self.pipe.zadd.assert_called_once_with(REMINDER_SCHEDULE_KEY, {'overdue:5': due.timestamp()})
+        # A due_soon member not popped yet is left to fire
+        self.pipe.zrem.assert_not_called()
+    
+    def test_due_date_moved_into_the_past_drops_reminders(self):
+        """Test that moving the due date into the past removes its reminders instead of firing them."""
+        task = Task(id=5, title='Ship it', user_id=1, status='todo', due_date=timezone.now() - timedelta(days=1))
+        
+        sync_task_reminders([task])
+        
+        self.pipe.zadd.assert_not_called()
+        self.pipe.zrem.assert_called_once_with(REMINDER_SCHEDULE_KEY, 'due_soon:5', 'overdue:5')
+        self.pipe.hdel.assert_called_once_with(REMINDER_PAYLOAD_KEY, 5)
+    
+    def test_only_relevant_saves_sync(self):
+        """Test that saves not touching title, status or due date leave the index alone, and others keep sent reminders."""
+        task = Task.objects.create(title='Later', user_id=1, due_date=timezone.now() + timedelta(days=1))
+        task = Task.objects.get(pk=task.pk)
+        
+        with mock.patch('tasks.signals.sync_task_reminders') as sync:
+            with self.captureOnCommitCallbacks(execute=True):
+                task.description = 'More detail'
+                task.save()
+            sync.assert_not_called()
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                task.title = 'Renamed'
+                task.save()
+            sync.assert_called_once_with([task], False)
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                task.due_date += timedelta(days=1)
+                task.save()
+            self.assertEqual(sync.call_args.args, ([task], True))
+
+
+class TaskEventTest(MockRedisMixin, TestCase):
+    """Test cases for task events published to the notifications service."""
+    
+    def test_binary_encoding_is_versioned_and_compact(self):
+        """Test that binary events carry the schema header and beat JSON on size."""
+        data = {'id': 42, 'user_id': 7, 'title': 'Write report', 'task_title': 'Write report',
+                'due_date': '2026-01-31T12:00:00+00:00'}
+        
+        content_type, body = task_event_message('task_due_soon', data, encoding='binary')
+        json_type, json_body = task_event_message('task_due_soon', data, encoding='json')
+        
+        self.assertEqual(content_type, BINARY_CONTENT_TYPE)
+        self.assertEqual(json_type, JSON_CONTENT_TYPE)
+        self.assertEqual(HEADER.unpack_from(body), (b'TF', 1, 1))
+        self.assertLess(len(body), len(json_body) / 2)
+    
+    def published(self, connection):
+        channel = connection.return_value.channel.return_value
+        return [json.loads(c.kwargs['body']) for c in channel.basic_publish.call_args_list]
+    
+    @mock.patch('tasks.events.pika.BlockingConnection')
+    def test_events_published_after_commit(self, connection):
+        """Test that create and completion queue task_created and task_completed, and the relay sends them."""
+        with self.settings(TASK_EVENTS_ENABLED=True, TASK_EVENT_ENCODING='json', TASK_EVENT_RELAY_THREAD=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                task = Task.objects.create(title='Publish me', user_id=3)
+            with self.captureOnCommitCallbacks(execute=True):
+                task.status = 'done'
+                task.save()
+            
+            self.assertEqual(TaskEventOutbox.objects.count(), 2)
+            self.assertEqual(events.relay.drain(), 2)
+        
+        events_sent = self.published(connection)
+        self.assertEqual([event['type'] for event in events_sent], ['task_created', 'task_completed'])
+        self.assertEqual(events_sent[1]['data']['changes']['status'], ['todo', 'done'])
+        self.assertFalse(TaskEventOutbox.objects.exists())
+        connection.return_value.channel.return_value.confirm_delivery.assert_called_once()
+    
+    @mock.patch('tasks.events.pika.BlockingConnection')
+    def test_events_kept_while_broker_is_down(self, connection):
+        """Test that writes don't touch the broker and unpublished events stay in the outbox."""
+        connection.side_effect = pika.exceptions.AMQPConnectionError('down')
+        with self.settings(TASK_EVENTS_ENABLED=True, TASK_EVENT_RELAY_THREAD=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                Task.objects.create(title='Kept', user_id=3)
+            connection.assert_not_called()
+            
+            with self.assertRaises(pika.exceptions.AMQPError):
+                events.relay.drain()
+            self.assertEqual(TaskEventOutbox.objects.count(), 1)
+            
+            connection.side_effect = None
+            self.assertEqual(events.relay.drain(), 1)
+        self.assertEqual(len(connection.return_value.channel.return_value.basic_publish.call_args_list), 1)
+    
+    def test_rolled_back_write_has_no_event(self):
+        """Test that an event only exists if its change committed."""
+        with self.settings(TASK_EVENTS_ENABLED=True, TASK_EVENT_RELAY_THREAD=False):
+            with self.assertRaises(ZeroDivisionError), transaction.atomic():
+                Task.objects.create(title='Rolled back', user_id=3)
+                1 / 0
+        
+        self.assertFalse(TaskEventOutbox.objects.exists())
+    
+    def test_disabled_by_default(self):
+        """Test that nothing is queued unless TASK_EVENTS_ENABLED is set."""
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(title='Quiet', user_id=3)
+        
+        self.assertFalse(TaskEventOutbox.objects.exists())
+
+
+class TracingTest(MockRedisMixin, TestCase):
+    """Test cases for trace context propagation."""
+    
+    TRACEPARENT = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+    
+    def test_parse_traceparent(self):
+        """Test that valid headers parse and malformed ones are ignored."""
+        context = tracing.parse_traceparent(self.TRACEPARENT)
+        
+        self.assertEqual(context.trace_id, '4bf92f3577b34da6a3ce929d0e0e4736')
+        self.assertTrue(context.sampled)
+        self.assertIsNone(tracing.parse_traceparent('00-xyz'))
+        self.assertIsNone(tracing.parse_traceparent(None))
+    
+    @mock.patch.object(tracing.exporter, 'export')
+    @mock.patch('tasks.events.pika.BlockingConnection')
+    def test_event_carries_request_trace(self, connection, export):
+        """Test that a task event written in a traced request continues its trace when relayed."""
+        parent = tracing.parse_traceparent(self.TRACEPARENT)
+        
+        with self.settings(TASK_EVENTS_ENABLED=True, TASK_EVENT_RELAY_THREAD=False):
+            with tracing.start_span('http.request', parent=parent):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Task.objects.create(title='Traced', user_id=3)
+            events.relay.drain()
+        
+        channel = connection.return_value.channel.return_value
+        headers = channel.basic_publish.call_args.kwargs['properties'].headers
+        published = tracing.parse_traceparent(headers['traceparent'])
+        self.assertEqual(published.trace_id, parent.trace_id)
+        self.assertEqual([c.args[0].name for c in export.call_args_list],
+                         ['http.request', 'task_event.publish'])
+    
+    @mock.patch.object(tracing.exporter, 'export')
+    def test_caller_sampled_flag_is_not_trusted(self, export):
+        """Test that a request's own traceparent can't force its spans to be recorded."""
+        middleware = tracing.TracingMiddleware(lambda request: HttpResponse())
+        
+        with mock.patch.object(tracing.tracer, 'sample_rate', 0.0):
+            middleware(RequestFactory().get('/api/tasks/', HTTP_TRACEPARENT=self.TRACEPARENT))
+        
+        export.assert_not_called()
+    
+    def test_caller_sampled_flag_is_rate_limited(self):
+        """Test that callers' sampled flags are honoured up to TRACE_INCOMING_SAMPLED_LIMIT per second."""
+        tracer = tracing.Tracer(mock.Mock(), sample_rate=0.0, incoming_limit=1)
+        parent = tracing.parse_traceparent(self.TRACEPARENT)
+        
+        honoured, limited = tracer.incoming(parent), tracer.incoming(parent)
+        
+        self.assertTrue(honoured.sampled)
+        self.assertFalse(limited.sampled)
+        self.assertEqual(limited.trace_id, parent.trace_id)
+    
+    def test_exporter_writes_a_file_per_process_and_rotates(self):
+        """Test that the {pid} path is resolved at write time and full files are rotated."""
+        directory = tempfile.mkdtemp()
+        exporter = tracing.FileExporter('tasks', os.path.join(directory, 'tasks-{pid}.jsonl'),
+                                        batch_size=1, max_bytes=1, backup_count=1)
+        tracer = tracing.Tracer(exporter, sample_rate=1.0)
+        
+        with mock.patch('taskflow_common.tracing.os.getpid', return_value=4242):
+            for _ in range(3):
+                with tracer.start_span('job'):
+                    pass
+        
+        self.assertEqual(sorted(os.listdir(directory)), ['tasks-4242.jsonl', 'tasks-4242.jsonl.1'])
+        with open(os.path.join(directory, 'tasks-4242.jsonl')) as f:
+            self.assertEqual(json.loads(f.read())['service'], 'tasks')
+
+
+@override_settings(PROFILE_CAPTURE_RATE=1.0)
+class ProfilingMiddlewareTest(TestCase):
+    """Test cases for per-request profiling."""
+    
+    def setUp(self):
+        self.factory = RequestFactory()
+    
+    def view(self, request):
+        return HttpResponse(str(Task.objects.count()))
+    
+    def test_server_timing_counts_queries(self):
+        """Test that Server-Timing reports the queries the request ran."""
+        response = ProfilingMiddleware(self.view)(self.factory.get('/api/tasks/'))
+        
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="1 queries"')
+    
+    def test_server_timing_reports_serialize_time(self):
+        """Test that time spent building serializer data is reported apart from render."""
+        user = User.objects.create_user(username='profiled', password='pass')
+        Task.objects.create(title='Task', user_id=user.id)
+        
+        def slow_representation(task):
+            time.sleep(0.02)
+            return {}
+        
+        def view(request):
+            with mock.patch.object(TaskSerializer, 'to_representation', side_effect=slow_representation):
+                TaskSerializer(Task.objects.all(), many=True).data
+            return HttpResponse()
+        
+        response = ProfilingMiddleware(view)(self.factory.get('/api/tasks/'))
+        
+        serialize = re.search(r'serialize;dur=([\d.]+)', response['Server-Timing'])
+        self.assertGreaterEqual(float(serialize.group(1)), 20)
+        self.assertIn('render;dur=', response['Server-Timing'])
+    
+    @override_settings(PROFILE_CAPTURE_RATE=0.0)
+    def test_unsampled_requests_only_time_the_total(self):
+        """Test that requests not picked for capture skip the query wrapper."""
+        with mock.patch('taskflow_common.profiling.QueryStats') as stats:
+            response = ProfilingMiddleware(self.view)(self.factory.get('/api/tasks/'))
+        
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+$')
+        stats.assert_not_called()
+    
+    def test_signed_header_runs_profiler(self):
+        """Test that only signed X-Profile tokens start the profiler."""
+        profile_dir = tempfile.mkdtemp()
+        
+        with self.settings(PROFILE_DIR=profile_dir):
+            profiled = ProfilingMiddleware(self.view)(
+                self.factory.get('/api/tasks/', HTTP_X_PROFILE=make_profile_token())
+            )
+            forged = ProfilingMiddleware(self.view)(self.factory.get('/api/tasks/', HTTP_X_PROFILE='forged'))
+        
+        self.assertTrue(os.path.exists(os.path.join(profile_dir, profiled['X-Profile-Id'])))
+        self.assertNotIn('X-Profile-Id', forged)
+    
+    def test_slow_requests_are_logged(self):
+        """Test that requests over the threshold go to the slow-request log with their statements."""
+        with self.settings(SLOW_REQUEST_THRESHOLD_MS=0):
+            with self.assertLogs('slow_requests', level='WARNING') as logs:
+                ProfilingMiddleware(self.view)(self.factory.get('/api/tasks/'))
+        
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['queries'], 1)
+        self.assertIn('COUNT', entry['slowest'][0]['sql'])
+
+
+class WarmUpTest(TestCase):
+    def test_warm_up_does_not_query_database(self):
+        """Test that warm-up before forking workers never touches the database."""
+        with self.assertNumQueries(0):
+            warm_up()
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], REPLICA_MAX_LAG=2.0, REPLICA_LAG_CHECK_INTERVAL=5.0)
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse(ReplicaRouter().db_for_read(Task)))
+        replica_health.reset()
+        self.addCleanup(replica_health.reset)
+    
+    def route(self, method='get', **extra):
+        with mock.patch('tasks.routing.replication_lag', return_value=extra.pop('lag', 0.0)):
+            return self.middleware(getattr(self.factory, method)('/api/tasks/', **extra))
+    
+    def test_safe_requests_read_from_replica(self):
+        """Test that GET requests read from a healthy replica and set no pin."""
+        response = self.route()
+        
+        self.assertEqual(response.content, b'replica_0')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+    
+    def test_writes_pin_reads_to_primary(self):
+        """Test that a write uses the primary and pins the client's next reads there."""
+        response = self.route('post')
+        self.factory.cookies[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        
+        self.assertEqual(response.content, b'default')
+        self.assertEqual(self.route().content, b'default')
+    
+    def test_lagging_replica_is_skipped(self):
+        """Test that reads fall back to the primary when the replica is too far behind."""
+        self.assertEqual(self.route(lag=30.0).content, b'default')
+    
+    def test_reads_outside_requests_use_primary(self):
+        """Test that management commands and background jobs never read from replicas."""
+        self.assertEqual(ReplicaRouter().db_for_read(Task), 'default')
+
+
+class TaskVersionTest(MockRedisMixin, TestCase):
+    """Test cases for compare-and-swap task updates."""
+    
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.task = Task.objects.create(title='Draft', user_id=1)
+    
+    def patch(self, data, **extra):
+        view = views.TaskDetailView.as_view()
+        request = self.factory.patch(f'/api/tasks/{self.task.id}/', data, format='json', **extra)
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return view(request, pk=self.task.id)
+    
+    def test_matching_version_updates_and_bumps(self):
+        """Test that If-Match with the current version applies the update and returns the new ETag."""
+        response = self.patch({'title': 'Final'}, HTTP_IF_MATCH='"1"')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(response['ETag'], '"2"')
+    
+    def test_stale_version_returns_current_task(self):
+        """Test that a stale version in the body gets 409 with the current representation."""
+        Task.objects.get(id=self.task.id).save()
+        
+        response = self.patch({'title': 'Lost', 'version': 1})
+        
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['title'], 'Draft')
+        self.assertEqual(response.data['version'], 2)
+    
+    def test_concurrent_save_raises_conflict(self):
+        """Test that the second of two writers holding the same version is rejected."""
+        first, second = Task.objects.get(id=self.task.id), Task.objects.get(id=self.task.id)
+        first.title = 'First'
+        first.save()
+        second.title = 'Second'
+        
+        with self.assertRaises(VersionConflict):
+            second.save()
+        self.assertEqual(second.version, 1)
+    
+    def test_bulk_update_checks_versions(self):
+        """Test that bulk updates with stale versions change nothing and return 409."""
+        other = Task.objects.create(title='Other', user_id=1)
+        request = self.factory.post('/api/tasks/bulk-update/', {
+            'task_ids': [self.task.id, other.id],
+            'updates': {'priority': 'high'},
+            'versions': {str(self.task.id): 1, str(other.id): 7},
+        }, format='json')
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        
+        response = views.bulk_update_tasks(request)
+        
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Task.objects.filter(priority='high').exists())
+    
+    def test_bulk_update_rejects_malformed_versions(self):
+        """Test that versions must be an id->version object naming every task, or the request is a 400."""
+        other = Task.objects.create(title='Other', user_id=1)
+        for versions in ([1, 1], {'abc': 1}, {str(self.task.id): 'x'}, {str(self.task.id): 1}):
+            request = self.factory.post('/api/tasks/bulk-update/', {
+                'task_ids': [self.task.id, other.id],
+                'updates': {'priority': 'high'},
+                'versions': versions,
+            }, format='json')
+            request.user_id = 1
+            force_authenticate(request, user=mock.Mock(is_authenticated=True))
+            
+            response = views.bulk_update_tasks(request)
+            
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, versions)
+            self.assertIn('versions', response.data)
+        self.assertFalse(Task.objects.filter(priority='high').exists())
+
+
+class TaskParallelWritersTest(TransactionTestCase):
+    """Many threads incrementing the same task must not lose updates."""
+    
+    def test_no_lost_updates(self):
+        """Test that retrying on VersionConflict keeps every writer's change."""
+        writers, writes = 8, 10
+        with mock.patch('tasks.signals.transaction.on_commit'):
+            task = Task.objects.create(title='Counter', user_id=1)
+            conflicts = []
+            
+            def writer():
+                try:
+                    for _ in range(writes):
+                        while True:
+                            try:
+                                current = Task.objects.get(id=task.id)
+                                current.description += 'x'
+                                current.save()
+                                break
+                            except VersionConflict:
+                                conflicts.append(1)
+                            except OperationalError:
+                                # SQLite's shared-cache test database fails on lock contention instead of waiting
+                                pass
+                finally:
+                    connection.close()
+            
+            threads = [threading.Thread(target=writer) for _ in range(writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        task.refresh_from_db()
+        self.assertEqual(len(task.description), writers * writes)
+        self.assertEqual(task.version, 1 + writers * writes)
+
+
+class AdminChangelistTest(TestCase):
+    """Changelists must cost the same number of queries however many rows they show."""
+    
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+    
+    def add_rows(self, count):
+        tasks = Task.objects.bulk_create([Task(title=f'Task {i}', user_id=1) for i in range(count)])
+        TaskComment.objects.bulk_create([TaskComment(task=task, user_id=1, content='Hi') for task in tasks])
+        TaskAttachment.objects.bulk_create([
+            TaskAttachment(task=task, user_id=1, file_name='a.txt', file_path='/a.txt', file_size=1,
+                           mime_type='text/plain')
+            for task in tasks
+        ])
+    
+    def changelist_queries(self, model_name, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/admin/tasks/{model_name}/{query}')
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries.captured_queries]
+    
+    def assert_constant_queries(self, model_name, query=''):
+        self.add_rows(2)
+        few = self.changelist_queries(model_name, query)
+        self.add_rows(40)
+        many = self.changelist_queries(model_name, query)
+        
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(sum('COUNT(' in sql for sql in many), 1)
+        self.assertFalse([sql for sql in many if 'DISTINCT' in sql])
+    
+    def test_task_changelist(self):
+        """Test the task changelist, including a search and a date drill-down."""
+        self.assert_constant_queries('task')
+        self.assertEqual(len(self.changelist_queries('task', '?q=Task+1')),
+                         len(self.changelist_queries('task', f'?created_at__year={timezone.now().year}')))
+    
+    def test_comment_changelist(self):
+        """Test that comments load their task with a join, not one query per row."""
+        self.assert_constant_queries('taskcomment', '?q=1')
+    
+    def test_attachment_changelist(self):
+        """Test the attachment changelist with a file name prefix search."""
+        self.assert_constant_queries('taskattachment', '?q=a.t')
+    
+    def test_paginator_uses_large_estimates(self):
+        """Test that a large planner estimate replaces COUNT(*), and small ones are counted exactly."""
+        self.add_rows(3)
+        with mock.patch('tasks.pagination.estimated_count', return_value=5000000):
+            with self.assertNumQueries(0):
+                self.assertEqual(ApproximateCountPaginator(Task.objects.all(), 20).count, 5000000)
+        with mock.patch('tasks.pagination.estimated_count', return_value=10):
+            self.assertEqual(ApproximateCountPaginator(Task.objects.all(), 20).count, 3)
+
+
+class TaskExportTest(TestCase):
+    """Test cases for the streaming export."""
+    
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        Task.objects.bulk_create([
+            Task(title=f'Task {i}', user_id=1, status='done' if i % 2 else 'todo') for i in range(5)
+        ] + [Task(title='Someone else', user_id=2)])
+    
+    def export(self, **params):
+        request = self.factory.get('/api/tasks/export/', params)
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        response = views.TaskExportView.as_view()(request)
+        return response, list(response.streaming_content)
+    
+    def test_csv_respects_list_filters(self):
+        """Test that the export applies the list view's filters, search and ordering."""
+        with self.settings(TASK_EXPORT_CHUNK_SIZE=1):
+            response, chunks = self.export(status='done', ordering='created_at')
+        
+        rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual([row['title'] for row in rows], ['Task 1', 'Task 3'])
+        self.assertEqual(len(chunks), 2)  # One per chunk of rows
+    
+    def test_gzipped_ndjson(self):
+        """Test that NDJSON exports can be gzipped and decode to one task per line."""
+        response, chunks = self.export(export_format='ndjson', gzip='1', search='Task 4')
+        
+        lines = gzip.decompress(b''.join(chunks)).decode().splitlines()
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tasks.ndjson.gz"')
+        self.assertEqual([json.loads(line)['title'] for line in lines], ['Task 4'])
+    
+    def test_unknown_format(self):
+        """Test that unsupported formats are rejected."""
+        request = self.factory.get('/api/tasks/export/', {'export_format': 'xml'})
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        
+        self.assertEqual(views.TaskExportView.as_view()(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TaskImportTest(MockRedisMixin, TestCase):
+    """Test cases for the bulk import command."""
+    
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+    
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+    
+    def test_tasks_and_comments(self):
+        """Test that rows are validated, loaded with their timestamps and comments find their task."""
+        tasks = self.write('tasks.csv', (
+            'external_id,user_id,title,priority,status,created_at\n'
+            'a1,7,First,high,done,2020-01-02T03:04:05+00:00\n'
+            'a2,7,Second,,todo,\n'
+            'a3,7,Bad,whenever,todo,\n'
+        ))
+        comments = self.write('comments.ndjson', (
+            '{"task_external_id": "a1", "user_id": 8, "content": "Nice", "created_at": "2020-01-03T00:00:00"}\n'
+            '{"task_external_id": "missing", "user_id": 8, "content": "Lost"}\n'
+        ))
+        errors = os.path.join(self.dir, 'errors.ndjson')
+        out = io.StringIO()
+        
+        call_command('import_tasks', 'acme', tasks=tasks, comments=comments, errors=errors,
+                     stdout=out, stderr=io.StringIO())
+        
+        first = Task.objects.get(title='First')
+        self.assertEqual(first.created_at.year, 2020)
+        self.assertEqual(first.completed_at, first.created_at)
+        self.assertEqual(Task.objects.get(title='Second').priority, 'medium')
+        self.assertEqual(list(first.comments.values_list('content', flat=True)), ['Nice'])
+        with open(errors) as f:
+            rejected = [(row['kind'], row['line']) for row in map(json.loads, f)]
+        self.assertEqual(rejected, [('tasks', 3), ('comments', 2)])
+        self.assertIn('tasks: read 3, loaded 2, skipped 0, rejected 1', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+    
+    def test_resume_after_failure(self):
+        """Test that a rerun continues after the last committed batch without duplicating rows."""
+        tasks = self.write('tasks.ndjson', ''.join(
+            json.dumps({'external_id': str(i), 'user_id': 1, 'title': f'Task {i}'}) + '\n' for i in range(5)
+        ))
+        real_load = OrmLoader.load_tasks
+        calls = []
+        
+        def fail_second_batch(loader, records):
+            calls.append(len(records))
+            if len(calls) == 2:
+                raise OperationalError('connection lost')
+            return real_load(loader, records)
+        
+        with mock.patch.object(OrmLoader, 'load_tasks', fail_second_batch):
+            with self.assertRaises(OperationalError):
+                run_import('acme', 'tasks', tasks, batch_size=2)
+        self.assertEqual(Task.objects.count(), 2)
+        
+        result = run_import('acme', 'tasks', tasks, batch_size=2)
+        
+        self.assertEqual((result.resumed_from, result.read, result.loaded), (2, 3, 3))
+        self.assertEqual(Task.objects.count(), 5)
+        # A full rerun finds every row already imported
+        result = run_import('acme', 'tasks', tasks, batch_size=2, restart=True)
+        self.assertEqual((result.loaded, result.skipped), (0, 5))
+        self.assertEqual(Task.objects.count(), 5)
+
+
+class TaskRollupTest(MockRedisMixin, TestCase):
+    """Test cases for the incrementally maintained analytics rollups."""
+    
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+    
+    def stored(self):
+        return {
+            (row.user_id, row.day, row.status, row.priority): [row.created, row.completed, row.overdue]
+            for row in TaskRollup.objects.all()
+            if row.created or row.completed or row.overdue
+        }
+    
+    def assertRollupsMatchTasks(self):
+        self.assertEqual(self.stored(), dict(rollups.bucket_counts(Task.objects.all())))
+    
+    def test_writes_keep_rollups_in_step(self):
+        """Test that creates, saves, bulk updates and deletes adjust the counts incrementally."""
+        past_due = timezone.now() - timedelta(days=2)
+        task = Task.objects.create(title='Late', user_id=1, due_date=past_due)
+        other = Task.objects.create(title='Other', user_id=1, priority='low')
+        self.assertRollupsMatchTasks()
+        self.assertEqual(TaskRollup.objects.get(status='todo', priority='medium', day=past_due.date()).overdue, 1)
+        
+        task = Task.objects.get(pk=task.pk)
+        task.status = 'done'  # completed_at is set in save, after the due date
+        task.save()
+        self.assertRollupsMatchTasks()
+        
+        request = self.factory.post('/api/tasks/bulk-update/', {
+            'task_ids': [task.pk, other.pk], 'updates': {'priority': 'urgent'},
+        }, format='json')
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        views.bulk_update_tasks(request)
+        self.assertRollupsMatchTasks()
+        
+        Task.objects.get(pk=other.pk).delete()
+        self.assertRollupsMatchTasks()
+        self.assertEqual(TaskRollup.objects.filter(priority='low').exclude(created=0).count(), 0)
+    
+    def test_analytics_by_week(self):
+        """Test that the endpoint sums daily buckets into weeks from the rollups alone."""
+        for day in (5, 6, 13):  # 2024-02-05 and -06 share a week
+            task = Task.objects.create(title=f'Feb {day}', user_id=1)
+            Task.objects.filter(pk=task.pk).update(created_at=timezone.make_aware(datetime(2024, 2, day)))
+        call_command('backfill_rollups', chunk_users=1, stdout=io.StringIO())
+        
+        request = self.factory.get('/api/tasks/analytics/', {
+            'start': '2024-02-01', 'end': '2024-02-29', 'interval': 'week', 'group_by': 'status',
+        })
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        with self.assertNumQueries(1):
+            response = views.task_analytics(request)
+        
+        self.assertEqual(
+            [(str(bucket['period']), bucket['status'], bucket['created']) for bucket in response.data['buckets']],
+            [('2024-02-05', 'todo', 2), ('2024-02-12', 'todo', 1)],
+        )
+    
+    def test_backfill_rebuilds_from_tasks(self):
+        """Test that the backfill replaces whatever the rollups held with counts from the tasks."""
+        for user_id in (1, 2, 3):
+            Task.objects.create(title='Task', user_id=user_id, status='done')
+        TaskRollup.objects.update(created=99)
+        
+        call_command('backfill_rollups', chunk_users=2, stdout=io.StringIO())
+        
+        self.assertRollupsMatchTasks()
+
+
+class TaskArchiveTest(MockRedisMixin, TestCase):
+    """Test cases for archiving finished tasks."""
+    
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.old_done = Task.objects.create(title='Old done', user_id=1, status='done')
+        self.old_todo = Task.objects.create(title='Old todo', user_id=1)
+        self.recent_done = Task.objects.create(title='Recent done', user_id=1, status='done')
+        TaskComment.objects.create(task=self.old_done, user_id=1, content='Finished')
+        TaskAttachment.objects.create(task=self.old_done, user_id=1, file_name='report.pdf',
+                                      file_path='/files/report.pdf', file_size=10, mime_type='application/pdf')
+        long_ago = timezone.now() - timedelta(days=400)
+        Task.objects.filter(pk__in=[self.old_done.pk, self.old_todo.pk]).update(updated_at=long_ago)
+    
+    def get(self, view, path, params=None, **kwargs):
+        request = self.factory.get(path, params)
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return view(request, **kwargs)
+    
+    def test_moves_old_finished_tasks_with_children(self):
+        """Test that only old finished tasks move, with their comments and attachments, in batches."""
+        rollup_counts = list(TaskRollup.objects.values_list('created', 'completed', 'overdue'))
+        
+        with self.settings(TASK_ARCHIVE_AFTER_DAYS=365):
+            call_command('archive_tasks', batch_size=1, stdout=io.StringIO())
+        
+        self.assertEqual(set(Task.objects.values_list('title', flat=True)), {'Old todo', 'Recent done'})
+        archived = ArchivedTask.objects.get()
+        self.assertEqual((archived.pk, archived.title), (self.old_done.pk, 'Old done'))
+        self.assertEqual(list(archived.comments.values_list('content', flat=True)), ['Finished'])
+        self.assertEqual(archived.attachments.get().file_name, 'report.pdf')
+        self.assertFalse(TaskComment.objects.exists())
+        # History is kept
+        self.assertEqual(list(TaskRollup.objects.values_list('created', 'completed', 'overdue')), rollup_counts)
+    
+    def test_backfill_keeps_archived_history(self):
+        """Test that rebuilding the rollups after an archive pass still counts the archived tasks."""
+        Task.objects.filter(pk=self.old_done.pk).update(due_date=timezone.now() - timedelta(days=2))
+        call_command('backfill_rollups', stdout=io.StringIO())
+        rollup_counts = set(TaskRollup.objects.values_list('user_id', 'day', 'status', 'priority',
+                                                           'created', 'completed', 'overdue'))
+        
+        call_command('archive_tasks', older_than_days=365, stdout=io.StringIO())
+        call_command('backfill_rollups', stdout=io.StringIO())
+        
+        self.assertTrue(ArchivedTask.objects.exists())
+        self.assertEqual(set(TaskRollup.objects.values_list('user_id', 'day', 'status', 'priority',
+                                                            'created', 'completed', 'overdue')), rollup_counts)
+    
+    def test_reads_include_archived_on_request(self):
+        """Test that list, export and detail reads reach archived tasks only with include_archived."""
+        call_command('archive_tasks', older_than_days=365, stdout=io.StringIO())
+        list_view = views.TaskListCreateView.as_view()
+        
+        response = self.get(list_view, '/api/tasks/', {'status': 'done'})
+        self.assertEqual([task['title'] for task in response.data['results']], ['Recent done'])
+        response = self.get(list_view, '/api/tasks/', {'status': 'done', 'include_archived': '1',
+                                                       'ordering': 'created_at'})
+        self.assertEqual([task['title'] for task in response.data['results']], ['Old done', 'Recent done'])
+        self.assertEqual(response.data['count'], 2)
+        
+        response = self.get(views.TaskExportView.as_view(), '/api/tasks/export/', {'include_archived': 'true'})
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 3)
+        
+        detail = views.TaskDetailView.as_view()
+        path = f'/api/tasks/{self.old_done.pk}/'
+        self.assertEqual(self.get(detail, path, pk=self.old_done.pk).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.get(detail, path, {'include_archived': '1'}, pk=self.old_done.pk)
+        self.assertEqual(response.data['comments'][0]['content'], 'Finished')
+        
+        request = self.factory.patch(f'{path}?include_archived=1', {'title': 'Reopened'}, format='json')
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        self.assertEqual(detail(request, pk=self.old_done.pk).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TaskHierarchyTest(MockRedisMixin, TestCase):
+    """Test cases for subtasks, the closure table and dependencies."""
+    
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+    
+    def closure(self):
+        return set(TaskClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+    
+    def request(self, method, path, data=None):
+        request = getattr(self.factory, method)(path, data, format='json')
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return request
+    
+    def test_deep_chain_moves_keep_closure_exact(self):
+        """Test that saves maintain the closure incrementally through a 50-level chain and a move."""
+        chain = [Task.objects.create(title='Level 0', user_id=1)]
+        for level in range(1, 50):
+            chain.append(Task.objects.create(title=f'Level {level}', user_id=1, parent=chain[-1]))
+        other_root = Task.objects.create(title='Other root', user_id=1)
+        
+        self.assertEqual(hierarchy.subtree(chain[0].pk).count(), 49)
+        self.assertEqual(hierarchy.subtree(chain[0].pk).get(pk=chain[-1].pk).depth, 49)
+        self.assertEqual(hierarchy.subtree(chain[0].pk, max_depth=10).count(), 10)
+        
+        middle = Task.objects.get(pk=chain[25].pk)
+        middle.parent = other_root
+        middle.save()
+        incremental = self.closure()
+        hierarchy.rebuild_closure()
+        self.assertEqual(incremental, self.closure())
+        self.assertEqual(hierarchy.subtree(chain[0].pk).count(), 24)
+        self.assertEqual(hierarchy.subtree(other_root.pk).count(), 25)
+    
+    def test_parent_cycles_are_rejected(self):
+        """Test that a task can't be moved below itself, through the model or the API."""
+        root = Task.objects.create(title='Root', user_id=1)
+        child = Task.objects.create(title='Child', user_id=1, parent=root)
+        grandchild = Task.objects.create(title='Grandchild', user_id=1, parent=child)
+        someone_elses = Task.objects.create(title='Not mine', user_id=2)
+        
+        root = Task.objects.get(pk=root.pk)
+        root.parent = grandchild
+        with self.assertRaises(hierarchy.CycleError):
+            root.save()
+        self.assertIsNone(Task.objects.get(pk=root.pk).parent_id)
+        
+        detail = views.TaskDetailView.as_view()
+        for parent_id in (root.pk, grandchild.pk, someone_elses.pk):
+            response = detail(self.request('patch', f'/api/tasks/{root.pk}/', {'parent_id': parent_id}), pk=root.pk)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('parent_id', response.data)
+        
+        response = views.bulk_update_tasks(self.request('post', '/api/tasks/bulk-update/', {
+            'task_ids': [root.pk], 'updates': {'parent_id': grandchild.pk},
+        }))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.closure()), 3)
+    
+    def test_wide_tree_reads_are_single_queries(self):
+        """Test that listing, progress and blocked checks on 10k subtasks each take one query."""
+        root = Task.objects.create(title='Epic', user_id=1)
+        Task.objects.bulk_create([
+            Task(title=f'Step {i}', user_id=1, parent=root, status='done' if i % 10 < 7 else 'todo')
+            for i in range(10000)
+        ], batch_size=1000)
+        hierarchy.rebuild_closure()
+        blocker = Task.objects.create(title='Blocker', user_id=1)
+        hierarchy.add_dependency(root, blocker)
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(hierarchy.subtree(root.pk).count(), 10000)
+        with self.assertNumQueries(1):
+            progress = hierarchy.annotate_progress(Task.objects.filter(pk=root.pk)).get()
+        self.assertEqual((progress.subtasks_done, progress.subtasks_total, progress.blocked), (7000, 10000, True))
+        with self.assertNumQueries(1):
+            self.assertTrue(hierarchy.blocking(root.pk).exists())
+        
+        response = views.TaskSubtaskListView.as_view()(self.request('get', f'/api/tasks/{root.pk}/subtasks/'),
+                                                        pk=root.pk)
+        self.assertEqual(response.data['results'][0]['depth'], 1)
+        self.assertEqual(response.data['results'][0]['parent_id'], root.pk)
+    
+    def test_dependency_cycles_are_rejected(self):
+        """Test that a dependency closing a loop is refused and finished dependencies stop blocking."""
+        first, second, third = (Task.objects.create(title=title, user_id=1) for title in ('First', 'Second', 'Third'))
+        hierarchy.add_dependency(second, first)
+        hierarchy.add_dependency(third, second)
+        with self.assertRaises(hierarchy.CycleError):
+            hierarchy.add_dependency(first, third)
+        
+        path = f'/api/tasks/{first.pk}/dependencies/'
+        response = views.task_dependencies(self.request('post', path, {'depends_on': third.pk}), pk=first.pk)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(TaskDependency.objects.count(), 2)
+        
+        path = f'/api/tasks/{third.pk}/dependencies/'
+        self.assertTrue(views.task_dependencies(self.request('get', path), pk=third.pk).data['blocked'])
+        Task.objects.filter(pk=second.pk).update(status='done')
+        self.assertFalse(views.task_dependencies(self.request('get', path), pk=third.pk).data['blocked'])
+    
+    def test_archive_waits_for_subtasks(self):
+        """Test that a finished parent is only archived once its subtasks are gone."""
+        parent = Task.objects.create(title='Parent', user_id=1, status='done')
+        child = Task.objects.create(title='Child', user_id=1, parent=parent)
+        Task.objects.update(updated_at=timezone.now() - timedelta(days=400))
+        
+        call_command('archive_tasks', older_than_days=365, stdout=io.StringIO())
+        self.assertFalse(ArchivedTask.objects.exists())
+        
+        Task.objects.filter(pk=child.pk).update(status='done')
+        call_command('archive_tasks', older_than_days=365, stdout=io.StringIO())
+        call_command('archive_tasks', older_than_days=365, stdout=io.StringIO())
+        self.assertEqual(set(ArchivedTask.objects.values_list('id', 'parent_id')),
+                         {(child.pk, parent.pk), (parent.pk, None)})
+        self.assertFalse(TaskClosure.objects.exists())
+
+
+class TaskTagTest(MockRedisMixin, TestCase):
+    """Test cases for task tags, tag filters and tag counts."""
+    
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+    
+    def request(self, method, path, data=None):
+        request = getattr(self.factory, method)(path, data, format='json' if method != 'get' else None)
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return request
+    
+    def counts(self):
+        return dict(TaskTagCount.objects.filter(user_id=1, count__gt=0).values_list('tag', 'count'))
+    
+    def titles(self, params):
+        response = views.TaskListCreateView.as_view()(self.request('get', '/api/tasks/', params))
+        return sorted(task['title'] for task in response.data['results'])
+    
+    def test_writes_keep_tag_rows_and_counts_in_step(self):
+        """Test that creates, edits and deletes update the tag rows and per-user counts."""
+        response = views.TaskListCreateView.as_view()(self.request('post', '/api/tasks/', {
+            'title': 'Tagged', 'tags': [' Bug', 'ui', 'bug'],
+        }))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        task = Task.objects.get(title='Tagged')
+        self.assertEqual(task.tags, ['bug', 'ui'])
+        Task.objects.create(title='Other', user_id=1, tags=['bug'])
+        self.assertEqual(self.counts(), {'bug': 2, 'ui': 1})
+        
+        task.tags.remove('ui')
+        task.tags.append('backend')
+        task.save()
+        self.assertEqual(set(TaskTag.objects.filter(task=task).values_list('tag', flat=True)), {'bug', 'backend'})
+        self.assertEqual(self.counts(), {'bug': 2, 'backend': 1})
+        
+        task.delete()
+        self.assertEqual(self.counts(), {'bug': 1})
+        response = views.task_tags(self.request('get', '/api/tasks/tags/'))
+        self.assertEqual(response.data, [{'tag': 'bug', 'count': 1}])
+        
+        response = views.TaskListCreateView.as_view()(self.request('post', '/api/tasks/', {
+            'title': 'Bad tag', 'tags': ['a,b'],
+        }))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_all_and_any_filters(self):
+        """Test that tags requires every tag and tags_any at least one, archived tasks included on request."""
+        Task.objects.create(title='Both', user_id=1, tags=['bug', 'ui'])
+        Task.objects.create(title='Bug', user_id=1, tags=['bug'])
+        Task.objects.create(title='None', user_id=1)
+        Task.objects.create(title='Not mine', user_id=2, tags=['bug', 'ui'])
+        old = Task.objects.create(title='Archived', user_id=1, status='done', tags=['bug', 'ui'])
+        Task.objects.filter(pk=old.pk).update(updated_at=timezone.now() - timedelta(days=400))
+        call_command('archive_tasks', older_than_days=365, stdout=io.StringIO())
+        self.assertEqual(self.counts(), {'bug': 2, 'ui': 1})
+        
+        self.assertEqual(self.titles({'tags': 'bug,UI'}), ['Both'])
+        self.assertEqual(self.titles({'tags_any': 'ui,bug'}), ['Both', 'Bug'])
+        self.assertEqual(self.titles({'tags': 'bug', 'tags_any': 'missing'}), [])
+        self.assertEqual(self.titles({'tags': 'bug,ui', 'include_archived': '1'}), ['Archived', 'Both'])
+    
+    def test_filters_are_index_lookups(self):
+        """Test that each tag check is an index search, never a scan of the tag rows."""
+        for queryset in (tagging.filter_all(Task.objects.filter(user_id=1), ['bug', 'ui']),
+                         tagging.filter_any(Task.objects.filter(user_id=1), ['bug', 'ui'])):
+            plan = queryset.explain()
+            self.assertIn('SEARCH U0 USING', plan)
+            self.assertNotIn('SCAN U0', plan)
+
+
+class TaskPriorityRankTest(MockRedisMixin, TestCase):
+    """Test cases for the stored priority rank, priority ordering and cursor pages."""
+    
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+    
+    def list(self, params):
+        request = self.factory.get('/api/tasks/', params)
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return views.TaskListCreateView.as_view()(request)
+    
+    def test_rank_follows_priority(self):
+        """Test that saves, bulk updates and ordering use the rank rather than the name."""
+        for priority in ('urgent', 'low', 'high', 'medium'):
+            Task.objects.create(title=priority, user_id=1, priority=priority)
+        self.assertEqual([task['title'] for task in self.list({'ordering': 'priority'}).data['results']],
+                         ['low', 'medium', 'high', 'urgent'])
+        
+        task = Task.objects.get(title='low')
+        task.priority = 'urgent'
+        task.save(update_fields=['priority'])
+        self.assertEqual(Task.objects.get(pk=task.pk).priority_rank, Task.PRIORITY_RANKS['urgent'])
+        
+        request = self.factory.post('/api/tasks/bulk-update/', {
+            'task_ids': [task.pk], 'updates': {'priority': 'high'},
+        }, format='json')
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        views.bulk_update_tasks(request)
+        self.assertEqual(Task.objects.get(pk=task.pk).priority_rank, Task.PRIORITY_RANKS['high'])
+        
+        plan = Task.objects.filter(user_id=1).order_by('-priority_rank', '-id').explain()
+        self.assertIn('tasks_user_priority_rank', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+    
+    def test_bulk_update_rejects_read_only_fields(self):
+        """Test that bulk updates can't write priority_rank or other non-editable fields."""
+        task = Task.objects.create(title='Task', user_id=1, priority='low')
+        
+        for updates in ({'priority_rank': 3}, {'priority': 'high', 'priority_rank': 3}, {'created_at': '2020-01-01'}):
+            request = self.factory.post('/api/tasks/bulk-update/', {'task_ids': [task.pk], 'updates': updates},
+                                        format='json')
+            request.user_id = 1
+            force_authenticate(request, user=mock.Mock(is_authenticated=True))
+            response = views.bulk_update_tasks(request)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        task.refresh_from_db()
+        self.assertEqual((task.priority, task.priority_rank), ('low', Task.PRIORITY_RANKS['low']))
+    
+    def test_cursor_pages_cover_every_task_once(self):
+        """Test that cursor pages walk the whole priority ordering with one query per page."""
+        priorities = [priority for priority, _ in Task.PRIORITY_CHOICES]
+        Task.objects.bulk_create([
+            Task(title=f'Task {i}', user_id=1, priority=priorities[i % 4], priority_rank=i % 4) for i in range(45)
+        ])
+        expected = list(Task.objects.filter(user_id=1).order_by('-priority_rank', '-id').values_list('id', flat=True))
+        
+        seen, params = [], {'ordering': '-priority', 'cursor': ''}
+        while True:
+            with self.assertNumQueries(1):
+                response = self.list(params)
+            seen += [task['id'] for task in response.data['results']]
+            if not response.data['next']:
+                break
+            params = dict(parse_qsl(urlsplit(response.data['next']).query))
+        self.assertEqual(seen, expected)
+        
+        self.assertEqual(self.list({'cursor': 'bad'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.list({'cursor': '', 'ordering': 'due_date'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        
+        response = self.list({'cursor': '', 'ordering': 'priority,-created_at'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ordering', response.data)
+    
+    def test_cursor_pages_split_rows_within_one_millisecond(self):
+        """Test that cursor pages on the default ordering keep created_at's microseconds."""
+        Task.objects.bulk_create([Task(title=f'Task {i}', user_id=1) for i in range(45)])
+        base = timezone.make_aware(datetime(2024, 1, 1, 0, 0, 0, 100000))
+        for i, task_id in enumerate(Task.objects.filter(user_id=1).order_by('id').values_list('id', flat=True)):
+            # Out of id order, all inside the same millisecond
+            Task.objects.filter(pk=task_id).update(created_at=base + timedelta(microseconds=(i * 7) % 45 * 10))
+        expected = list(Task.objects.filter(user_id=1).order_by('-created_at', '-id').values_list('id', flat=True))
+        
+        seen, params = [], {'cursor': ''}
+        while True:
+            response = self.list(params)
+            seen += [task['id'] for task in response.data['results']]
+            if not response.data['next']:
+                break
+            params = dict(parse_qsl(urlsplit(response.data['next']).query))
+        self.assertEqual(seen, expected)
+    
+    def test_migration_backfills_in_batches(self):
+        """Test that the migration's backfill ranks existing rows across several batches."""
+        migration = importlib.import_module('tasks.migrations.0002_priority_rank')
+        for i, priority in enumerate(['urgent', 'low', 'high', 'medium', 'low']):
+            Task.objects.create(title=f'Task {i}', user_id=1, priority=priority)
+        Task.objects.update(priority_rank=1)
+        
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            migration.backfill_priority_rank(apps, mock.Mock(connection=connection))
+        
+        for task in Task.objects.all():
+            self.assertEqual(task.priority_rank, Task.PRIORITY_RANKS[task.priority])
+
+
+class TaskFacetsTest(MockRedisMixin, TestCase):
+    """Test cases for the facet counts endpoint and its cache."""
+    
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        # A dict standing in for Redis, enough for GET/SET/INCR
+        self.store = {}
+        self.redis.get.side_effect = self.store.get
+        self.redis.set.side_effect = lambda key, value, ex=None: self.store.__setitem__(key, value)
+        self.redis.pipeline.return_value.incr.side_effect = (
+            lambda key: self.store.__setitem__(key, int(self.store.get(key, 0)) + 1))
+        
+        past, future = timezone.now() - timedelta(days=1), timezone.now() + timedelta(days=1)
+        Task.objects.create(title='Late report', user_id=1, priority='high', due_date=past)
+        Task.objects.create(title='Report draft', user_id=1, priority='high', due_date=future, tags=['work'])
+        Task.objects.create(title='Done report', user_id=1, status='done', due_date=past, tags=['work'])
+        Task.objects.create(title='Groceries', user_id=1, priority='low')
+        Task.objects.create(title='Not mine', user_id=2, priority='high')
+    
+    def facets(self, params=None):
+        request = self.factory.get('/api/tasks/facets/', params)
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        return views.TaskFacetsView.as_view()(request).data
+    
+    def test_counts_follow_search_and_filters_in_one_query(self):
+        """Test that the counts cover exactly what the list shows, from one GROUP BY."""
+        with self.assertNumQueries(1):
+            data = self.facets({'search': 'report'})
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['status'], {'todo': 2, 'in_progress': 0, 'review': 0, 'done': 1, 'cancelled': 0})
+        self.assertEqual(data['priority'], {'low': 0, 'medium': 1, 'high': 2, 'urgent': 0})
+        self.assertEqual(data['overdue'], 1)
+        self.assertIn({'status': 'todo', 'priority': 'high', 'overdue': True, 'count': 1}, data['buckets'])
+        
+        data = self.facets({'tags': 'work', 'priority': 'high'})
+        self.assertEqual((data['total'], data['overdue']), (1, 0))
+    
+    def test_cached_until_the_users_tasks_change(self):
+        """Test that repeated queries are served from the cache and a write invalidates them."""
+        self.assertEqual(self.facets()['total'], 4)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.facets({'page': '2'})['total'], 4)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(title='New', user_id=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.facets()['total'], 5)
+        
+        request = self.factory.post('/api/tasks/bulk-update/', {
+            'task_ids': [Task.objects.get(title='New').pk], 'updates': {'status': 'done'},
+        }, format='json')
+        request.user_id = 1
+        force_authenticate(request, user=mock.Mock(is_authenticated=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            views.bulk_update_tasks(request)
+        self.assertEqual(self.facets()['status']['done'], 2)
+    
+    def test_counts_are_read_from_the_primary(self):
+        """Test that cached counts never come from a replica that may lag behind the last write."""
+        with mock.patch('tasks.routing.ReplicaRouter.db_for_read', return_value='replica'):
+            data = self.facets({'include_archived': '1'})
+        
+        self.assertEqual(data['total'], 4)
@@ -0,0 +1,37 @@
+"""
+Minimal W3C trace context tracing.
+
+The tracer and span format are shared with the notifications service
+(``taskflow_common.tracing``); this module configures them from settings
+and adds ``TracingMiddleware``, which starts a span per request and
+continues an incoming ``traceparent`` header. Task events written during
+the request carry the trace to the notifications worker.
+"""
+
+from django.conf import settings
+from taskflow_common.tracing import (  # noqa: F401
+    FileExporter, Span, SpanContext, Tracer, current_span, extract, inject, parse_traceparent,
+)
+
+exporter = FileExporter('tasks', settings.TRACE_EXPORT_PATH, max_bytes=settings.TRACE_EXPORT_MAX_BYTES,
+                        backup_count=settings.TRACE_EXPORT_BACKUP_COUNT)
+tracer = Tracer(exporter, settings.TRACE_SAMPLE_RATE, settings.TRACE_INCOMING_SAMPLED_LIMIT)
+start_span = tracer.start_span
+record_span = tracer.record_span
+
+
+class TracingMiddleware:
+    """Wrap each request in an ``http.request`` span."""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        # The caller's sampling decision is only honoured within TRACE_INCOMING_SAMPLED_LIMIT
+        parent = tracer.incoming(parse_traceparent(request.headers.get('traceparent')))
+        with start_span('http.request', parent=parent, method=request.method) as span:
+            response = self.get_response(request)
+            match = request.resolver_match
+            span.set('route', match.route if match else request.path)
+            span.set('status', response.status_code)
+        return response
@@ -5,7 +5,15 @@ urlpatterns = [
     path('', views.TaskListCreateView.as_view(), name='task-list-create'),
     path('<int:pk>/', views.TaskDetailView.as_view(), name='task-detail'),
     path('stats/', views.task_stats, name='task-stats'),
+    path('tags/', views.task_tags, name='task-tags'),
+    path('analytics/', views.task_analytics, name='task-analytics'),
+    path('facets/', views.TaskFacetsView.as_view(), name='task-facets'),
+    path('export/', views.TaskExportView.as_view(), name='task-export'),
     path('bulk-update/', views.bulk_update_tasks, name='bulk-update-tasks'),
+    path('<int:pk>/subtasks/', views.TaskSubtaskListView.as_view(), name='task-subtasks'),
+    path('<int:pk>/dependencies/', views.task_dependencies, name='task-dependencies'),
+    path('<int:pk>/dependencies/<int:depends_on>/', views.remove_task_dependency,
+         name='task-dependency-delete'),
     path('<int:task_id>/comments/', views.TaskCommentListCreateView.as_view(), name='task-comments'),
     path('<int:task_id>/attachments/', views.TaskAttachmentListCreateView.as_view(), name='task-attachments'),
 ]
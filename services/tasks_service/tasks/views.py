@@ -1,51 +1,285 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
 from rest_framework import generics, status, filters
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
-from .models import Task, TaskComment, TaskAttachment
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.db.models import F, Q, Sum
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+from . import export, facets, hierarchy, rollups, tagging
+from .filters import TaskFilterSet, TaskOrderingFilter
+from .models import (
+    ArchivedTask, Task, TaskComment, TaskAttachment, TaskDependency, TaskRollup, TaskTagCount, VersionConflict
+)
+from .pagination import KeysetPagination
+from .reminders import sync_task_reminders
 from .serializers import (
     TaskSerializer, TaskCreateSerializer, TaskUpdateSerializer,
-    TaskCommentSerializer, TaskAttachmentSerializer, TaskDetailSerializer
+    TaskCommentSerializer, TaskAttachmentSerializer, TaskDetailSerializer, SubtaskSerializer
 )
 
 
-class TaskListCreateView(generics.ListCreateAPIView):
-    """List and create tasks."""
+class TaskFilterMixin:
+    """The user's tasks with the list view's filters, search and ordering."""
     
-    serializer_class = TaskSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['status', 'priority']
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, TaskOrderingFilter]
+    filterset_class = TaskFilterSet
     search_fields = ['title', 'description']
     ordering_fields = ['created_at', 'updated_at', 'due_date', 'priority']
     ordering = ['-created_at']
     
+    def get_queryset(self):
+        user_id = self.request.user_id
+        return Task.objects.filter(user_id=user_id)
+    
+    def filter_table(self, queryset):
+        """Filters, search and ordering applied to one table, live or archived."""
+        return super().filter_queryset(queryset)
+    
+    def filter_queryset(self, queryset):
+        if not include_archived(self.request):
+            return self.filter_table(queryset)
+        # Same filters on both tables, combined with UNION ALL and ordered as requested
+        ordering = TaskOrderingFilter().get_ordering(self.request, queryset, self)
+        archived = ArchivedTask.objects.filter(user_id=self.request.user_id)
+        fields = [*export.FIELDS, 'priority_rank']  # For ?ordering=priority
+        live = self.filter_table(queryset).order_by().values(*fields)
+        archived = self.filter_table(archived).order_by().values(*fields)
+        return live.union(archived, all=True).order_by(*ordering)
+
+
+def include_archived(request):
+    """Whether a read asked for archived tasks too (``?include_archived=1``)."""
+    return request.query_params.get('include_archived') in ('1', 'true')
+
+
+class TaskListCreateView(TaskFilterMixin, generics.ListCreateAPIView):
+    """List and create tasks."""
+    
+    serializer_class = TaskSerializer
+    
+    @property
+    def paginator(self):
+        # ?cursor= (empty for the first page) switches to keyset pages
+        if not hasattr(self, '_paginator'):
+            if 'cursor' not in self.request.query_params:
+                self._paginator = self.pagination_class()
+            elif include_archived(self.request):
+                raise ValidationError({'cursor': 'Cursor pages are not available with include_archived'})
+            else:
+                self._paginator = KeysetPagination()
+        return self._paginator
+    
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return TaskCreateSerializer
         return TaskSerializer
     
-    def get_queryset(self):
-        user_id = self.request.user_id
-        return Task.objects.filter(user_id=user_id)
-    
     def perform_create(self, serializer):
-        serializer.save(user_id=self.request.user_id)
+        with parent_errors():
+            serializer.save(user_id=self.request.user_id)
+
+
+class TaskFacetsView(TaskFilterMixin, generics.GenericAPIView):
+    """
+    Counts for the list's filter chips: per status, priority and overdue, and per combination.
+    
+    Takes the list's search and filter parameters and counts the tasks the
+    list would show, with one GROUP BY (two with ``include_archived``).
+    Cached per user and query until the user's tasks next change, so the
+    counts are read from the primary: a lagging replica's counts would be
+    cached as current after the write that invalidated them.
+    """
+    
+    def get(self, request):
+        return Response(facets.cached(request.user_id, request.query_params, self.counts))
+    
+    def counts(self):
+        live = self.filter_table(self.get_queryset().using('default'))
+        if not include_archived(self.request):
+            return facets.counts(live)
+        archived = self.filter_table(ArchivedTask.objects.using('default').filter(user_id=self.request.user_id))
+        return facets.merge(facets.counts(live), facets.counts(archived))
+
+
+class TaskExportView(TaskFilterMixin, generics.GenericAPIView):
+    """Stream every matching task as CSV or NDJSON (``?export_format=``), optionally gzipped (``?gzip=1``)."""
+    
+    serializer_class = TaskSerializer
+    
+    def perform_content_negotiation(self, request, force=False):
+        # The export picks its own content type; renderers only matter for error responses
+        return super().perform_content_negotiation(request, force=True)
+    
+    def get(self, request):
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in export.FORMATS:
+            return Response(
+                {'error': f"export_format must be one of: {', '.join(export.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        # Rows are fetched while the response streams, after the middleware has
+        # returned; pick the database (replica or primary) for this request now
+        queryset = queryset.using(queryset.db)
+        return export.streaming_response(queryset, export_format, compress)
+
+
+def expected_version(request):
+    """The version a client last saw, from ``If-Match: "<version>"`` or a ``version`` field."""
+    if_match = request.headers.get('If-Match', '').strip()
+    if if_match and if_match != '*':
+        value = if_match.removeprefix('W/').strip('"')
+    else:
+        value = request.data.get('version') if hasattr(request.data, 'get') else None
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({'version': 'Expected an integer version'})
+
+
+def expected_versions(request, task_ids):
+    """A bulk update's ``{"<task_id>": version}`` map, which must name every task in ``task_ids``."""
+    versions = request.data.get('versions')
+    if versions is None:
+        return None
+    if not isinstance(versions, dict):
+        raise ValidationError({'versions': 'Expected an object mapping task ids to versions'})
+    try:
+        expected = {int(task_id): int(version) for task_id, version in versions.items()}
+        requested = {int(task_id) for task_id in task_ids}
+    except (TypeError, ValueError):
+        raise ValidationError({'versions': 'Expected integer task ids and versions'})
+    if expected.keys() != requested:
+        raise ValidationError({'versions': 'Expected a version for every task in task_ids'})
+    return expected
+
+
+@contextmanager
+def parent_errors():
+    """Report a rejected parent (``hierarchy.CycleError``) as a 400 on ``parent_id``."""
+    try:
+        yield
+    except hierarchy.CycleError as exc:
+        raise ValidationError({'parent_id': [str(exc)]})
+
+
+def conflict_response(task):
+    """409 with the task as it is now, so the client can merge and retry."""
+    return Response(TaskDetailSerializer(task).data, status=status.HTTP_409_CONFLICT,
+                    headers={'ETag': f'"{task.version}"'})
 
 
 class TaskDetailView(generics.RetrieveUpdateDestroyAPIView):
-    """Retrieve, update, or delete a task."""
+    """Retrieve, update, or delete a task.
+    
+    Updates are compare-and-swap: the write only applies if the task is still
+    at the version the client sent (If-Match or ``version``), or else at the
+    version loaded for this request. Otherwise the response is 409 with the
+    current task.
+    """
     
     serializer_class = TaskDetailSerializer
     
     def get_queryset(self):
         user_id = self.request.user_id
-        return Task.objects.filter(user_id=user_id)
+        return hierarchy.annotate_progress(Task.objects.filter(user_id=user_id))
+    
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Archived tasks can be read, never changed
+            if self.request.method != 'GET' or not include_archived(self.request):
+                raise
+            return get_object_or_404(ArchivedTask, pk=self.kwargs['pk'], user_id=self.request.user_id)
     
     def get_serializer_class(self):
         if self.request.method in ['PUT', 'PATCH']:
             return TaskUpdateSerializer
         return TaskDetailSerializer
+    
+    def update(self, request, *args, **kwargs):
+        try:
+            return super().update(request, *args, **kwargs)
+        except VersionConflict:
+            return conflict_response(self.get_object())
+    
+    def perform_update(self, serializer):
+        expected = expected_version(self.request)
+        if expected is not None and expected != serializer.instance.version:
+            raise VersionConflict()
+        with parent_errors():
+            serializer.save()
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        version = response.data.get('version') if isinstance(response.data, dict) else None
+        if version is not None and 'ETag' not in response:
+            response['ETag'] = f'"{version}"'
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class TaskSubtaskListView(generics.ListAPIView):
+    """All subtasks below a task (``?max_depth=`` to stop early), nearest first."""
+    
+    serializer_class = SubtaskSerializer
+    
+    def get_queryset(self):
+        task = get_object_or_404(Task, pk=self.kwargs['pk'], user_id=self.request.user_id)
+        max_depth = self.request.query_params.get('max_depth')
+        if max_depth is not None:
+            try:
+                max_depth = int(max_depth)
+            except ValueError:
+                raise ValidationError({'max_depth': 'Expected an integer'})
+        return hierarchy.subtree(task.pk, max_depth).order_by('depth', 'id')
+
+
+@api_view(['GET', 'POST'])
+def task_dependencies(request, pk):
+    """
+    The tasks a task depends on, or add one with ``{"depends_on": <task id>}``.
+    
+    A task is blocked while any of them is unfinished. A dependency that
+    would close a loop is rejected with a 400.
+    """
+    task = get_object_or_404(Task, pk=pk, user_id=request.user_id)
+    if request.method == 'POST':
+        try:
+            depends_on_id = int(request.data.get('depends_on'))
+        except (TypeError, ValueError):
+            raise ValidationError({'depends_on': 'Expected a task id'})
+        depends_on = get_object_or_404(Task, pk=depends_on_id, user_id=request.user_id)
+        try:
+            with transaction.atomic():
+                hierarchy.add_dependency(task, depends_on)
+        except hierarchy.CycleError as exc:
+            raise ValidationError({'depends_on': [str(exc)]})
+    
+    depends_on = list(Task.objects.filter(dependents__task_id=task.pk).order_by('id'))
+    return Response({
+        'blocked': any(other.status not in hierarchy.FINISHED_STATUSES for other in depends_on),
+        'depends_on': TaskSerializer(depends_on, many=True).data,
+    }, status=status.HTTP_201_CREATED if request.method == 'POST' else status.HTTP_200_OK)
+
+
+@api_view(['DELETE'])
+def remove_task_dependency(request, pk, depends_on):
+    """Remove a dependency of a task."""
+    task = get_object_or_404(Task, pk=pk, user_id=request.user_id)
+    deleted, _ = TaskDependency.objects.filter(task=task, depends_on_id=depends_on).delete()
+    if not deleted:
+        raise Http404
+    return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class TaskCommentListCreateView(generics.ListCreateAPIView):
@@ -103,6 +337,69 @@ def task_stats(request):
     return Response(stats)
 
 
+@api_view(['GET'])
+def task_tags(request):
+    """The user's tags with the number of live tasks carrying each, most used first."""
+    counts = (
+        TaskTagCount.objects.filter(user_id=request.user_id, count__gt=0)
+        .order_by('-count', 'tag')
+        .values('tag', 'count')
+    )
+    return Response(list(counts))
+
+
+def _date_param(request, name, default):
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected a date as YYYY-MM-DD'})
+
+
+@api_view(['GET'])
+def task_analytics(request):
+    """
+    Created, completed and overdue task counts per day or week.
+    
+    Answered from the daily rollups, so the cost depends on the length of the
+    range rather than on how many tasks the user has. Query parameters:
+    ``start``/``end`` (inclusive dates, default the last 30 days),
+    ``interval`` (``day`` or ``week``, weeks starting on Monday) and
+    ``group_by`` (``status`` or ``priority``, current values). A task is
+    counted as overdue on its due date unless it was cancelled or completed
+    by then. Periods without any counts are left out.
+    """
+    end = _date_param(request, 'end', timezone.localdate())
+    start = _date_param(request, 'start', end - timedelta(days=29))
+    if start > end:
+        raise ValidationError({'start': 'Must not be after end'})
+    interval = request.query_params.get('interval', 'day')
+    if interval not in ('day', 'week'):
+        raise ValidationError({'interval': "Expected 'day' or 'week'"})
+    group_by = request.query_params.get('group_by')
+    if group_by not in (None, 'status', 'priority'):
+        raise ValidationError({'group_by': "Expected 'status' or 'priority'"})
+    
+    period = TruncWeek('day') if interval == 'week' else F('day')
+    dims = ['period'] + ([group_by] if group_by else [])
+    buckets = (
+        TaskRollup.objects.filter(user_id=request.user_id, day__range=(start, end))
+        .annotate(period=period)
+        .values(*dims)
+        .annotate(**{metric: Sum(metric) for metric in rollups.METRICS})
+        .order_by(*dims)
+    )
+    return Response({
+        'start': start,
+        'end': end,
+        'interval': interval,
+        'group_by': group_by,
+        'buckets': list(buckets),
+    })
+
+
 @api_view(['POST'])
 def bulk_update_tasks(request):
     """Bulk update multiple tasks."""
@@ -114,6 +411,30 @@ def bulk_update_tasks(request):
             {'error': 'task_ids and updates are required'}, 
             status=status.HTTP_400_BAD_REQUEST
         )
+    read_only = {field.attname for field in Task._meta.concrete_fields if not field.editable} & updates.keys()
+    if read_only:
+        # priority_rank follows priority, and the timestamps are set by the model
+        return Response(
+            {'error': f"{', '.join(sorted(read_only))} cannot be updated"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if 'priority' in updates:
+        if updates['priority'] not in Task.PRIORITY_RANKS:
+            return Response(
+                {'error': f"priority must be one of: {', '.join(Task.PRIORITY_RANKS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        updates = {**updates, 'priority_rank': Task.PRIORITY_RANKS[updates['priority']]}
+    if {'parent', 'parent_id', 'tags'} & updates.keys():
+        # QuerySet.update() would bypass the cycle check, the closure and tag tables
+        return Response(
+            {'error': 'parent_id and tags cannot be bulk updated'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Optional {"<task_id>": version} map: all tasks must still be at those
+    # versions, checked in the same UPDATE that writes them
+    versions = expected_versions(request, task_ids)
     
     user_id = request.user_id
     tasks = Task.objects.filter(id__in=task_ids, user_id=user_id)
@@ -124,7 +445,41 @@ def bulk_update_tasks(request):
             status=status.HTTP_404_NOT_FOUND
         )
     
-    updated_count = tasks.update(**updates)
+    with transaction.atomic():
+        if versions is not None:
+            expected = Q(pk__in=[])
+            for task_id, version in versions.items():
+                expected |= Q(id=task_id, version=version)
+            tasks = tasks.filter(expected)
+        # QuerySet.update() skips Task.save, so move the rollup counts here
+        before = []
+        if set(rollups.STATE_FIELDS) & updates.keys():
+            before = list(tasks.select_for_update().values('id', *rollups.STATE_FIELDS))
+        updated_count = tasks.update(**{**updates, 'version': F('version') + 1})
+        # Every requested task must have matched, including ones missing or not the user's
+        conflict = versions is not None and updated_count != len(versions)
+        if conflict:
+            transaction.set_rollback(True)
+        elif before:
+            after = Task.objects.filter(id__in=[state['id'] for state in before]).values(*rollups.STATE_FIELDS)
+            rollups.apply(rollups.diff(before, after))
+    
+    if conflict:
+        current = Task.objects.filter(id__in=versions, user_id=user_id)
+        return Response(
+            {'error': 'Some tasks were changed by someone else',
+             'tasks': TaskSerializer(current, many=True).data},
+            status=status.HTTP_409_CONFLICT
+        )
+    
+    # QuerySet.update() skips post_save, so refresh the reminder index and facets here
+    transaction.on_commit(lambda: facets.invalidate([user_id]))
+    if 'due_date' in updates or 'status' in updates:
+        sync_task_reminders(
+            Task.objects.filter(id__in=task_ids, user_id=user_id)
+            .only('id', 'user_id', 'title', 'status', 'due_date'),
+            due_date_changed='due_date' in updates
+        )
     
     return Response({
         'message': f'Updated {updated_count} tasks',
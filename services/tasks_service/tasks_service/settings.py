@@ -33,6 +33,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tasks.tracing.TracingMiddleware',
+    'taskflow_common.profiling.ProfilingMiddleware',
+    'tasks.routing.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -65,12 +68,38 @@ TEMPLATES = [
 WSGI_APPLICATION = 'tasks_service.wsgi.application'
 
 # Database
+# Persistent connections: each gunicorn worker thread keeps its connection for
+# DB_CONN_MAX_AGE seconds and checks it is still usable before reusing it
 DATABASES = {
     'default': dj_database_url.config(
-        default=config('DATABASE_URL', default='sqlite:///db.sqlite3')
+        default=config('DATABASE_URL', default='sqlite:///db.sqlite3'),
+        conn_max_age=config('DB_CONN_MAX_AGE', default=60, cast=int),
+        conn_health_checks=True,
     )
 }
 
+# Read replicas, e.g. DATABASE_REPLICA_URLS=postgres://replica1/taskflow,postgres://replica2/taskflow.
+# Safe (GET/HEAD/OPTIONS) requests read from them, see tasks/routing.py. To try it
+# locally, point DATABASE_URL and DATABASE_REPLICA_URLS at two SQLite files.
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, config('DATABASE_REPLICA_URLS', default='').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(
+        url,
+        conn_max_age=config('DB_CONN_MAX_AGE', default=60, cast=int),
+        conn_health_checks=True,
+    )
+    # Tests run against the primary's test database only
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['tasks.routing.ReplicaRouter']
+# After a write, the client's reads stay on the primary this many seconds
+READ_YOUR_WRITES_WINDOW = config('READ_YOUR_WRITES_WINDOW', default=5, cast=int)
+# Replicas further behind than this are skipped until they catch up
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=2.0, cast=float)
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=5.0, cast=float)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -138,8 +167,50 @@ CACHES = {
     }
 }
 
+# Due-date reminders: how long before due_date a task_due_soon reminder fires
+TASK_DUE_SOON_LEAD = config('TASK_DUE_SOON_LEAD', default=86400, cast=int)
+
+# Task events for the notifications service
+RABBITMQ_URL = config('RABBITMQ_URL', default='amqp://localhost:5672')
+TASK_EVENTS_ENABLED = config('TASK_EVENTS_ENABLED', default=False, cast=bool)
+# 'binary' (compact, versioned) or 'json' for consumers that predate the binary schema
+TASK_EVENT_ENCODING = config('TASK_EVENT_ENCODING', default='binary')
+# Outbox relay: a thread per web process publishes committed events (turn off when
+# manage.py relay_task_events runs instead), in batches, polling this often in seconds
+TASK_EVENT_RELAY_THREAD = config('TASK_EVENT_RELAY_THREAD', default=True, cast=bool)
+TASK_EVENT_RELAY_BATCH_SIZE = config('TASK_EVENT_RELAY_BATCH_SIZE', default=100, cast=int)
+TASK_EVENT_RELAY_INTERVAL = config('TASK_EVENT_RELAY_INTERVAL', default=1.0, cast=float)
+TASK_EVENT_RELAY_MAX_BACKOFF = config('TASK_EVENT_RELAY_MAX_BACKOFF', default=30, cast=int)
+# Seconds of broker silence before the connection is dropped and reopened
+TASK_EVENT_HEARTBEAT = config('TASK_EVENT_HEARTBEAT', default=30, cast=int)
+
+# Task exports: rows fetched per round trip (server-side cursor on Postgres)
+TASK_EXPORT_CHUNK_SIZE = config('TASK_EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Bulk imports (manage.py import_tasks): rows validated and committed per batch
+TASK_IMPORT_BATCH_SIZE = config('TASK_IMPORT_BATCH_SIZE', default=5000, cast=int)
+
+# Archival (manage.py archive_tasks): done/cancelled tasks untouched this long move to
+# the archive tables, this many per transaction
+TASK_ARCHIVE_AFTER_DAYS = config('TASK_ARCHIVE_AFTER_DAYS', default=180, cast=int)
+TASK_ARCHIVE_BATCH_SIZE = config('TASK_ARCHIVE_BATCH_SIZE', default=500, cast=int)
+
+# Facet counts (/api/tasks/facets/): seconds a cached result may be served. Task writes
+# invalidate sooner; this bounds how late a task shows as overdue after its due date
+TASK_FACETS_CACHE_TTL = config('TASK_FACETS_CACHE_TTL', default=60, cast=int)
+
+# Tracing: fraction of requests traced end to end, and where this process writes its spans
+# (rotated at TRACE_EXPORT_MAX_BYTES, keeping TRACE_EXPORT_BACKUP_COUNT old files)
+TRACE_SAMPLE_RATE = config('TRACE_SAMPLE_RATE', default=0.0, cast=float)
+TRACE_EXPORT_PATH = config('TRACE_EXPORT_PATH', default='traces/tasks-{pid}.jsonl')
+TRACE_EXPORT_MAX_BYTES = config('TRACE_EXPORT_MAX_BYTES', default=50 * 1024 * 1024, cast=int)
+TRACE_EXPORT_BACKUP_COUNT = config('TRACE_EXPORT_BACKUP_COUNT', default=3, cast=int)
+# Requests per second per process whose caller-set traceparent sampled flag is honoured;
+# 0 ignores it and samples callers' traces at TRACE_SAMPLE_RATE like any other request
+TRACE_INCOMING_SAMPLED_LIMIT = config('TRACE_INCOMING_SAMPLED_LIMIT', default=0.0, cast=float)
+
 # Celery configuration
-CELERY_BROKER_URL = config('RABBITMQ_URL', default='amqp://localhost:5672')
+CELERY_BROKER_URL = RABBITMQ_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -148,3 +219,34 @@ CELERY_TIMEZONE = TIME_ZONE
 
 # External service URLs
 AUTH_SERVICE_URL = config('AUTH_SERVICE_URL', default='http://localhost:8001')
+
+# Request profiling: Server-Timing headers on every response, a rotating log of
+# slow requests, and a sampling profiler for requests with a signed X-Profile header
+# Fraction of requests whose queries, serialize and render time are captured too
+PROFILE_CAPTURE_RATE = config('PROFILE_CAPTURE_RATE', default=0.01, cast=float)
+SLOW_REQUEST_THRESHOLD_MS = config('SLOW_REQUEST_THRESHOLD_MS', default=500, cast=int)
+SLOW_REQUEST_LOG = config('SLOW_REQUEST_LOG', default=str(BASE_DIR / 'slow_requests.log'))
+PROFILE_DIR = config('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILE_SAMPLE_INTERVAL = config('PROFILE_SAMPLE_INTERVAL', default=0.001, cast=float)
+PROFILE_TOKEN_MAX_AGE = config('PROFILE_TOKEN_MAX_AGE', default=3600, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'slow_requests': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_REQUEST_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
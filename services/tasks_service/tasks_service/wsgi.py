@@ -9,3 +9,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tasks_service.settings')
 
 application = get_wsgi_application()
+
+from taskflow_common.warmup import warm_up  # noqa: E402  (needs the app registry loaded)
+
+warm_up()